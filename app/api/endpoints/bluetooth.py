@@ -1,16 +1,49 @@
 import asyncio
 from typing import List, Dict, Optional
-from fastapi import APIRouter, HTTPException, status
-from bleak import BleakScanner, BleakClient
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from bleak import BleakScanner
+import json
+import os
 import platform
 import subprocess
 import re
 from urllib.parse import unquote
 
+from app.services.ble_connections import ConnectionPoolFull, DeviceNotConnected, ble_connection_pool
+from app.services.ble_gatt import GattError, GattTransferError, WriteQueueFull, describe_services, gatt_writer
+from app.services.ble_notifications import NOTIFICATION_PARSERS, ble_notifications
+from app.services.bluetooth_discovery import DEVICE_TYPE_BLE, DEVICE_TYPE_BT, bluetooth_discovery
+
 router = APIRouter(prefix="/bluetooth", tags=["bluetooth"])
 
-# 存储当前连接的设备
-connected_devices: Dict[str, BleakClient] = {}
+# 传统蓝牙扫描命令（可指向模拟脚本用于离线调试，见 tool/fake_hcitool）
+HCITOOL_PATH = os.environ.get("BLUETOOTH_HCITOOL", "hcitool")
+# 传统蓝牙扫描命令的超时时间（秒）
+BT_SCAN_TIMEOUT = float(os.environ.get("BLUETOOTH_BT_SCAN_TIMEOUT", "30"))
+# 读取RSSI命令的超时时间（秒）
+BT_RSSI_TIMEOUT = 5.0
+# 发送数据默认写入的特征值（常见串口透传模块的特征值）
+DEFAULT_WRITE_CHARACTERISTIC = os.environ.get("BLUETOOTH_WRITE_CHARACTERISTIC", "0000ffe1-0000-1000-8000-00805f9b34fb")
+
+async def run_command(args: List[str], timeout: float, check: bool = True) -> str:
+    """
+    异步执行外部命令并返回标准输出，不阻塞事件循环；超时或请求被取消时结束子进程
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
+    return stdout.decode("utf-8", errors="replace")
 
 # 解析传统蓝牙扫描结果（跨平台适配）
 def parse_bt_scan_output(output: str) -> List[Dict]:
@@ -50,30 +83,18 @@ async def scan_bt_devices_real() -> List[Dict]:
         system = platform.system()
         if system == "Linux":
             # Linux使用hcitool扫描
-            result = subprocess.run(
-                ["hcitool", "scan", "--flush"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            # 补充获取RSSI（需要root权限）
-            rssi_result = subprocess.run(
-                ["hcitool", "rssi", "hci0"],
-                capture_output=True,
-                text=True
-            )
-            full_output = result.stdout + rssi_result.stdout
-            return parse_bt_scan_output(full_output)
+            output = await run_command([HCITOOL_PATH, "scan", "--flush"], BT_SCAN_TIMEOUT)
+            # 补充获取RSSI（需要root权限，失败时忽略）
+            try:
+                output += await run_command([HCITOOL_PATH, "rssi", "hci0"], BT_RSSI_TIMEOUT, check=False)
+            except (OSError, asyncio.TimeoutError):
+                pass
+            return parse_bt_scan_output(output)
             
         elif system == "Darwin":  # macOS
-            result = subprocess.run(
-                ["blueutil", "--inquiry", "5"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            output = await run_command(["blueutil", "--inquiry", "5"], BT_SCAN_TIMEOUT)
             devices = []
-            for line in result.stdout.split('\n'):
+            for line in output.split('\n'):
                 if line.strip() and "Address:" in line:
                     mac = line.split("Address:")[1].split()[0].strip()
                     name = line.split("Name:")[1].strip() if "Name:" in line else "Unknown"
@@ -87,13 +108,9 @@ async def scan_bt_devices_real() -> List[Dict]:
             return devices
             
         elif system == "Windows":
-            result = subprocess.run(
-                ["powershell", "Get-BluetoothDevice -Discoverable"],
-                capture_output=True,
-                text=True
-            )
+            output = await run_command(["powershell", "Get-BluetoothDevice -Discoverable"], BT_SCAN_TIMEOUT, check=False)
             devices = []
-            for line in result.stdout.split('\n'):
+            for line in output.split('\n'):
                 if "Address" in line and "Name" in line:
                     mac = line.split("Address:")[1].split()[0].strip()
                     name = line.split("Name:")[1].strip()
@@ -112,6 +129,13 @@ async def scan_bt_devices_real() -> List[Dict]:
                 detail=f"传统蓝牙扫描不支持 {system} 系统"
             )
             
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"传统蓝牙扫描超时（{BT_SCAN_TIMEOUT:g}秒）"
+        )
     except subprocess.CalledProcessError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -153,30 +177,24 @@ async def scan_ble_devices_real() -> List[Dict]:
             detail=f"BLE扫描失败: {str(e)}"
         )
 
+# 登记扫描方式，由设备发现服务在后台或按需调用
+bluetooth_discovery.register(DEVICE_TYPE_BLE, scan_ble_devices_real)
+bluetooth_discovery.register(DEVICE_TYPE_BT, scan_bt_devices_real)
+
 @router.get("/scan/ble", response_model=List[Dict])
-async def scan_ble_devices():
+async def scan_ble_devices(fresh: bool = Query(False, description="是否立即重新扫描，默认读取后台扫描结果")):
     """扫描真实BLE设备"""
-    return await scan_ble_devices_real()
+    return await bluetooth_discovery.get_devices(DEVICE_TYPE_BLE, fresh)
 
 @router.get("/scan/bt", response_model=List[Dict])
-async def scan_bt_devices():
+async def scan_bt_devices(fresh: bool = Query(False, description="是否立即重新扫描，默认读取后台扫描结果")):
     """扫描真实传统蓝牙设备"""
-    return await scan_bt_devices_real()
+    return await bluetooth_discovery.get_devices(DEVICE_TYPE_BT, fresh)
 
 @router.get("/scan/all", response_model=List[Dict])
-async def scan_all_devices():
-    """扫描所有真实蓝牙设备（BLE+传统蓝牙）"""
-    ble_devices = await scan_ble_devices_real()
-    bt_devices = await scan_bt_devices_real()
-    # 去重（避免同一设备被重复扫描）
-    all_devices = ble_devices + bt_devices
-    seen_macs = set()
-    unique_devices = []
-    for device in all_devices:
-        if device["mac"] not in seen_macs:
-            seen_macs.add(device["mac"])
-            unique_devices.append(device)
-    return unique_devices
+async def scan_all_devices(fresh: bool = Query(False, description="是否立即重新扫描，默认读取后台扫描结果")):
+    """扫描所有真实蓝牙设备（BLE+传统蓝牙，同一MAC只保留一条）"""
+    return await bluetooth_discovery.get_devices(fresh=fresh)
 
 @router.post("/connect/{device_id}")
 async def connect_device(device_id: str):
@@ -184,9 +202,21 @@ async def connect_device(device_id: str):
     # 解码URL编码的设备ID
     decoded_device_id = unquote(device_id)
     
-    # 先确认设备存在
-    all_devices = await scan_all_devices()
-    device = next((d for d in all_devices if d["id"] == decoded_device_id), None)
+    # 检查是否已连接（已连接的设备通常停止广播，不再出现在扫描结果中）
+    conn = ble_connection_pool.get(decoded_device_id)
+    if conn is not None and conn.is_connected:
+        conn.touch()
+        device = conn.info
+        return {
+            "message": f"已连接到 {device['name']}",
+            "device": device
+        }
+    
+    # 先确认设备存在（读取设备表，表中没有时再扫描一次BLE设备）
+    device = bluetooth_discovery.get(decoded_device_id)
+    if not device:
+        await bluetooth_discovery.get_devices(DEVICE_TYPE_BLE, fresh=True)
+        device = bluetooth_discovery.get(decoded_device_id)
     
     if not device:
         raise HTTPException(
@@ -200,21 +230,17 @@ async def connect_device(device_id: str):
             detail="目前仅支持BLE设备连接"
         )
     
-    # 检查是否已连接
-    if decoded_device_id in connected_devices:
-        return {
-            "message": f"已连接到 {device['name']}",
-            "device": device
-        }
-    
     try:
-        client = BleakClient(decoded_device_id)
-        await client.connect()
-        connected_devices[decoded_device_id] = client
+        conn = await ble_connection_pool.connect(decoded_device_id, device)
         return {
-            "message": f"成功连接到 {device['name']}",
-            "device": device
+            "message": f"成功连接到 {conn.info['name']}",
+            "device": conn.info
         }
+    except ConnectionPoolFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -227,65 +253,204 @@ async def disconnect_device(device_id: str):
     # 解码URL编码的设备ID
     decoded_device_id = unquote(device_id)
     
-    if decoded_device_id not in connected_devices:
+    try:
+        conn = await ble_connection_pool.disconnect(decoded_device_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"断开连接失败: {str(e)}"
+        )
+    
+    if conn is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"设备 {decoded_device_id} 未连接"
         )
     
+    return {
+        "message": f"成功断开与 {conn.info['name']} 的连接"
+    }
+
+@router.get("/connections", response_model=List[Dict])
+async def list_connections():
+    """列出连接池中的设备连接及其状态"""
+    return ble_connection_pool.list_connections()
+
+@router.get("/services/{device_id}", response_model=List[Dict])
+async def get_device_services(device_id: str):
+    """列出已连接设备的GATT服务和特征值"""
+    decoded_device_id = unquote(device_id)
     try:
-        client = connected_devices[decoded_device_id]
-        if client.is_connected:
-            await client.disconnect()
-        del connected_devices[decoded_device_id]
-        
-        # 获取设备名称
-        all_devices = await scan_all_devices()
-        device = next((d for d in all_devices if d["id"] == decoded_device_id), None)
-        device_name = device["name"] if device else "未知设备"
-        
-        return {
-            "message": f"成功断开与 {device_name} 的连接"
-        }
-    except Exception as e:
+        async with ble_connection_pool.acquire(decoded_device_id) as conn:
+            return describe_services(conn.client)
+    except DeviceNotConnected as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+
+async def write_to_device(device_id: str, characteristic: str, data: bytes, response: Optional[bool]) -> Dict:
+    """写入特征值，把发送过程中的错误转换为HTTP错误"""
+    if ble_connection_pool.get(device_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"设备 {device_id} 未连接"
+        )
+    try:
+        return await gatt_writer.write(device_id, characteristic, data, response)
+    except (DeviceNotConnected, WriteQueueFull) as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    except GattTransferError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"断开连接失败: {str(e)}"
+            detail=f"发送数据失败: {str(e)}"
+        )
+    except GattError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
         )
 
 @router.post("/send_data/{device_id}")
-async def send_data_to_device(device_id: str, data: Dict):
-    """向指定设备发送数据（仅支持BLE）"""
+async def send_data_to_device(
+    device_id: str,
+    data: Dict,
+    characteristic: str = Query(DEFAULT_WRITE_CHARACTERISTIC, description="写入的特征值UUID")
+):
+    """向指定设备发送数据（仅支持BLE），数据以JSON编码后写入特征值"""
     # 解码URL编码的设备ID
     decoded_device_id = unquote(device_id)
     
-    if decoded_device_id not in connected_devices:
+    data_bytes = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    result = await write_to_device(decoded_device_id, characteristic, data_bytes, None)
+    return {
+        "message": f"成功向设备发送数据",
+        "sent_data": data,
+        **result
+    }
+
+@router.post("/write/{device_id}")
+async def write_raw_data(
+    device_id: str,
+    request: Request,
+    characteristic: str = Query(DEFAULT_WRITE_CHARACTERISTIC, description="写入的特征值UUID"),
+    response: Optional[bool] = Query(None, description="是否使用有响应写入，默认自动选择（大块数据使用无响应写入）")
+):
+    """向设备写入请求体中的原始二进制数据（固件分片、配置文件等）"""
+    decoded_device_id = unquote(device_id)
+    data_bytes = await request.body()
+    if not data_bytes:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"设备 {decoded_device_id} 未连接"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请求体为空"
         )
-    
+    return await write_to_device(decoded_device_id, characteristic, data_bytes, response)
+
+@router.post("/notifications/{device_id}/subscribe")
+async def subscribe_notifications(
+    device_id: str,
+    characteristic: str = Query(DEFAULT_WRITE_CHARACTERISTIC, description="订阅的特征值UUID"),
+    parser: Optional[str] = Query(None, description=f"通知数据的解析方式: {', '.join(NOTIFICATION_PARSERS)}"),
+    forward_to: Optional[str] = Query(None, description="把解析出的读数写入该设备（devices表的device_id）的私有数据"),
+    metric: Optional[str] = Query(None, description="解析结果为单个数值时使用的读数名称，默认为特征值UUID")
+):
+    """订阅已连接设备的特征值通知，通过WebSocket接收"""
+    decoded_device_id = unquote(device_id)
     try:
-        client = connected_devices[decoded_device_id]
-        if not client.is_connected:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="设备连接已断开"
-            )
-        
-        # 注意：实际发送需要知道目标特征值UUID
-        # 这里仅作为示例，需要根据实际设备的GATT特征值修改
-        # 例如：await client.write_gatt_char("0000ffe1-0000-1000-8000-00805f9b34fb", data_bytes)
-        
-        # 模拟数据发送（实际应用中需要替换为真实的特征值写入）
-        data_bytes = str(data).encode('utf-8')
-        return {
-            "message": f"成功向设备发送数据",
-            "sent_data": data,
-            "bytes_sent": len(data_bytes)
-        }
+        subscription = await ble_notifications.subscribe(decoded_device_id, characteristic, parser, forward_to, metric)
+    except DeviceNotConnected as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except GattError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"发送数据失败: {str(e)}"
-        )
\ No newline at end of file
+            detail=f"订阅通知失败: {str(e)}"
+        )
+    return {
+        "message": f"已订阅特征值 {subscription['characteristic']} 的通知",
+        "subscription": subscription
+    }
+
+@router.post("/notifications/{device_id}/unsubscribe")
+async def unsubscribe_notifications(
+    device_id: str,
+    characteristic: str = Query(DEFAULT_WRITE_CHARACTERISTIC, description="取消订阅的特征值UUID")
+):
+    """取消特征值通知订阅"""
+    decoded_device_id = unquote(device_id)
+    if not await ble_notifications.unsubscribe(decoded_device_id, characteristic):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"设备 {decoded_device_id} 未订阅特征值 {characteristic}"
+        )
+    return {"message": f"已取消特征值 {characteristic} 的通知订阅"}
+
+@router.get("/notifications/{device_id}")
+async def get_notifications(device_id: str, limit: int = Query(50, ge=0, le=1000)):
+    """设备的通知订阅和最近收到的通知"""
+    decoded_device_id = unquote(device_id)
+    stream = ble_notifications.get_stream(decoded_device_id)
+    if stream is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"设备 {decoded_device_id} 没有通知数据，请先订阅通知"
+        )
+    return {
+        "subscriptions": ble_notifications.list_subscriptions(decoded_device_id),
+        "recent": stream.recent(limit),
+        "next_seq": stream.next_seq
+    }
+
+@router.websocket("/notifications/{device_id}/ws")
+async def notifications_websocket(websocket: WebSocket, device_id: str, backlog: int = 0):
+    """
+    通过WebSocket推送设备通知
+    每条消息携带一批通知；客户端消费过慢时跳过被覆盖的通知，dropped为跳过的条数
+    设备没有订阅过通知时拒绝连接；设备连接关闭后推送 disconnected 并结束
+    """
+    decoded_device_id = unquote(device_id)
+    stream = ble_notifications.get_stream(decoded_device_id)
+    if stream is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    cursor = max(stream.next_seq - max(backlog, 0), stream.oldest_seq)
+    receiver = None
+    waiter = None
+    try:
+        # 同时等待客户端消息（用于发现断开）和新通知
+        receiver = asyncio.ensure_future(websocket.receive())
+        while True:
+            entries, cursor, dropped = stream.read(cursor)
+            if entries or dropped:
+                await websocket.send_json({"type": "batch", "entries": entries, "dropped": dropped, "next_seq": cursor})
+                if any(entry["type"] == "disconnected" for entry in entries):
+                    await websocket.close()
+                    break
+                if not receiver.done():
+                    continue
+            else:
+                waiter = asyncio.ensure_future(stream.wait(cursor))
+                await asyncio.wait({receiver, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                if not waiter.done():
+                    waiter.cancel()
+            if receiver.done():
+                if receiver.result()["type"] == "websocket.disconnect":
+                    break
+                receiver = asyncio.ensure_future(websocket.receive())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in (receiver, waiter):
+            if task is not None:
+                task.cancel()
@@ -1,5 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File, Cookie
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File, Cookie, Query, status
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, FileResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 from sqlalchemy.orm import Session
@@ -7,22 +7,48 @@ from pathlib import Path
 import os
 import shutil
 import platform
+import hashlib
 import json
+import re
+import time
+import asyncio
+from typing import Any, Dict, Optional, Tuple
 from urllib.parse import unquote, quote
 
+import anyio
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
 # 直接从user_service导入authenticate_user函数
 from app.services.user_service import authenticate_user
 from app.database.database import get_db
+from app.schemas.cloud import UploadInit, UploadStatus, JobCreate, JobStatus
+from app.services.blob_store import blob_store, temp_path_for
+from app.services.cloud_state import cloud_state
+from app.services.directory_index import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SYSTEM_RESERVED, directory_cache
+from app.services.file_download import build_download_response, content_disposition
+from app.services.job_queue import FINISHED_STATES, Job, job_queue
+import app.services.file_jobs  # 登记文件操作任务类型（delete/copy/move/mkdir）
+from app.services.quota_service import QuotaExceeded, quota_service
+from app.services.search_index import MAX_SEARCH_LIMIT, search_index
+from app.services.thumbnail_service import DEFAULT_THUMBNAIL_SIZE, ThumbnailError, thumbnail_service
+from app.services.upload_service import DEFAULT_CHUNK_SIZE, UploadOffsetMismatch, upload_manager
+from app.services.zip_stream import stream_zip
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 
-# 默认云盘根目录
+# 默认云盘根目录，未设置挂载路径的用户各自使用其下以用户名命名的目录
 DEFAULT_CLOUD_ROOT = Path("cloud_storage")
 DEFAULT_CLOUD_ROOT.mkdir(exist_ok=True)
 
-# 存储用户挂载路径的字典（实际项目中应该存储在数据库中）
-user_mount_paths = {}
+# 用户挂载路径（保存在共享存储中，这里是本进程的读缓存，修改需调用 cloud_state.set_mount_path）
+user_mount_paths = cloud_state.mount_paths
+
+# 任务状态SSE连接空闲时发送保活注释的间隔（秒）
+SSE_KEEPALIVE_SECONDS = 15
+# 由其他worker进程执行的任务，SSE连接从共享存储轮询状态的间隔（秒）
+JOB_POLL_INTERVAL = 1.0
 
 def get_disk_partitions():
     """
@@ -44,8 +70,57 @@ def get_disk_partitions():
         
     return partitions
 
+async def get_cloud_user(cloud_session: Optional[str] = Cookie(None)) -> Optional[str]:
+    """
+    根据登录会话Cookie获取当前云盘用户，未登录或会话已过期时返回None
+    """
+    return await cloud_state.get_session_user(cloud_session)
+
+def _home_dirname(username: str) -> str:
+    """
+    用户默认目录的名称，用户名中不能用作文件名的字符替换为下划线（此时追加哈希避免重名）
+    """
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", username).strip(" .")
+    if name != username or not name:
+        name = f"{name or 'user'}-{hashlib.sha1(username.encode('utf-8')).hexdigest()[:8]}"
+    return name
+
+def _mount_path(cloud_user: str) -> Path:
+    """
+    用户的挂载路径：未设置时为默认云盘根目录下该用户自己的目录，
+    占用空间（配额）按挂载路径统计，使用默认路径的用户之间互不影响
+    """
+    mount_path = user_mount_paths.get(cloud_user)
+    if mount_path:
+        return Path(mount_path)
+    home = DEFAULT_CLOUD_ROOT / _home_dirname(cloud_user)
+    home.mkdir(exist_ok=True)
+    return home
+
+def _mount_root(cloud_user: str) -> str:
+    """
+    用户挂载路径的绝对路径，作为搜索索引的根目录
+    """
+    return str(_mount_path(cloud_user).resolve())
+
+def _resolve_user_path(cloud_user: str, path: str) -> Path:
+    """
+    解析相对于用户挂载路径的路径（URL编码），结果不在挂载路径之内时返回403
+    按路径组件判断是否在挂载路径之内，不能用字符串前缀比较：
+    默认用户目录彼此相邻，cloud_storage/al 是 cloud_storage/alice 的前缀
+    """
+    mount_path = _mount_path(cloud_user).resolve()
+    decoded_path = unquote(path) if path else ""
+    try:
+        full_path = (mount_path / decoded_path).resolve()
+    except (OSError, RuntimeError, ValueError):
+        raise HTTPException(status_code=403, detail="访问被拒绝")
+    if not full_path.is_relative_to(mount_path):
+        raise HTTPException(status_code=403, detail="访问被拒绝")
+    return full_path
+
 @router.get("/", response_class=HTMLResponse)
-async def cloud_dashboard(request: Request, cloud_user: str = Cookie(None)):
+async def cloud_dashboard(request: Request, cloud_user: Optional[str] = Depends(get_cloud_user)):
     """
     云盘页面
     """
@@ -72,69 +147,53 @@ async def cloud_login(
             "error": "用户名或密码错误"
         })
     
-    # 设置登录cookie
+    # 创建登录会话，Cookie中只保存会话令牌
+    token = await cloud_state.create_session(username)
     response = RedirectResponse(url="/api/v1/cloud/files", status_code=303)
-    response.set_cookie(key="cloud_user", value=username)
+    response.set_cookie(key="cloud_session", value=token, httponly=True, samesite="lax",
+                        max_age=cloud_state.session_ttl)
     return response
 
 @router.get("/files", response_class=HTMLResponse)
-async def list_files(request: Request, path: str = "", cloud_user: str = Cookie(None)):
+async def list_files(
+    request: Request,
+    path: str = "",
+    page: int = 1,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cloud_user: Optional[str] = Depends(get_cloud_user)
+):
     """
-    列出云盘文件
+    列出云盘文件（分页）
     """
     # 简单的身份验证检查
     if not cloud_user:
         return RedirectResponse(url="/api/v1/cloud/")
     
     # 获取用户的挂载路径
-    mount_path = user_mount_paths.get(cloud_user, DEFAULT_CLOUD_ROOT)
-    mount_path = Path(mount_path)
+    mount_path = _mount_path(cloud_user)
     
     # 解码路径参数
     decoded_path = unquote(path) if path else ""
     
-    # 构建完整路径
-    full_path = mount_path / decoded_path if decoded_path else mount_path
-    
-    # 检查路径是否在允许范围内（对于自定义路径，我们信任用户的选择）
-    try:
-        full_path = full_path.resolve()
-        if not cloud_user in user_mount_paths:  # 只对默认路径进行限制
-            if not str(full_path).startswith(str(mount_path.resolve())):
-                raise HTTPException(status_code=403, detail="访问被拒绝")
-    except Exception:
-        raise HTTPException(status_code=403, detail="访问被拒绝")
+    # 构建完整路径，并检查路径是否在挂载路径之内
+    full_path = _resolve_user_path(cloud_user, path)
     
     # 检查路径是否存在
     if not full_path.exists():
         raise HTTPException(status_code=404, detail="路径不存在")
     
+    # 挂载路径首次访问时在后台建立搜索索引
+    await search_index.ensure_root(_mount_root(cloud_user))
+    
     try:
-        # 获取当前目录下的所有文件和文件夹
-        items = []
-        # 系统保留文件/文件夹列表，需要过滤
-        system_reserved = ['$RECYCLE.BIN', 'System Volume Information', 'pagefile.sys', 'hiberfil.sys', 'swapfile.sys']
-        
-        for item in full_path.iterdir():
-            # 过滤系统保留文件
-            if item.name in system_reserved:
-                continue
-                
-            try:
-                stat = item.stat()
-                items.append({
-                    "name": item.name,
-                    "is_dir": item.is_dir(),
-                    "size": stat.st_size if item.is_file() else None,
-                    "modified": stat.st_mtime,
-                    "path": str(item.relative_to(mount_path)).replace("\\", "/")
-                })
-            except (PermissionError, OSError):
-                # 跳过无权限访问的文件
-                continue
-        
-        # 按名称排序，文件夹在前
-        items.sort(key=lambda x: (not x["is_dir"], x["name"].lower()))
+        # 获取当前页的文件和文件夹（目录列表有缓存，扫描在线程池中进行）
+        page = max(page, 1)
+        page_items, total = await directory_cache.list_page(str(full_path), (page - 1) * page_size, page_size)
+        items = [
+            {**item, "path": f"{decoded_path.strip('/')}/{item['name']}" if decoded_path.strip("/") else item["name"]}
+            for item in page_items
+        ]
+        total_pages = max((total + page_size - 1) // page_size, 1)
         
         # 构建面包屑导航路径
         breadcrumbs = []
@@ -147,13 +206,15 @@ async def list_files(request: Request, path: str = "", cloud_user: str = Cookie(
                 })
         
         # 获取父目录路径
-        parent_path = str(full_path.parent.relative_to(mount_path)).replace("\\", "/") if full_path != mount_path else ""
+        parent_path = decoded_path.rstrip("/").rpartition("/")[0] if decoded_path else ""
         
         # 获取系统磁盘分区
         disk_partitions = get_disk_partitions()
         
     except Exception as e:
         items = []
+        total = 0
+        total_pages = 1
         breadcrumbs = []
         parent_path = ""
         disk_partitions = get_disk_partitions()
@@ -166,14 +227,19 @@ async def list_files(request: Request, path: str = "", cloud_user: str = Cookie(
         "breadcrumbs": breadcrumbs,
         "parent_path": parent_path if parent_path != "." else "",
         "mount_path": str(mount_path),
-        "disk_partitions": disk_partitions
+        "disk_partitions": disk_partitions,
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "total_pages": total_pages,
+        "dedup_enabled": blob_store.enabled
     })
 
 @router.post("/set_mount_path")
 async def set_mount_path(
     request: Request,
     mount_path: str = Form(...),
-    cloud_user: str = Cookie(None)
+    cloud_user: Optional[str] = Depends(get_cloud_user)
 ):
     """
     设置用户挂载路径
@@ -181,17 +247,21 @@ async def set_mount_path(
     if not cloud_user:
         return RedirectResponse(url="/api/v1/cloud/")
     
-    # 检查路径是否存在
+    # 检查路径是否存在（慢速磁盘上的检查也不阻塞事件循环）
     path_obj = Path(mount_path)
-    if not path_obj.exists():
-        # 尝试创建路径
-        try:
-            path_obj.mkdir(parents=True, exist_ok=True)
-        except Exception:
-            return RedirectResponse(url="/api/v1/cloud/files?error=路径不存在且无法创建", status_code=303)
+    if not await anyio.Path(path_obj).exists():
+        # 路径不存在时在后台任务中创建，创建成功后再切换挂载路径
+        async def _mount_after_mkdir(job: Job):
+            if job.status == "succeeded":
+                await cloud_state.set_mount_path(cloud_user, mount_path)
+                await search_index.ensure_root(_mount_root(cloud_user))
+        
+        job = job_queue.submit("mkdir", cloud_user, {"path": str(path_obj)}, on_complete=_mount_after_mkdir)
+        return RedirectResponse(url=f"/api/v1/cloud/files?job={job.id}", status_code=303)
     
     # 保存用户的挂载路径
-    user_mount_paths[cloud_user] = mount_path
+    await cloud_state.set_mount_path(cloud_user, mount_path)
+    await search_index.ensure_root(_mount_root(cloud_user))
     
     return RedirectResponse(url="/api/v1/cloud/files", status_code=303)
 
@@ -205,12 +275,13 @@ async def validate_path(path: str = Form(...)):
     return JSONResponse(content={"exists": exists})
 
 @router.get("/logout")
-async def cloud_logout():
+async def cloud_logout(cloud_session: Optional[str] = Cookie(None)):
     """
     云盘登出
     """
+    await cloud_state.delete_session(cloud_session)
     response = RedirectResponse(url="/api/v1/cloud/")
-    response.delete_cookie("cloud_user")
+    response.delete_cookie("cloud_session")
     return response
 
 @router.post("/upload")
@@ -218,7 +289,7 @@ async def upload_file(
     request: Request, 
     files: list[UploadFile] = File(...), 
     path: str = Form(""), 
-    cloud_user: str = Cookie(None)
+    cloud_user: Optional[str] = Depends(get_cloud_user)
 ):
     """
     上传文件（支持多文件）
@@ -226,41 +297,53 @@ async def upload_file(
     if not cloud_user:
         return RedirectResponse(url="/api/v1/cloud/")
     
-    # 获取用户的挂载路径
-    mount_path = user_mount_paths.get(cloud_user, DEFAULT_CLOUD_ROOT)
-    mount_path = Path(mount_path)
-    
     # 解码路径参数
     decoded_path = unquote(path) if path else ""
     
-    # 构建完整路径
-    full_path = mount_path / decoded_path if decoded_path else mount_path
+    # 构建完整路径，并检查路径是否在挂载路径之内
+    full_path = _resolve_user_path(cloud_user, path)
     
-    # 检查路径是否在允许范围内
+    # 表单上传在进入这里之前已经接收完毕，只能按请求大小检查配额（分片上传在接收数据之前检查）
     try:
-        full_path = full_path.resolve()
-        # 对所有路径都进行限制，防止访问系统关键文件
-        if not str(full_path).startswith(str(mount_path.resolve())):
-            raise HTTPException(status_code=403, detail="访问被拒绝")
-    except Exception:
-        raise HTTPException(status_code=403, detail="访问被拒绝")
+        await quota_service.check(cloud_user, _mount_root(cloud_user), int(request.headers.get("content-length") or 0))
+    except QuotaExceeded:
+        for file in files:
+            await file.close()
+        return RedirectResponse(url=f"/api/v1/cloud/files?path={quote(decoded_path)}&error=文件上传失败：存储空间不足", status_code=303)
     
     try:
         # 确保目录存在
-        full_path.mkdir(parents=True, exist_ok=True)
+        await anyio.Path(full_path).mkdir(parents=True, exist_ok=True)
         
         # 处理所有上传的文件
+        saved_paths = [full_path]
         for file in files:
             try:
-                # 保存上传的文件
-                file_location = full_path / file.filename
-                with open(file_location, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
+                # 保存上传的文件（只取文件名部分，文件名中的路径不能指向目标目录之外）
+                file_location = full_path / Path(file.filename.replace("\\", "/")).name
+                if blob_store.enabled:
+                    # 去重存储：边接收边计算哈希，按内容保存
+                    await blob_store.save_stream(_read_upload(file), file_location)
+                else:
+                    # 分块读取并异步写入临时文件，避免同步复制大文件时阻塞事件循环；
+                    # 写完后原子替换同名文件，不会原地覆盖其内容（可能是共享inode的去重文件）
+                    temp_location = temp_path_for(file_location)
+                    try:
+                        async with await anyio.open_file(temp_location, "wb") as buffer:
+                            while chunk := await file.read(DEFAULT_CHUNK_SIZE):
+                                await buffer.write(chunk)
+                        await run_in_threadpool(os.replace, temp_location, file_location)
+                    except BaseException:
+                        await anyio.Path(temp_location).unlink(missing_ok=True)
+                        raise
+                saved_paths.append(file_location)
             except Exception as e:
                 # 记录单个文件上传失败，但继续处理其他文件
                 print(f"文件 {file.filename} 上传失败: {str(e)}")
             finally:
                 await file.close()  # 使用await关闭文件
+        directory_cache.invalidate(full_path)
+        await search_index.add_paths(_mount_root(cloud_user), *saved_paths)
     except (PermissionError, OSError) as e:
         # 处理权限错误和其他系统错误
         return RedirectResponse(url=f"/api/v1/cloud/files?path={quote(decoded_path)}&error=文件上传失败：权限不足或系统限制", status_code=303)
@@ -270,36 +353,260 @@ async def upload_file(
     # 重新加载文件列表
     return RedirectResponse(url=f"/api/v1/cloud/files?path={quote(decoded_path)}", status_code=303)
 
-@router.get("/download/{file_path:path}")
-async def download_file(file_path: str, cloud_user: str = Cookie(None)):
+async def _read_upload(file: UploadFile):
     """
-    下载文件
+    分块读取上传的文件
+    """
+    while chunk := await file.read(DEFAULT_CHUNK_SIZE):
+        yield chunk
+
+def _resolve_upload_dir(cloud_user: str, path: str) -> Path:
+    """
+    解析上传目标目录，限制在用户挂载路径之内
+    """
+    return _resolve_user_path(cloud_user, path)
+
+async def _check_upload_quota(cloud_user: str, target: Path, size: int, upload_id: Optional[str] = None) -> None:
+    """
+    上传前检查配额（覆盖同名文件时扣除原文件大小，upload_id 对应会话自身的预留不计入），不足时返回507
+    """
+    try:
+        replaced = (await anyio.Path(target).stat()).st_size if await anyio.Path(target).is_file() else 0
+        await quota_service.check(cloud_user, _mount_root(cloud_user), size, replaced, exclude_upload=upload_id)
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=507, detail=str(e))
+
+def _upload_offset_conflict(e: UploadOffsetMismatch) -> HTTPException:
+    """
+    偏移量冲突时返回409，并在响应头中告知服务器已接收的字节数
+    """
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=str(e),
+        headers={"Upload-Offset": str(e.offset)}
+    )
+
+@router.post("/uploads", response_model=UploadStatus, status_code=status.HTTP_201_CREATED)
+async def create_upload(upload_init: UploadInit, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    创建分片上传会话
+    之后按返回的offset逐片 PUT /uploads/{upload_id}?offset=...，全部上传后调用 /uploads/{upload_id}/complete
     """
     if not cloud_user:
         raise HTTPException(status_code=401, detail="未授权访问")
     
-    # 获取用户的挂载路径
-    mount_path = user_mount_paths.get(cloud_user, DEFAULT_CLOUD_ROOT)
-    mount_path = Path(mount_path)
+    target_dir = _resolve_upload_dir(cloud_user, upload_init.path)
+    root = _mount_root(cloud_user)
+    # 检查配额与创建会话（预留空间）在同一把锁内，并发创建的会话不会都通过检查
+    async with quota_service.lock(root):
+        await _check_upload_quota(cloud_user, target_dir / Path(upload_init.filename.replace("\\", "/")).name, upload_init.size)
+        try:
+            upload_status = await upload_manager.create(
+                cloud_user, target_dir, unquote(upload_init.path), upload_init.filename, upload_init.size,
+                upload_init.sha256, root=root
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    if upload_status["completed"]:
+        # 内容已存在，直接完成
+        directory_cache.invalidate(target_dir)
+        await search_index.add_paths(_mount_root(cloud_user), upload_status["file"])
+    return upload_status
+
+@router.get("/uploads/{upload_id}", response_model=UploadStatus)
+async def get_upload_status(upload_id: str, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    查询分片上传进度，断线后从返回的offset继续上传
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
     
-    # 解码路径参数
-    decoded_path = unquote(file_path)
+    upload_status = await upload_manager.get_status(upload_id, cloud_user)
+    if upload_status is None:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    return upload_status
+
+@router.put("/uploads/{upload_id}", response_model=UploadStatus)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="分片在文件中的起始偏移量"),
+    cloud_user: Optional[str] = Depends(get_cloud_user)
+):
+    """
+    上传一个分片，请求体为分片的原始字节
+    offset必须等于服务器已接收的字节数，否则返回409并在Upload-Offset响应头中给出正确的偏移量
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
     
-    # 构建完整路径
-    full_path = mount_path / decoded_path
+    try:
+        upload_status = await upload_manager.write_chunk(upload_id, cloud_user, offset, request.stream())
+    except UploadOffsetMismatch as e:
+        raise _upload_offset_conflict(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ClientDisconnect:
+        # 客户端断开时已写入的数据会保留，重新连接后查询进度即可续传
+        return await upload_manager.get_status(upload_id, cloud_user)
+    
+    if upload_status is None:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    return upload_status
+
+@router.post("/uploads/{upload_id}/complete", response_model=UploadStatus)
+async def complete_upload(upload_id: str, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    完成分片上传，把文件移动到目标目录
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    
+    # 上传期间可能有其他文件占用了空间，移入目标目录前再检查一次
+    pending = await upload_manager.get_status(upload_id, cloud_user)
+    if pending is not None:
+        target_dir = _resolve_upload_dir(cloud_user, pending["path"])
+        await _check_upload_quota(cloud_user, target_dir / pending["filename"], pending["size"], upload_id)
     
-    # 检查路径是否在允许范围内
     try:
-        full_path = full_path.resolve()
-        if not cloud_user in user_mount_paths:  # 只对默认路径进行限制
-            if not str(full_path).startswith(str(mount_path.resolve())):
-                raise HTTPException(status_code=403, detail="访问被拒绝")
-    except Exception:
-        raise HTTPException(status_code=403, detail="访问被拒绝")
+        upload_status = await upload_manager.complete(upload_id, cloud_user)
+    except UploadOffsetMismatch as e:
+        raise _upload_offset_conflict(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"保存文件失败: {str(e)}")
+    
+    if upload_status is None:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    directory_cache.invalidate(Path(upload_status["file"]).parent)
+    await search_index.add_paths(_mount_root(cloud_user), upload_status["file"])
+    return upload_status
+
+@router.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def abort_upload(upload_id: str, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    取消分片上传
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
     
-    if not full_path.exists() or full_path.is_dir():
+    if not await upload_manager.abort(upload_id, cloud_user):
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+
+@router.api_route("/dedup/blobs/{sha256}", methods=["GET", "HEAD"])
+async def check_blob(sha256: str, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    查询内容是否已存在（去重存储），存在时创建上传会话时带上sha256即可秒传
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    if not blob_store.enabled:
+        raise HTTPException(status_code=404, detail="未开启去重存储")
+    
+    blob = await blob_store.lookup(sha256.lower())
+    if blob is None:
+        raise HTTPException(status_code=404, detail="内容不存在")
+    return {"sha256": blob["sha256"], "size": blob["size"]}
+
+@router.get("/dedup/stats")
+async def dedup_stats(cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    去重存储统计：blob数量、实际占用与节省的空间
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    return await blob_store.stats()
+
+@router.get("/usage")
+async def get_usage(cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    当前挂载路径的占用空间和配额（读取增量维护的汇总，不遍历目录）
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    
+    root = _mount_root(cloud_user)
+    await search_index.ensure_root(root)
+    return await quota_service.get_usage(cloud_user, root)
+
+@router.get("/search")
+async def search_files(
+    q: str = Query(..., min_length=1, description="搜索关键词，多个关键词用空格分隔"),
+    limit: int = Query(50, ge=1, le=MAX_SEARCH_LIMIT),
+    cloud_user: Optional[str] = Depends(get_cloud_user)
+):
+    """
+    按文件名/路径搜索当前挂载路径下的文件
+    indexing为true表示索引仍在建立中，结果可能不完整
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    
+    root = _mount_root(cloud_user)
+    await search_index.ensure_root(root)
+    started = time.perf_counter()
+    items = await search_index.search(root, q, limit)
+    return {
+        "items": items,
+        "indexing": search_index.is_indexing(root),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+def _zip_response(paths: list[Path], filename: str) -> StreamingResponse:
+    """
+    流式ZIP响应，生成器在线程池中迭代，第一个文件的数据读出后立即开始发送
+    """
+    return StreamingResponse(
+        stream_zip(paths),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(filename)}
+    )
+
+@router.get("/archive")
+async def download_archive(
+    paths: list[str] = Query(..., description="要打包的文件或文件夹，可重复传入多个"),
+    name: str = Query("download", description="压缩包名称（不含扩展名）"),
+    cloud_user: Optional[str] = Depends(get_cloud_user)
+):
+    """
+    把多个文件/文件夹打包为ZIP流式下载
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    
+    selected = []
+    for path in paths:
+        full_path = _resolve_user_path(cloud_user, path)
+        if not full_path.exists():
+            raise HTTPException(status_code=404, detail=f"文件未找到: {path}")
+        selected.append(full_path)
+    
+    return _zip_response(selected, f"{Path(name).name or 'download'}.zip")
+
+@router.api_route("/download/{file_path:path}", methods=["GET", "HEAD"])
+async def download_file(request: Request, file_path: str, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    下载文件
+    支持Range断点续传（含多区间）、If-Range，以及基于ETag/Last-Modified的条件请求（304）
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    
+    # 解码路径参数
+    decoded_path = unquote(file_path)
+    
+    # 构建完整路径，并检查路径是否在挂载路径之内
+    full_path = _resolve_user_path(cloud_user, file_path)
+    
+    if not full_path.exists():
         raise HTTPException(status_code=404, detail="文件未找到")
     
+    # 文件夹以ZIP格式流式打包下载
+    if full_path.is_dir():
+        return _zip_response([full_path], f"{full_path.name or 'cloud'}.zip")
+    
     # 检查是否为系统保留文件
     system_reserved = ['pagefile.sys', 'hiberfil.sys', 'swapfile.sys']
     if full_path.name in system_reserved:
@@ -307,42 +614,219 @@ async def download_file(file_path: str, cloud_user: str = Cookie(None)):
     
     filename = full_path.name
     try:
-        return FileResponse(path=full_path, filename=filename)
+        return await build_download_response(request, str(full_path), filename)
     except PermissionError:
         raise HTTPException(status_code=403, detail="没有权限访问此文件")
     except Exception as e:
         raise HTTPException(status_code=500, detail="文件下载失败")
 
+@router.get("/thumbnail/{file_path:path}")
+async def get_thumbnail(
+    request: Request,
+    file_path: str,
+    size: int = Query(DEFAULT_THUMBNAIL_SIZE, ge=16, le=4096, description="缩略图长边像素"),
+    cloud_user: Optional[str] = Depends(get_cloud_user)
+):
+    """
+    获取图片缩略图（或PDF首页预览）
+    缩略图随原文件的修改时间和大小变化，浏览器可缓存一天，之后用ETag确认
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    
+    full_path = _resolve_user_path(cloud_user, file_path)
+    
+    try:
+        stat_result = await anyio.Path(full_path).stat()
+    except OSError:
+        raise HTTPException(status_code=404, detail="文件未找到")
+    if not full_path.is_file():
+        raise HTTPException(status_code=404, detail="文件未找到")
+    if thumbnail_service.kind_of(full_path) is None:
+        raise HTTPException(status_code=415, detail="不支持预览的文件类型")
+    
+    # 缓存键在原文件不变时保持不变，浏览器缓存有效时无需生成或读取缩略图
+    etag = f'"{thumbnail_service.cache_key(full_path, stat_result, thumbnail_service.normalize_size(size))}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        cached, _ = await thumbnail_service.get_thumbnail(full_path, stat_result, size)
+    except ThumbnailError:
+        raise HTTPException(status_code=415, detail="无法生成缩略图")
+    return FileResponse(cached, media_type=thumbnail_service.media_type, headers=headers)
+
+async def _after_file_job(cloud_user: str, kind: str, source: Path, destination: Path = None) -> None:
+    """
+    文件操作后刷新目录缓存、搜索索引和去重存储的路径映射
+    """
+    root = _mount_root(cloud_user)
+    if kind in ("delete", "move"):
+        directory_cache.invalidate_tree(source)
+        await search_index.remove_path(root, source)
+    if kind == "delete":
+        await blob_store.release(source)
+    elif kind == "move":
+        await blob_store.move(source, destination)
+    elif kind == "mkdir":
+        directory_cache.invalidate(source.parent)
+        await search_index.add_paths(root, source)
+    if destination is not None:
+        directory_cache.invalidate_tree(destination)
+        if await anyio.Path(destination).is_dir():
+            # 整个文件夹的内容交给后台扫描补充
+            search_index.request_scan(root)
+        else:
+            await search_index.add_paths(root, destination)
+
+def _submit_file_job(cloud_user: str, kind: str, source: Path, destination: Path = None) -> Job:
+    """
+    提交后台文件操作任务，结束后（包括失败和取消）刷新缓存
+    """
+    params = {"path": str(source)} if destination is None else {"source": str(source), "destination": str(destination)}
+    
+    async def _on_complete(job: Job):
+        await _after_file_job(cloud_user, kind, source, destination)
+    
+    return job_queue.submit(kind, cloud_user, params, on_complete=_on_complete)
+
+@router.post("/jobs", response_model=JobStatus, status_code=status.HTTP_202_ACCEPTED)
+async def create_job(job_create: JobCreate, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    提交后台文件操作（删除/复制/移动/创建目录），立即返回任务ID
+    之后通过 GET /jobs/{job_id} 轮询，或 GET /jobs/{job_id}/events 订阅状态变化
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    
+    source = _resolve_user_path(cloud_user, job_create.path)
+    if source == Path(_mount_root(cloud_user)) and job_create.kind != "mkdir":
+        raise HTTPException(status_code=400, detail="不能操作挂载根目录")
+    if source.name in SYSTEM_RESERVED:
+        raise HTTPException(status_code=403, detail="无法操作系统保留文件或文件夹")
+    
+    destination = None
+    if job_create.kind in ("copy", "move"):
+        if not job_create.destination:
+            raise HTTPException(status_code=400, detail="复制/移动需要指定目标路径")
+        destination = _resolve_user_path(cloud_user, job_create.destination)
+        if await anyio.Path(destination).exists():
+            raise HTTPException(status_code=409, detail="目标已存在")
+    if job_create.kind != "mkdir" and not await anyio.Path(source).exists():
+        raise HTTPException(status_code=404, detail="文件未找到")
+    
+    return _submit_file_job(cloud_user, job_create.kind, source, destination).to_dict()
+
+@router.get("/jobs", response_model=list[JobStatus])
+async def list_jobs(cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    当前用户的后台任务（最新的在前）
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    # 本进程的任务状态最新，其他worker进程执行的任务从共享存储读取
+    jobs = {job.id: job.to_dict() for job in job_queue.list_jobs(cloud_user)}
+    for job in await cloud_state.list_jobs(cloud_user):
+        jobs.setdefault(job["id"], job)
+    return sorted(jobs.values(), key=lambda job: job["created_at"], reverse=True)
+
+async def _get_user_job(job_id: str, cloud_user: str) -> Tuple[Optional[Job], Dict[str, Any]]:
+    """
+    返回 (本进程的任务, 任务状态)；任务由其他worker进程执行时第一项为None，状态来自共享存储
+    """
+    if not cloud_user:
+        raise HTTPException(status_code=401, detail="未授权访问")
+    job = job_queue.get(job_id, cloud_user)
+    if job is not None:
+        return job, job.to_dict()
+    snapshot = await cloud_state.get_job(job_id, cloud_user)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return None, snapshot
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    查询后台任务状态和进度
+    """
+    _, snapshot = await _get_user_job(job_id, cloud_user)
+    return snapshot
+
+@router.delete("/jobs/{job_id}", response_model=JobStatus)
+async def cancel_job(job_id: str, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    取消后台任务，执行中的任务在处理下一个文件前停止
+    """
+    job, snapshot = await _get_user_job(job_id, cloud_user)
+    if job is not None:
+        if not job_queue.cancel(job):
+            raise HTTPException(status_code=409, detail="任务已结束")
+        return job.to_dict()
+    # 由其他worker进程执行的任务：记录取消请求，执行任务的进程同步状态时取消
+    if snapshot["status"] in FINISHED_STATES or not await cloud_state.request_job_cancel(job_id):
+        raise HTTPException(status_code=409, detail="任务已结束")
+    return snapshot
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request, cloud_user: Optional[str] = Depends(get_cloud_user)):
+    """
+    通过Server-Sent Events推送任务状态，任务结束后关闭连接
+    """
+    job, snapshot = await _get_user_job(job_id, cloud_user)
+    
+    async def remote_event_stream():
+        # 任务由其他worker进程执行，轮询共享存储中的状态快照
+        nonlocal snapshot
+        sent, last_sent = None, time.monotonic()
+        while not await request.is_disconnected():
+            if snapshot is None:
+                break
+            if snapshot != sent:
+                sent, last_sent = snapshot, time.monotonic()
+                yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+                if snapshot["status"] in FINISHED_STATES:
+                    break
+            elif time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            snapshot = await cloud_state.get_job(job_id, cloud_user)
+    
+    async def event_stream():
+        version = -1
+        while not await request.is_disconnected():
+            if job.version > version:
+                version = job.version
+                yield f"data: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                if job.finished:
+                    break
+            elif not await job.wait_changed(version, SSE_KEEPALIVE_SECONDS):
+                yield ": keepalive\n\n"
+    
+    return StreamingResponse(
+        event_stream() if job is not None else remote_event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/delete/{file_path:path}")
-async def delete_file(request: Request, file_path: str, cloud_user: str = Cookie(None)):
+async def delete_file(request: Request, file_path: str, cloud_user: Optional[str] = Depends(get_cloud_user)):
     """
     删除文件或文件夹
     """
     if not cloud_user:
         return RedirectResponse(url="/api/v1/cloud/")
     
-    # 获取用户的挂载路径
-    mount_path = user_mount_paths.get(cloud_user, DEFAULT_CLOUD_ROOT)
-    mount_path = Path(mount_path)
-    
     # 解码路径参数
     decoded_path = unquote(file_path)
     
-    # 构建完整路径
-    full_path = mount_path / decoded_path
-    
-    # 检查路径是否在允许范围内
-    try:
-        full_path = full_path.resolve()
-        if not cloud_user in user_mount_paths:  # 只对默认路径进行限制
-            if not str(full_path).startswith(str(mount_path.resolve())):
-                raise HTTPException(status_code=403, detail="访问被拒绝")
-    except Exception:
-        raise HTTPException(status_code=403, detail="访问被拒绝")
+    # 构建完整路径，并检查路径是否在挂载路径之内
+    full_path = _resolve_user_path(cloud_user, file_path)
     
     # 获取父目录用于重定向
-    parent_dir = str(full_path.parent.relative_to(mount_path)).replace("\\", "/")
-    redirect_path = parent_dir if parent_dir != "." else ""
+    redirect_path = decoded_path.strip("/").rpartition("/")[0]
     
     try:
         if full_path.exists():
@@ -353,8 +837,13 @@ async def delete_file(request: Request, file_path: str, cloud_user: str = Cookie
                 
             if full_path.is_file():
                 full_path.unlink()
+                await _after_file_job(cloud_user, "delete", full_path)
             else:
-                shutil.rmtree(full_path)
+                # 文件夹在后台任务中删除，页面根据任务ID显示进度
+                job = _submit_file_job(cloud_user, "delete", full_path)
+                return RedirectResponse(
+                    url=f"/api/v1/cloud/files?path={quote(redirect_path)}&job={job.id}", status_code=303
+                )
     except PermissionError:
         return RedirectResponse(url=f"/api/v1/cloud/files?path={quote(redirect_path)}&error=删除失败：权限不足", status_code=303)
     except OSError as e:
@@ -373,7 +862,7 @@ async def create_folder(
     request: Request,
     folder_name: str = Form(...),
     path: str = Form(""), 
-    cloud_user: str = Cookie(None)
+    cloud_user: Optional[str] = Depends(get_cloud_user)
 ):
     """
     创建文件夹
@@ -382,28 +871,18 @@ async def create_folder(
         return RedirectResponse(url="/api/v1/cloud/")
     
     # 获取用户的挂载路径
-    mount_path = user_mount_paths.get(cloud_user, DEFAULT_CLOUD_ROOT)
-    mount_path = Path(mount_path)
-    
     # 解码路径参数
     decoded_path = unquote(path) if path else ""
     
-    # 构建完整路径
-    full_path = mount_path / decoded_path if decoded_path else mount_path
-    
-    # 检查路径是否在允许范围内
-    try:
-        full_path = full_path.resolve()
-        if not cloud_user in user_mount_paths:  # 只对默认路径进行限制
-            if not str(full_path).startswith(str(mount_path.resolve())):
-                raise HTTPException(status_code=403, detail="访问被拒绝")
-    except Exception:
-        raise HTTPException(status_code=403, detail="访问被拒绝")
+    # 构建完整路径，并检查路径是否在挂载路径之内
+    full_path = _resolve_user_path(cloud_user, path)
     
     try:
         # 创建新文件夹
         new_folder_path = full_path / folder_name
         new_folder_path.mkdir(exist_ok=True)
+        directory_cache.invalidate(full_path)
+        await search_index.add_paths(_mount_root(cloud_user), new_folder_path)
     except PermissionError:
         return RedirectResponse(url=f"/api/v1/cloud/files?path={quote(decoded_path)}&error=创建文件夹失败：权限不足", status_code=303)
     except OSError as e:
@@ -1,29 +1,46 @@
 # 设备相关的API端点
 
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+import asyncio
+import json
+from typing import List, Optional, Dict, Any
+from datetime import datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.database import get_db
+from app.database.database import get_async_db, AsyncSessionLocal
 from app.schemas.device import (
     DeviceTypeCreate, DeviceTypeUpdate, DeviceTypeResponse,
-    DeviceCreate, DeviceUpdate, DeviceResponse, DeviceStatusUpdate
+    DeviceCreate, DeviceUpdate, DeviceResponse, DeviceStatusUpdate,
+    DeviceHeartbeatBatch, DeviceBulkCreate, DeviceBulkUpdate, DeviceBulkDelete, DeviceBulkResponse,
+    JsonPatchOperation, DevicePrivateDataPatchResult
 )
-from app.services.device_service import DeviceService, DeviceTypeService
+from app.services.device_service import DeviceVersionConflict, get_cache_stats
+from app.services.json_patch import JSON_PATCH_MEDIA_TYPE, JsonPatchConflict
+from app.services.async_device_service import AsyncDeviceService, AsyncDeviceTypeService
+from app.schemas.telemetry import TelemetryBatch, TelemetrySeries
+from app.services.heartbeat_service import HeartbeatBufferFull, heartbeat_buffer
+from app.services.device_events import device_event_hub
+from app.services.telemetry_service import ROLLUP_BUCKET_SECONDS
+from app.services.pagination import MAX_PAGE_LIMIT, set_next_cursor
 
 router = APIRouter(prefix="/api/v1", tags=["devices"])
 
+# SSE连接空闲时发送保活注释的间隔（秒）
+SSE_KEEPALIVE_SECONDS = 15
+
 # 设备类型相关端点
 @router.post("/device-type", response_model=DeviceTypeResponse, status_code=status.HTTP_201_CREATED)
-def create_device_type(
+async def create_device_type(
     device_type_data: DeviceTypeCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     创建设备类型
     """
     # 检查设备类型名称是否已存在
-    existing_type = DeviceTypeService.get_device_type_by_name(db, device_type_data.name)
+    existing_type = await AsyncDeviceTypeService.get_device_type_by_name(db, device_type_data.name)
     if existing_type:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -31,8 +48,8 @@ def create_device_type(
         )
     
     try:
-        device_type = DeviceTypeService.create_device_type(db, device_type_data)
-        return device_type.to_dict()
+        device_type = await AsyncDeviceTypeService.create_device_type(db, device_type_data)
+        return device_type
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -40,50 +57,58 @@ def create_device_type(
         )
 
 @router.get("/device-type", response_model=List[DeviceTypeResponse])
-def get_device_types(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+async def get_device_types(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_LIMIT),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    获取设备类型列表
+    获取设备类型列表（游标分页，下一页游标在响应头X-Next-Cursor中返回）
     """
-    device_types = DeviceTypeService.get_device_types(db, skip=skip, limit=limit)
-    return [device_type.to_dict() for device_type in device_types]
+    try:
+        device_types, next_cursor = await AsyncDeviceTypeService.get_device_types(db, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    set_next_cursor(response, next_cursor)
+    return device_types
 
 @router.get("/device-type/{device_type_id}", response_model=DeviceTypeResponse)
-def get_device_type(
+async def get_device_type(
     device_type_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     根据ID获取设备类型详情
     """
-    device_type = DeviceTypeService.get_device_type(db, device_type_id)
+    device_type = await AsyncDeviceTypeService.get_device_type(db, device_type_id)
     if not device_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"设备类型ID {device_type_id} 不存在"
         )
-    return device_type.to_dict()
+    return device_type
 
 @router.put("/device-type/{device_type_id}", response_model=DeviceTypeResponse)
-def update_device_type(
+async def update_device_type(
     device_type_id: int,
     device_type_data: DeviceTypeUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     更新设备类型
     """
     try:
-        device_type = DeviceTypeService.update_device_type(db, device_type_id, device_type_data)
+        device_type = await AsyncDeviceTypeService.update_device_type(db, device_type_id, device_type_data)
         if not device_type:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"设备类型ID {device_type_id} 不存在"
             )
-        return device_type.to_dict()
+        return device_type
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -91,15 +116,15 @@ def update_device_type(
         )
 
 @router.delete("/device-type/{device_type_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_device_type(
+async def delete_device_type(
     device_type_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     删除设备类型
     """
     try:
-        success = DeviceTypeService.delete_device_type(db, device_type_id)
+        success = await AsyncDeviceTypeService.delete_device_type(db, device_type_id)
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -118,15 +143,15 @@ def delete_device_type(
 
 # 设备相关端点
 @router.post("/device", response_model=DeviceResponse, status_code=status.HTTP_201_CREATED)
-def create_device(
+async def create_device(
     device_data: DeviceCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     创建设备
     """
     # 检查设备ID是否已存在
-    existing_device = DeviceService.get_device_by_device_id(db, device_data.device_id)
+    existing_device = await AsyncDeviceService.get_device_by_device_id(db, device_data.device_id)
     if existing_device:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -134,8 +159,8 @@ def create_device(
         )
     
     try:
-        device = DeviceService.create_device(db, device_data)
-        return device.to_dict()
+        device = await AsyncDeviceService.create_device(db, device_data)
+        return device
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -148,70 +173,144 @@ def create_device(
         )
 
 @router.get("/device", response_model=List[DeviceResponse])
-def get_devices(
-    skip: int = 0,
-    limit: int = 100,
+async def get_devices(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_LIMIT),
     device_type_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    获取设备列表，可选择按设备类型筛选
+    获取设备列表（游标分页，下一页游标在响应头X-Next-Cursor中返回），可选择按设备类型筛选
     """
-    if device_type_id:
-        devices = DeviceService.get_devices_by_type(db, device_type_id)
-    else:
-        devices = DeviceService.get_devices(db, skip=skip, limit=limit)
-    return [device.to_dict() for device in devices]
+    try:
+        # 序列化时通过设备类型映射填充嵌套的设备类型，避免逐个设备惰性加载（N+1查询）
+        devices, next_cursor = await AsyncDeviceService.get_devices(
+            db, cursor=cursor, limit=limit, device_type_id=device_type_id
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    set_next_cursor(response, next_cursor)
+    return devices
+
+# 批量设备端点（需声明在 /device/{device_id} 之前，避免被路径参数匹配）
+def _bulk_response(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    汇总批量操作的逐项结果
+    """
+    succeeded = sum(1 for result in results if result["success"])
+    return {
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
+
+@router.post("/device/bulk", response_model=DeviceBulkResponse)
+async def bulk_create_devices(
+    bulk_data: DeviceBulkCreate,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    批量创建设备，返回逐项结果
+    """
+    try:
+        results = await AsyncDeviceService.bulk_create_devices(db, bulk_data.devices)
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量创建设备失败: {str(e)}"
+        )
+    return _bulk_response(results)
+
+@router.put("/device/bulk", response_model=DeviceBulkResponse)
+async def bulk_update_devices(
+    bulk_data: DeviceBulkUpdate,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    批量更新设备，返回逐项结果
+    """
+    try:
+        results = await AsyncDeviceService.bulk_update_devices(db, bulk_data.devices)
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量更新设备失败: {str(e)}"
+        )
+    return _bulk_response(results)
+
+@router.delete("/device/bulk", response_model=DeviceBulkResponse)
+async def bulk_delete_devices(
+    bulk_data: DeviceBulkDelete,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    批量删除设备，返回逐项结果
+    """
+    try:
+        results = await AsyncDeviceService.bulk_delete_devices(db, bulk_data.ids)
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量删除设备失败: {str(e)}"
+        )
+    return _bulk_response(results)
 
 @router.get("/device/{device_id}", response_model=DeviceResponse)
-def get_device(
+async def get_device(
     device_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     根据ID获取设备详情
     """
-    device = DeviceService.get_device(db, device_id)
+    device = await AsyncDeviceService.get_device(db, device_id)
     if not device:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"设备ID {device_id} 不存在"
         )
-    return device.to_dict()
+    return device
 
 @router.get("/device/by-device-id/{device_unique_id}", response_model=DeviceResponse)
-def get_device_by_device_id(
+async def get_device_by_device_id(
     device_unique_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     根据设备唯一标识符获取设备详情
     """
-    device = DeviceService.get_device_by_device_id(db, device_unique_id)
+    device = await AsyncDeviceService.get_device_by_device_id(db, device_unique_id)
     if not device:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"设备唯一标识符 '{device_unique_id}' 不存在"
         )
-    return device.to_dict()
+    return device
 
 @router.put("/device/{device_id}", response_model=DeviceResponse)
-def update_device(
+async def update_device(
     device_id: int,
     device_data: DeviceUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     更新设备信息
     """
     try:
-        device = DeviceService.update_device(db, device_id, device_data)
+        device = await AsyncDeviceService.update_device(db, device_id, device_data)
         if not device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"设备ID {device_id} 不存在"
             )
-        return device.to_dict()
+        return device
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -224,32 +323,187 @@ def update_device(
         )
 
 @router.put("/device/{device_id}/status", response_model=DeviceResponse)
-def update_device_status(
+async def update_device_status(
     device_id: int,
     status_data: DeviceStatusUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     更新设备状态
     """
-    device = DeviceService.update_device_status(db, device_id, status_data)
+    device = await AsyncDeviceService.update_device_status(db, device_id, status_data)
     if not device:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"设备ID {device_id} 不存在"
         )
-    return device.to_dict()
+    return device
+
+def _parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """
+    解析If-Match请求头中的版本号，支持 3、"3"、W/"3" 三种写法
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"无效的If-Match版本号: {if_match}"
+        )
+
+@router.patch("/device/{device_id}/private-data", response_model=DevicePrivateDataPatchResult)
+async def patch_device_private_data(
+    device_id: int,
+    request: Request,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    局部更新设备私有数据
+    Content-Type 为 application/json-patch+json 时请求体是 JSON Patch 操作列表（add/replace/remove），
+    否则按 JSON Merge Patch 处理（值为null表示删除该键），请求体必须是对象；
+    replace/remove 的目标路径或 add 的父路径不存在时返回409，不做任何修改
+    If-Match 携带版本号时只在版本一致时更新，不一致返回412；响应的ETag为更新后的版本号
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="请求体不是有效的JSON")
+    
+    expected_version = _parse_if_match(if_match)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == JSON_PATCH_MEDIA_TYPE:
+        if not isinstance(body, list):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="JSON Patch请求体必须是操作列表")
+        try:
+            patch = [JsonPatchOperation.model_validate(operation).model_dump() for operation in body]
+        except ValidationError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.errors(include_url=False))
+        patch_format = "json-patch"
+    else:
+        if not isinstance(body, dict):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="JSON Merge Patch请求体必须是JSON对象")
+        patch = body
+        patch_format = "merge"
+    
+    try:
+        result = await AsyncDeviceService.patch_device_private_data(
+            db, device_id, patch, patch_format=patch_format, expected_version=expected_version
+        )
+    except DeviceVersionConflict as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail=str(e),
+            headers={"ETag": f'"{e.current_version}"'}
+        )
+    except JsonPatchConflict as e:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"设备ID {device_id} 不存在"
+        )
+    response.headers["ETag"] = f'"{result["version"]}"'
+    return result
+
+@router.get("/device/cache/stats")
+async def get_device_cache_stats():
+    """
+    获取设备与设备类型查询缓存的命中统计
+    """
+    return get_cache_stats()
+
+@router.post("/device/heartbeat", status_code=status.HTTP_202_ACCEPTED)
+async def report_device_heartbeats(heartbeat_batch: DeviceHeartbeatBatch):
+    """
+    批量上报设备心跳
+    心跳进入内存缓冲区，同一设备只保留最新一条，由后台任务定期批量写入数据库
+    缓冲区已满时返回503，客户端稍后重试
+    """
+    try:
+        accepted = heartbeat_buffer.add(heartbeat_batch.heartbeats)
+    except HeartbeatBufferFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="心跳缓冲区已满，请稍后重试",
+            headers={"Retry-After": str(max(1, round(heartbeat_buffer.flush_interval)))}
+        )
+    return {
+        "accepted": accepted,
+        "pending": heartbeat_buffer.pending_count
+    }
+
+@router.post("/device/{device_id}/telemetry", status_code=status.HTTP_201_CREATED)
+async def report_device_telemetry(
+    device_id: int,
+    telemetry_batch: TelemetryBatch,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    批量写入设备遥测读数
+    """
+    try:
+        inserted = await AsyncDeviceService.insert_telemetry(db, device_id, telemetry_batch.readings)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"写入遥测数据失败: {str(e)}"
+        )
+    if inserted is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"设备ID {device_id} 不存在"
+        )
+    return {"inserted": inserted}
+
+@router.get("/device/{device_id}/telemetry", response_model=TelemetrySeries)
+async def get_device_telemetry(
+    device_id: int,
+    metric: str,
+    start: datetime,
+    end: datetime,
+    bucket_seconds: int = Query(ROLLUP_BUCKET_SECONDS, ge=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    查询设备指标的降采样遥测数据（每个时间桶返回 min/max/avg）
+    """
+    try:
+        points = await AsyncDeviceService.query_telemetry(db, device_id, metric, start, end, bucket_seconds)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return {
+        "device_id": device_id,
+        "metric": metric,
+        "bucket_seconds": bucket_seconds,
+        "points": points
+    }
 
 @router.delete("/device/{device_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_device(
+async def delete_device(
     device_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     删除设备
     """
     try:
-        success = DeviceService.delete_device(db, device_id)
+        success = await AsyncDeviceService.delete_device(db, device_id)
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -259,4 +513,80 @@ def delete_device(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"删除设备失败: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+# 设备实时事件端点
+async def _load_device_snapshot() -> Dict[str, Any]:
+    """
+    在独立会话中加载设备快照
+    流式连接会长时间保持，不能占用请求级的会话
+    """
+    async with AsyncSessionLocal() as db:
+        return await AsyncDeviceService.build_snapshot(db)
+
+@router.get("/device/events/stream")
+async def stream_device_events(request: Request):
+    """
+    通过Server-Sent Events推送设备变化
+    首条事件为全量快照，之后只推送增量事件
+    """
+    # 先订阅再加载快照，保证快照之后的变化不会丢失
+    subscription = device_event_hub.subscribe()
+    try:
+        snapshot = await _load_device_snapshot()
+    except Exception:
+        device_event_hub.unsubscribe(subscription)
+        raise
+
+    async def event_stream():
+        try:
+            yield f"data: {json.dumps({'type': 'snapshot', **snapshot}, ensure_ascii=False)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            device_event_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/device/events/ws")
+async def device_events_websocket(websocket: WebSocket):
+    """
+    通过WebSocket推送设备变化
+    首条消息为全量快照，之后只推送增量事件
+    """
+    await websocket.accept()
+    subscription = device_event_hub.subscribe()
+    receiver = None
+    getter = None
+    try:
+        snapshot = await _load_device_snapshot()
+        await websocket.send_json({"type": "snapshot", **snapshot})
+
+        # 同时等待客户端消息（用于发现断开）和新事件
+        receiver = asyncio.ensure_future(websocket.receive())
+        getter = asyncio.ensure_future(subscription.get())
+        while True:
+            done, _ = await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                await websocket.send_json(getter.result())
+                getter = asyncio.ensure_future(subscription.get())
+            if receiver in done:
+                if receiver.result()["type"] == "websocket.disconnect":
+                    break
+                receiver = asyncio.ensure_future(websocket.receive())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        device_event_hub.unsubscribe(subscription)
+        for task in (receiver, getter):
+            if task is not None:
+                task.cancel()
@@ -1,56 +1,62 @@
 # 用户相关API端点
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
-from app.database.database import get_db
+from app.database.database import get_async_db
 from app.schemas.user import UserCreate, UserUpdate, UserResponse
-from app.services.user_service import create_user, get_user, get_users, update_user
-from app.models.user import User as UserModel
+from app.services.async_user_service import create_user, get_user, get_user_by_username, get_users, update_user
+from app.services.pagination import MAX_PAGE_LIMIT, set_next_cursor
+from app.services.quota_service import quota_service
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 @router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def create_new_user(user: UserCreate, db: Session = Depends(get_db)):
+async def create_new_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """
     创建新用户
     """
-    db_user = get_user_by_username(db, username=user.username)
+    db_user = await get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return create_user(db=db, user=user)
+    return await create_user(db=db, user=user)
 
 @router.get("/", response_model=List[UserResponse])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """
-    获取用户列表
-    """
-    users = get_users(db, skip=skip, limit=limit)
+async def read_users(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_LIMIT),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    获取用户列表（游标分页，下一页游标在响应头X-Next-Cursor中返回）
+    """
+    try:
+        users, next_cursor = await get_users(db, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_next_cursor(response, next_cursor)
     return users
 
 @router.get("/{user_id}", response_model=UserResponse)
-def read_user(user_id: int, db: Session = Depends(get_db)):
+async def read_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     根据用户ID获取用户信息
     """
-    db_user = get_user(db, user_id=user_id)
+    db_user = await get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 @router.put("/{user_id}", response_model=UserResponse)
-def update_user_info(user_id: int, user_update: UserUpdate, db: Session = Depends(get_db)):
+async def update_user_info(user_id: int, user_update: UserUpdate, db: AsyncSession = Depends(get_async_db)):
     """
     更新用户信息
     """
-    db_user = update_user(db, user_id=user_id, user_update=user_update)
+    db_user = await update_user(db, user_id=user_id, user_update=user_update)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    # 配额或用户名可能被修改
+    quota_service.invalidate()
     return db_user
-
-def get_user_by_username(db: Session, username: str):
-    """
-    根据用户名获取用户（内部函数）
-    """
-    return db.query(UserModel).filter(UserModel.username == username).first()
\ No newline at end of file
@@ -1,19 +1,247 @@
 # 数据库连接与管理模块
 
-from sqlalchemy import create_engine
+import os
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+from sqlalchemy import MetaData, create_engine, event, inspect
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateColumn, CreateIndex
 
 # 数据库URL配置
 # 示例使用SQLite数据库，实际项目中可以替换为PostgreSQL、MySQL等
 SQLALCHEMY_DATABASE_URL = "sqlite:///./fastapi_app.db"
 
+# 同步驱动 -> 异步驱动
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+class DatabaseSettings(BaseModel):
+    """
+    数据库引擎配置
+    可通过 DatabaseSettings.from_env() 从环境变量读取
+    """
+    url: str = SQLALCHEMY_DATABASE_URL
+    # 异步引擎使用的URL，为空时根据url自动替换为对应的异步驱动
+    async_url: Optional[str] = None
+    echo: bool = False
+
+    # 连接池配置（SQLite文件库与PostgreSQL/MySQL通用）
+    pool_size: int = 10
+    max_overflow: int = 20
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+
+    # SQLite连接参数，每个新连接建立时通过PRAGMA设置
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_cache_size: int = -64000       # 负数表示KiB，即约64MB页缓存
+    sqlite_mmap_size: int = 268435456     # 256MB内存映射
+    sqlite_busy_timeout: int = 5000       # 毫秒
+    sqlite_temp_store: str = "MEMORY"
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        """
+        从环境变量读取配置，未设置的项使用默认值
+        DATABASE_URL, ASYNC_DATABASE_URL, DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+        DB_POOL_PRE_PING, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_CACHE_SIZE,
+        SQLITE_MMAP_SIZE, SQLITE_BUSY_TIMEOUT, SQLITE_TEMP_STORE
+        """
+        env_names = {
+            "url": "DATABASE_URL",
+            "async_url": "ASYNC_DATABASE_URL",
+            "echo": "DB_ECHO",
+            "pool_size": "DB_POOL_SIZE",
+            "max_overflow": "DB_MAX_OVERFLOW",
+            "pool_timeout": "DB_POOL_TIMEOUT",
+            "pool_recycle": "DB_POOL_RECYCLE",
+            "pool_pre_ping": "DB_POOL_PRE_PING",
+            "sqlite_journal_mode": "SQLITE_JOURNAL_MODE",
+            "sqlite_synchronous": "SQLITE_SYNCHRONOUS",
+            "sqlite_cache_size": "SQLITE_CACHE_SIZE",
+            "sqlite_mmap_size": "SQLITE_MMAP_SIZE",
+            "sqlite_busy_timeout": "SQLITE_BUSY_TIMEOUT",
+            "sqlite_temp_store": "SQLITE_TEMP_STORE",
+        }
+        values = {field: os.environ[name] for field, name in env_names.items() if name in os.environ}
+        return cls(**values)
+
+    @property
+    def resolved_async_url(self) -> str:
+        """
+        异步引擎使用的URL
+        """
+        if self.async_url:
+            return self.async_url
+        url = make_url(self.url)
+        backend = url.get_backend_name()
+        if backend not in ASYNC_DRIVERS:
+            raise ValueError(f"数据库 {backend} 没有可用的异步驱动，请设置 ASYNC_DATABASE_URL")
+        return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+    @property
+    def is_sqlite(self) -> bool:
+        """
+        是否为SQLite数据库
+        """
+        return make_url(self.url).get_backend_name() == "sqlite"
+
+    @property
+    def is_sqlite_memory(self) -> bool:
+        """
+        是否为SQLite内存数据库
+        """
+        database = make_url(self.url).database
+        return self.is_sqlite and (not database or database == ":memory:")
+
+def _sqlite_pragmas(settings: DatabaseSettings) -> Dict[str, Any]:
+    """
+    需要在每个SQLite连接上执行的PRAGMA
+    """
+    pragmas = {
+        "synchronous": settings.sqlite_synchronous,
+        "cache_size": settings.sqlite_cache_size,
+        "mmap_size": settings.sqlite_mmap_size,
+        "busy_timeout": settings.sqlite_busy_timeout,
+        "temp_store": settings.sqlite_temp_store,
+    }
+    # 内存数据库不支持WAL
+    if not settings.is_sqlite_memory:
+        pragmas = {"journal_mode": settings.sqlite_journal_mode, **pragmas}
+    return pragmas
+
+def _engine_kwargs(settings: DatabaseSettings) -> Dict[str, Any]:
+    """
+    同步与异步引擎共用的创建参数
+    """
+    kwargs: Dict[str, Any] = {"echo": settings.echo}
+
+    if settings.is_sqlite:
+        kwargs["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": settings.sqlite_busy_timeout / 1000,
+        }
+        if settings.is_sqlite_memory:
+            # 内存数据库只能共享同一个连接
+            kwargs["poolclass"] = StaticPool
+        else:
+            kwargs.update(
+                pool_size=settings.pool_size,
+                max_overflow=settings.max_overflow,
+                pool_timeout=settings.pool_timeout,
+            )
+    else:
+        kwargs.update(
+            pool_size=settings.pool_size,
+            max_overflow=settings.max_overflow,
+            pool_timeout=settings.pool_timeout,
+            pool_recycle=settings.pool_recycle,
+            pool_pre_ping=settings.pool_pre_ping,
+        )
+    return kwargs
+
+def _install_sqlite_pragmas(db_engine: Engine, settings: DatabaseSettings) -> None:
+    """
+    在每个新建的SQLite连接上执行PRAGMA
+    """
+    pragmas = _sqlite_pragmas(settings)
+
+    @event.listens_for(db_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+def create_db_engine(settings: Optional[DatabaseSettings] = None) -> Engine:
+    """
+    根据配置创建数据库引擎
+    SQLite：连接建立时设置WAL、synchronous、缓存、mmap和busy_timeout，读写可以并发进行
+    PostgreSQL/MySQL：按配置设置连接池大小、溢出数量、超时和回收时间
+    """
+    settings = settings or DatabaseSettings.from_env()
+    db_engine = create_engine(settings.url, **_engine_kwargs(settings))
+    if settings.is_sqlite:
+        _install_sqlite_pragmas(db_engine, settings)
+    return db_engine
+
+def create_async_db_engine(settings: Optional[DatabaseSettings] = None) -> AsyncEngine:
+    """
+    根据配置创建异步数据库引擎（aiosqlite/asyncpg/aiomysql），连接池和PRAGMA与同步引擎一致
+    """
+    settings = settings or DatabaseSettings.from_env()
+    kwargs = _engine_kwargs(settings)
+    if settings.is_sqlite:
+        # aiosqlite在自己的线程中访问连接，不需要check_same_thread
+        kwargs["connect_args"] = {"timeout": settings.sqlite_busy_timeout / 1000}
+    async_db_engine = create_async_engine(settings.resolved_async_url, **kwargs)
+    if settings.is_sqlite:
+        _install_sqlite_pragmas(async_db_engine.sync_engine, settings)
+    return async_db_engine
+
+def add_missing_columns(db_engine: Engine, metadata: MetaData) -> None:
+    """
+    为已存在的表补充模型中新增的列
+    create_all 只会创建缺失的表，不会修改已有表，新增列需要带默认值（server_default）或允许为空
+    """
+    inspector = inspect(db_engine)
+    with db_engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=db_engine.dialect)
+                    connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                    print(f"数据表 {table.name} 新增列: {column.name}")
+
+def add_missing_indexes(db_engine: Engine, metadata: MetaData) -> None:
+    """
+    为已存在的表补充模型中新增的索引（create_all 不会为已有的表创建索引）
+    多个进程同时启动时可能重复创建，支持的数据库使用 CREATE INDEX IF NOT EXISTS；
+    唯一索引可能与已有数据冲突，每个索引在单独的事务中创建，失败时只打印错误
+    """
+    inspector = inspect(db_engine)
+    if_not_exists = db_engine.dialect.name in ("sqlite", "postgresql")
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                with db_engine.begin() as connection:
+                    connection.execute(CreateIndex(index, if_not_exists=if_not_exists))
+                print(f"数据表 {table.name} 新增索引: {index.name}")
+            except Exception as e:
+                print(f"数据表 {table.name} 创建索引 {index.name} 失败: {str(e)}")
+
+# 数据库配置（从环境变量读取）
+settings = DatabaseSettings.from_env()
+
 # 创建数据库引擎
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_db_engine(settings)
 
 # 创建数据库会话
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 创建异步数据库引擎和会话，供异步端点使用，不会占用线程池
+async_engine = create_async_db_engine(settings)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 # 创建基础模型类
 Base = declarative_base()
 
@@ -25,4 +253,11 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """
+    获取异步数据库会话依赖项
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -5,13 +5,29 @@ from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 
 from app.api.api import api_router
-from app.database.database import engine, Base, get_db
+from app.database.database import engine, Base, get_db, add_missing_columns, add_missing_indexes
 from app.models.user import User as UserModel
 from app.models.device import Device, DeviceType  # 导入设备相关模型
+from app.models.telemetry import TelemetryReading, TelemetryRollup, TelemetryDirtyBucket  # 导入遥测数据模型
+from app.models.cloud import CloudUserSetting, CloudSession, CloudStateRevision, CloudJob  # 导入云盘设置、会话与任务模型
 from app.services.user_service import authenticate_user
+from app.services.heartbeat_service import heartbeat_buffer
+from app.services.telemetry_service import telemetry_maintenance
+from app.services.search_index import search_index
+from app.services.blob_store import blob_store
+from app.services.thumbnail_service import thumbnail_service
+from app.services.job_queue import job_queue
+from app.services.cloud_state import cloud_state
+from app.services.bluetooth_discovery import bluetooth_discovery
+from app.services.ble_connections import ble_connection_pool
+from app.services.ble_gatt import gatt_writer
+from app.services.ble_notifications import ble_notifications
 
 # 创建数据库表（会自动包含所有继承自Base的模型）
 Base.metadata.create_all(bind=engine)
+# 为已有的表补充新增的列和索引
+add_missing_columns(engine, Base.metadata)
+add_missing_indexes(engine, Base.metadata)
 
 # 创建FastAPI应用
 app = FastAPI(title="ikun的后端工程", description="现代化的FastAPI后端工程示例")
@@ -71,6 +87,42 @@ async def startup_event():
         init_devices(db)
     finally:
         db.close()
+    
+    # 启动设备心跳批量写入任务
+    heartbeat_buffer.start()
+    # 启动遥测数据汇总与过期清理任务
+    telemetry_maintenance.start()
+    # 加载云盘用户设置，并在后台同步其他worker进程的修改
+    await cloud_state.load()
+    cloud_state.start()
+    # 启动云盘搜索索引任务（各用户的挂载路径在首次访问时建立索引）
+    search_index.start()
+    # 开启去重存储时在后台核对引用计数，回收无引用的内容
+    blob_store.start()
+    # 启动云盘后台文件操作任务的worker，任务状态写入共享存储，其他worker进程也能查询和取消
+    job_queue.store = cloud_state
+    job_queue.start()
+    # 启动蓝牙设备后台扫描（扫描方式在蓝牙路由模块中登记）和BLE连接健康检查
+    bluetooth_discovery.start()
+    ble_connection_pool.start()
+
+# 应用关闭事件
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    应用关闭时写入缓冲区中剩余的设备心跳，并停止后台任务、断开所有BLE设备
+    """
+    await heartbeat_buffer.stop()
+    await telemetry_maintenance.stop()
+    await search_index.stop()
+    await blob_store.stop()
+    await job_queue.stop()
+    await cloud_state.stop()
+    await bluetooth_discovery.stop()
+    await gatt_writer.stop()
+    await ble_notifications.stop()
+    await ble_connection_pool.stop()
+    thumbnail_service.shutdown()
 
 # 主页路由
 @app.get("/", response_class=HTMLResponse)
@@ -1,5 +1,7 @@
 # Models模块初始化文件
 from app.models.user import User
 from app.models.device import Device, DeviceType
+from app.models.telemetry import TelemetryReading, TelemetryRollup, TelemetryDirtyBucket
+from app.models.cloud import CloudUserSetting, CloudSession, CloudStateRevision, CloudJob
 
-__all__ = ["User", "Device", "DeviceType"]
\ No newline at end of file
+__all__ = ["User", "Device", "DeviceType", "TelemetryReading", "TelemetryRollup", "TelemetryDirtyBucket", "CloudUserSetting", "CloudSession", "CloudStateRevision", "CloudJob"]
\ No newline at end of file
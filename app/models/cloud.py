@@ -0,0 +1,48 @@
+# 云盘用户设置、登录会话与后台任务状态数据模型
+
+from sqlalchemy import Boolean, Column, Float, Integer, String, Text
+from app.database.database import Base
+
+class CloudUserSetting(Base):
+    """
+    云盘用户设置（挂载路径等），所有worker进程共享
+    """
+    __tablename__ = "cloud_user_settings"
+
+    username = Column(String, primary_key=True, comment="用户名")
+    mount_path = Column(String, nullable=True, comment="挂载路径，为空时使用默认云盘目录")
+    updated_at = Column(Float, nullable=False, index=True, comment="最后修改时间（Unix时间戳）")
+
+class CloudStateRevision(Base):
+    """
+    云盘共享状态的修订号，修改设置时在同一事务中加一，其他进程据此发现修改
+    """
+    __tablename__ = "cloud_state_revisions"
+
+    name = Column(String, primary_key=True, comment="状态名称，如settings")
+    revision = Column(Integer, nullable=False, default=0, comment="修订号，只增不减")
+
+class CloudSession(Base):
+    """
+    云盘登录会话，Cookie中只保存随机令牌
+    """
+    __tablename__ = "cloud_sessions"
+
+    token = Column(String, primary_key=True, comment="会话令牌")
+    username = Column(String, nullable=False, index=True, comment="用户名")
+    created_at = Column(Float, nullable=False, comment="创建时间（Unix时间戳）")
+    expires_at = Column(Float, nullable=False, index=True, comment="过期时间（Unix时间戳）")
+
+class CloudJob(Base):
+    """
+    云盘后台任务状态快照，由执行任务的进程定期写入，任何worker进程都可以查询
+    """
+    __tablename__ = "cloud_jobs"
+
+    id = Column(String, primary_key=True, comment="任务ID")
+    username = Column(String, nullable=False, index=True, comment="提交任务的用户")
+    status = Column(String, nullable=False, comment="任务状态")
+    snapshot = Column(Text, nullable=False, comment="任务状态（JSON）")
+    cancel_requested = Column(Boolean, nullable=False, default=False, comment="其他进程请求取消，由执行任务的进程处理")
+    created_at = Column(Float, nullable=False, index=True, comment="提交时间（Unix时间戳）")
+    updated_at = Column(Float, nullable=False, comment="最后写入时间（Unix时间戳），执行中的任务定期刷新")
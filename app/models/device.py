@@ -4,6 +4,7 @@ from sqlalchemy import Column, Integer, String, ForeignKey, JSON, Boolean, DateT
 from sqlalchemy.orm import relationship
 from app.database.database import Base
 from datetime import datetime
+from typing import Optional, Dict, Any
 
 class DeviceType(Base):
     """
@@ -45,33 +46,42 @@ class Device(Base):
     id = Column(Integer, primary_key=True, index=True)
     device_id = Column(String, unique=True, nullable=False, index=True, comment="设备唯一标识符")
     name = Column(String, nullable=False, comment="设备名称")
-    device_type_id = Column(Integer, ForeignKey("device_types.id"), nullable=False, comment="设备类型ID")
+    device_type_id = Column(Integer, ForeignKey("device_types.id"), nullable=False, index=True, comment="设备类型ID")
     status = Column(String, default="inactive", nullable=False, comment="设备状态：active/inactive/maintenance/error")
     private_data = Column(JSON, default={}, nullable=True, comment="设备私有数据，以JSON格式存储")
     firmware_version = Column(String, nullable=True, comment="固件版本")
     last_online = Column(DateTime, nullable=True, comment="最后在线时间")
     is_online = Column(Boolean, default=False, nullable=False, comment="设备是否在线")
+    version = Column(Integer, default=1, server_default="1", nullable=False, comment="设备数据版本号，修改设备信息或私有数据时递增，用于乐观并发控制")
     created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
     
     # 关系定义：一个设备属于一个设备类型
     device_type = relationship("DeviceType", back_populates="devices")
     
-    def to_dict(self):
+    def to_dict(self, device_type_map: Optional[Dict[int, Dict[str, Any]]] = None):
         """
         将设备对象转换为字典
+        传入device_type_map（设备类型ID -> 设备类型字典）时直接从映射中取嵌套的设备类型，
+        不访问惰性加载的device_type关系，避免逐行触发额外查询
         """
+        if device_type_map is not None:
+            device_type = device_type_map.get(self.device_type_id)
+        else:
+            device_type = self.device_type.to_dict() if self.device_type else None
+        
         return {
             "id": self.id,
             "device_id": self.device_id,
             "name": self.name,
             "device_type_id": self.device_type_id,
-            "device_type": self.device_type.to_dict() if self.device_type else None,
+            "device_type": device_type,
             "status": self.status,
             "private_data": self.private_data,
             "firmware_version": self.firmware_version,
             "last_online": self.last_online.isoformat() if self.last_online else None,
             "is_online": self.is_online,
+            "version": self.version,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
\ No newline at end of file
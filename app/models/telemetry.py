@@ -0,0 +1,48 @@
+# 设备遥测数据模型
+
+from sqlalchemy import Column, Integer, BigInteger, String, Float, ForeignKey
+from app.database.database import Base
+
+class TelemetryReading(Base):
+    """
+    设备遥测原始读数
+    以 (设备ID, 指标名, 时间戳) 为主键只追加写入，
+    SQLite下使用 WITHOUT ROWID 表，数据按主键聚簇存储，范围查询只需顺序扫描
+    """
+    __tablename__ = "telemetry_readings"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True, autoincrement=False, comment="设备ID")
+    metric = Column(String, primary_key=True, comment="指标名称，如temperature/humidity/lux")
+    ts = Column(BigInteger, primary_key=True, autoincrement=False, comment="采样时间（UTC毫秒时间戳）")
+    value = Column(Float, nullable=False, comment="读数")
+
+class TelemetryRollup(Base):
+    """
+    设备遥测聚合数据
+    按固定时间桶汇总原始读数，原始数据过期删除后仍可用于长时间范围的降采样查询
+    """
+    __tablename__ = "telemetry_rollups"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True, autoincrement=False, comment="设备ID")
+    metric = Column(String, primary_key=True, comment="指标名称")
+    bucket_start = Column(BigInteger, primary_key=True, autoincrement=False, comment="时间桶起点（UTC毫秒时间戳）")
+    count = Column(Integer, nullable=False, comment="桶内读数数量")
+    min_value = Column(Float, nullable=False, comment="桶内最小值")
+    max_value = Column(Float, nullable=False, comment="桶内最大值")
+    sum_value = Column(Float, nullable=False, comment="桶内读数之和")
+
+class TelemetryDirtyBucket(Base):
+    """
+    待重新汇总的时间桶
+    写入读数时记录读数所在的 (设备, 指标, 时间桶)，后台汇总只重建这些时间桶，
+    迟到或补传的历史读数也会进入聚合数据
+    """
+    __tablename__ = "telemetry_dirty_buckets"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True, autoincrement=False, comment="设备ID")
+    metric = Column(String, primary_key=True, comment="指标名称")
+    bucket_start = Column(BigInteger, primary_key=True, autoincrement=False, comment="时间桶起点（UTC毫秒时间戳）")
+    claim = Column(String(32), nullable=True, comment="正在汇总该时间桶的任务标识，汇总期间有新读数写入时清空")
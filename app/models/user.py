@@ -1,6 +1,6 @@
 # 用户数据模型
 
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import BigInteger, Column, Integer, String, Boolean
 from app.database.database import Base
 
 class User(Base):
@@ -15,6 +15,8 @@ class User(Base):
     full_name = Column(String, nullable=True)
     hashed_password = Column(String, nullable=False)
     disabled = Column(Boolean, default=False)
+    # 云盘存储配额（字节）：为空时使用默认配额，0表示不限制
+    storage_quota = Column(BigInteger, nullable=True)
 
     def to_dict(self):
         """
@@ -25,5 +27,6 @@ class User(Base):
             "username": self.username,
             "email": self.email,
             "full_name": self.full_name,
-            "disabled": self.disabled
+            "disabled": self.disabled,
+            "storage_quota": self.storage_quota
         }
\ No newline at end of file
@@ -2,11 +2,23 @@
 from app.schemas.user import UserCreate, UserResponse, UserUpdate, Token
 from app.schemas.device import (
     DeviceTypeBase, DeviceTypeCreate, DeviceTypeUpdate, DeviceTypeResponse,
-    DeviceBase, DeviceCreate, DeviceUpdate, DeviceResponse, DeviceStatusUpdate
+    DeviceBase, DeviceCreate, DeviceUpdate, DeviceResponse, DeviceStatusUpdate,
+    DeviceHeartbeat, DeviceHeartbeatBatch,
+    DeviceBulkCreate, DeviceBulkUpdateItem, DeviceBulkUpdate, DeviceBulkDelete,
+    DeviceBulkItemResult, DeviceBulkResponse,
+    JsonPatchOperation, DevicePrivateDataPatchResult
 )
+from app.schemas.telemetry import TelemetryReadingCreate, TelemetryBatch, TelemetryPoint, TelemetrySeries
+from app.schemas.cloud import UploadInit, UploadStatus, JobCreate, JobStatus
 
 __all__ = [
     "UserCreate", "UserResponse", "UserUpdate", "Token",
     "DeviceTypeBase", "DeviceTypeCreate", "DeviceTypeUpdate", "DeviceTypeResponse",
-    "DeviceBase", "DeviceCreate", "DeviceUpdate", "DeviceResponse", "DeviceStatusUpdate"
+    "DeviceBase", "DeviceCreate", "DeviceUpdate", "DeviceResponse", "DeviceStatusUpdate",
+    "DeviceHeartbeat", "DeviceHeartbeatBatch",
+    "DeviceBulkCreate", "DeviceBulkUpdateItem", "DeviceBulkUpdate", "DeviceBulkDelete",
+    "DeviceBulkItemResult", "DeviceBulkResponse",
+    "JsonPatchOperation", "DevicePrivateDataPatchResult",
+    "TelemetryReadingCreate", "TelemetryBatch", "TelemetryPoint", "TelemetrySeries",
+    "UploadInit", "UploadStatus", "JobCreate", "JobStatus"
 ]
\ No newline at end of file
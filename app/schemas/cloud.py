@@ -0,0 +1,56 @@
+# 云盘相关的数据验证模式
+
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
+
+class UploadInit(BaseModel):
+    """
+    创建分片上传会话模型
+    """
+    filename: str = Field(..., description="文件名")
+    size: int = Field(..., ge=0, description="文件总大小（字节）")
+    path: str = Field("", description="目标目录，相对于用户挂载路径")
+    sha256: Optional[str] = Field(
+        None, pattern="^[0-9a-fA-F]{64}$", description="文件的SHA-256，开启去重存储且内容已存在时无需上传"
+    )
+
+class UploadStatus(BaseModel):
+    """
+    分片上传进度模型
+    """
+    upload_id: Optional[str] = Field(..., description="上传会话ID，秒传时为空")
+    filename: str = Field(..., description="文件名")
+    path: str = Field(..., description="目标目录")
+    size: int = Field(..., description="文件总大小（字节）")
+    offset: int = Field(..., description="服务器已接收的字节数，续传时从此处开始")
+    chunk_size: int = Field(..., description="建议的分片大小（字节）")
+    completed: bool = Field(..., description="是否已接收全部数据")
+    file: Optional[str] = Field(None, description="完成后文件的保存位置")
+    deduplicated: bool = Field(False, description="内容已存在，未占用额外的存储空间")
+
+class JobCreate(BaseModel):
+    """
+    提交后台文件操作任务模型
+    """
+    kind: str = Field(..., pattern="^(delete|copy|move|mkdir)$", description="操作类型：delete/copy/move/mkdir")
+    path: str = Field(..., description="要操作的文件或文件夹，相对于用户挂载路径")
+    destination: Optional[str] = Field(None, description="复制/移动的目标路径（含新名称），相对于用户挂载路径")
+
+class JobStatus(BaseModel):
+    """
+    后台任务状态模型
+    """
+    id: str = Field(..., description="任务ID")
+    kind: str = Field(..., description="操作类型")
+    status: str = Field(..., description="queued/running/succeeded/failed/cancelled")
+    params: Dict[str, Any] = Field(..., description="任务参数")
+    done: int = Field(..., description="已处理的条目数")
+    total: Optional[int] = Field(None, description="条目总数，统计完成前为空")
+    progress: float = Field(..., description="进度（0~1）")
+    message: str = Field("", description="当前阶段")
+    error: Optional[str] = Field(None, description="失败原因")
+    result: Optional[Dict[str, Any]] = Field(None, description="执行结果")
+    created_at: float = Field(..., description="提交时间")
+    started_at: Optional[float] = Field(None, description="开始时间")
+    finished_at: Optional[float] = Field(None, description="结束时间")
+    version: int = Field(..., description="状态版本号，每次变化加一")
@@ -1,7 +1,7 @@
 # 设备相关的数据验证模式
 
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Literal
 from datetime import datetime
 
 class DeviceTypeBase(BaseModel):
@@ -70,6 +70,7 @@ class DeviceResponse(DeviceBase):
     id: int
     status: str
     is_online: bool
+    version: int = Field(1, description="设备数据版本号")
     last_online: Optional[datetime]
     created_at: datetime
     updated_at: datetime
@@ -84,4 +85,80 @@ class DeviceStatusUpdate(BaseModel):
     """
     status: str = Field(..., description="设备状态")
     is_online: bool = Field(..., description="设备是否在线")
-    last_online: Optional[datetime] = Field(None, description="最后在线时间")
\ No newline at end of file
+    last_online: Optional[datetime] = Field(None, description="最后在线时间")
+
+class DeviceHeartbeat(BaseModel):
+    """
+    设备心跳模型
+    """
+    device_id: str = Field(..., description="设备唯一标识符")
+    status: str = Field(..., description="设备状态")
+    is_online: bool = Field(True, description="设备是否在线")
+    ts: Optional[datetime] = Field(None, description="心跳时间，为空时使用服务器接收时间")
+
+# 单次批量请求最多包含的设备数量
+MAX_BULK_ITEMS = 10000
+
+class DeviceHeartbeatBatch(BaseModel):
+    """
+    批量设备心跳模型
+    """
+    heartbeats: List[DeviceHeartbeat] = Field(..., min_length=1, max_length=MAX_BULK_ITEMS, description="心跳记录列表")
+
+class DeviceBulkCreate(BaseModel):
+    """
+    批量创建设备模型
+    """
+    devices: List[DeviceCreate] = Field(..., min_length=1, max_length=MAX_BULK_ITEMS, description="待创建的设备列表")
+
+class DeviceBulkUpdateItem(DeviceUpdate):
+    """
+    批量更新中的单个设备
+    """
+    id: int = Field(..., description="设备ID")
+
+class DeviceBulkUpdate(BaseModel):
+    """
+    批量更新设备模型
+    """
+    devices: List[DeviceBulkUpdateItem] = Field(..., min_length=1, max_length=MAX_BULK_ITEMS, description="待更新的设备列表")
+
+class DeviceBulkDelete(BaseModel):
+    """
+    批量删除设备模型
+    """
+    ids: List[int] = Field(..., min_length=1, max_length=MAX_BULK_ITEMS, description="待删除的设备ID列表")
+
+class DeviceBulkItemResult(BaseModel):
+    """
+    批量操作中单个设备的处理结果
+    """
+    index: int = Field(..., description="在请求列表中的位置")
+    success: bool
+    id: Optional[int] = Field(None, description="设备ID")
+    device_id: Optional[str] = Field(None, description="设备唯一标识符")
+    error: Optional[str] = Field(None, description="失败原因")
+
+class DeviceBulkResponse(BaseModel):
+    """
+    批量操作响应模型
+    """
+    succeeded: int
+    failed: int
+    results: List[DeviceBulkItemResult]
+
+class JsonPatchOperation(BaseModel):
+    """
+    JSON Patch (RFC 6902) 单个操作
+    """
+    op: Literal["add", "replace", "remove"] = Field(..., description="操作类型")
+    path: str = Field(..., description="JSON Pointer路径，如 /config/interval")
+    value: Any = Field(None, description="写入的值，remove操作忽略")
+
+class DevicePrivateDataPatchResult(BaseModel):
+    """
+    设备私有数据局部更新结果
+    """
+    id: int = Field(..., description="设备ID")
+    device_id: str = Field(..., description="设备唯一标识符")
+    version: int = Field(..., description="更新后的版本号")
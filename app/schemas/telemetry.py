@@ -0,0 +1,38 @@
+# 设备遥测相关的数据验证模式
+
+from pydantic import BaseModel, Field
+from typing import Optional, List
+from datetime import datetime
+
+class TelemetryReadingCreate(BaseModel):
+    """
+    遥测读数写入模型
+    """
+    metric: str = Field(..., description="指标名称，如temperature/humidity/lux")
+    value: float = Field(..., description="读数")
+    ts: Optional[datetime] = Field(None, description="采样时间，为空时使用服务器接收时间")
+
+class TelemetryBatch(BaseModel):
+    """
+    批量遥测读数写入模型
+    """
+    readings: List[TelemetryReadingCreate] = Field(..., description="遥测读数列表")
+
+class TelemetryPoint(BaseModel):
+    """
+    降采样后的单个时间桶
+    """
+    ts: datetime = Field(..., description="时间桶起点（UTC）")
+    count: int = Field(..., description="桶内读数数量")
+    min: float = Field(..., description="最小值")
+    max: float = Field(..., description="最大值")
+    avg: Optional[float] = Field(None, description="平均值")
+
+class TelemetrySeries(BaseModel):
+    """
+    遥测查询响应模型
+    """
+    device_id: int
+    metric: str
+    bucket_seconds: int
+    points: List[TelemetryPoint]
@@ -1,6 +1,6 @@
 # 用户Pydantic数据模式
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 class UserBase(BaseModel):
@@ -11,6 +11,8 @@ class UserBase(BaseModel):
     email: Optional[str] = None
     full_name: Optional[str] = None
     disabled: Optional[bool] = None
+    # 云盘存储配额（字节），为空时使用默认配额，0表示不限制
+    storage_quota: Optional[int] = Field(None, ge=0)
 
 class UserCreate(UserBase):
     """
@@ -1,4 +1,9 @@
 # Services模块初始化文件
 from app.services.device_service import DeviceService, DeviceTypeService
+from app.services.telemetry_service import TelemetryService
+from app.services.async_device_service import AsyncDeviceService, AsyncDeviceTypeService
 
-__all__ = ["DeviceService", "DeviceTypeService"]
\ No newline at end of file
+__all__ = [
+    "DeviceService", "DeviceTypeService", "TelemetryService",
+    "AsyncDeviceService", "AsyncDeviceTypeService"
+]
@@ -0,0 +1,246 @@
+# 设备服务层的异步版本
+# 通过 AsyncSession.run_sync 在异步连接上执行同步服务的业务逻辑，
+# 缓存、事件推送、分页等行为与 DeviceService/DeviceTypeService 完全一致，
+# 数据库I/O由异步驱动完成，不占用线程池。
+# 返回值为已序列化的字典：会话之外访问惰性加载的关系需要额外I/O，因此序列化在run_sync内完成
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.schemas.device import (
+    DeviceTypeCreate, DeviceTypeUpdate,
+    DeviceCreate, DeviceUpdate, DeviceStatusUpdate,
+    DeviceBulkUpdateItem
+)
+from app.schemas.telemetry import TelemetryReadingCreate
+from app.services.device_service import DeviceService, DeviceTypeService
+from app.services.telemetry_service import TelemetryService
+
+def _to_dict(instance: Any) -> Optional[Dict[str, Any]]:
+    return instance.to_dict() if instance else None
+
+class AsyncDeviceTypeService:
+    """
+    设备类型服务类（异步）
+    """
+
+    @staticmethod
+    async def create_device_type(db: AsyncSession, device_type_data: DeviceTypeCreate) -> Dict[str, Any]:
+        """
+        创建设备类型
+        """
+        return await db.run_sync(
+            lambda session: DeviceTypeService.create_device_type(session, device_type_data).to_dict()
+        )
+
+    @staticmethod
+    async def get_device_type(db: AsyncSession, device_type_id: int) -> Optional[Dict[str, Any]]:
+        """
+        根据ID获取设备类型
+        """
+        return await db.run_sync(
+            lambda session: _to_dict(DeviceTypeService.get_device_type(session, device_type_id))
+        )
+
+    @staticmethod
+    async def get_device_type_by_name(db: AsyncSession, name: str) -> Optional[Dict[str, Any]]:
+        """
+        根据名称获取设备类型
+        """
+        return await db.run_sync(
+            lambda session: _to_dict(DeviceTypeService.get_device_type_by_name(session, name))
+        )
+
+    @staticmethod
+    async def get_device_types(
+        db: AsyncSession, cursor: Optional[str] = None, limit: int = 100
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        获取设备类型列表（游标分页）
+        """
+        def _get(session):
+            device_types, next_cursor = DeviceTypeService.get_device_types(session, cursor=cursor, limit=limit)
+            return [device_type.to_dict() for device_type in device_types], next_cursor
+        return await db.run_sync(_get)
+
+    @staticmethod
+    async def update_device_type(
+        db: AsyncSession, device_type_id: int, device_type_data: DeviceTypeUpdate
+    ) -> Optional[Dict[str, Any]]:
+        """
+        更新设备类型
+        """
+        return await db.run_sync(
+            lambda session: _to_dict(DeviceTypeService.update_device_type(session, device_type_id, device_type_data))
+        )
+
+    @staticmethod
+    async def delete_device_type(db: AsyncSession, device_type_id: int) -> bool:
+        """
+        删除设备类型
+        """
+        return await db.run_sync(
+            lambda session: DeviceTypeService.delete_device_type(session, device_type_id)
+        )
+
+class AsyncDeviceService:
+    """
+    设备服务类（异步）
+    """
+
+    @staticmethod
+    async def create_device(db: AsyncSession, device_data: DeviceCreate) -> Dict[str, Any]:
+        """
+        创建设备
+        """
+        return await db.run_sync(
+            lambda session: DeviceService.create_device(session, device_data).to_dict()
+        )
+
+    @staticmethod
+    async def get_device(db: AsyncSession, device_id: int) -> Optional[Dict[str, Any]]:
+        """
+        根据ID获取设备
+        """
+        return await db.run_sync(
+            lambda session: _to_dict(DeviceService.get_device(session, device_id))
+        )
+
+    @staticmethod
+    async def get_device_by_device_id(db: AsyncSession, device_id: str) -> Optional[Dict[str, Any]]:
+        """
+        根据设备唯一标识符获取设备
+        """
+        return await db.run_sync(
+            lambda session: _to_dict(DeviceService.get_device_by_device_id(session, device_id))
+        )
+
+    @staticmethod
+    async def get_devices(
+        db: AsyncSession, cursor: Optional[str] = None, limit: int = 100, device_type_id: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        获取设备列表（游标分页），可选择按设备类型筛选
+        """
+        def _get(session):
+            if device_type_id:
+                devices, next_cursor = DeviceService.get_devices_by_type(session, device_type_id, cursor=cursor, limit=limit)
+            else:
+                devices, next_cursor = DeviceService.get_devices(session, cursor=cursor, limit=limit)
+            return DeviceService.serialize_devices(session, devices), next_cursor
+        return await db.run_sync(_get)
+
+    @staticmethod
+    async def build_snapshot(db: AsyncSession) -> Dict[str, Any]:
+        """
+        构建全部设备类型和设备的快照
+        """
+        return await db.run_sync(DeviceService.build_snapshot)
+
+    @staticmethod
+    async def update_device(db: AsyncSession, device_id: int, device_data: DeviceUpdate) -> Optional[Dict[str, Any]]:
+        """
+        更新设备信息
+        """
+        return await db.run_sync(
+            lambda session: _to_dict(DeviceService.update_device(session, device_id, device_data))
+        )
+
+    @staticmethod
+    async def update_device_status(
+        db: AsyncSession, device_id: int, status_data: DeviceStatusUpdate
+    ) -> Optional[Dict[str, Any]]:
+        """
+        更新设备状态
+        """
+        return await db.run_sync(
+            lambda session: _to_dict(DeviceService.update_device_status(session, device_id, status_data))
+        )
+
+    @staticmethod
+    async def delete_device(db: AsyncSession, device_id: int) -> bool:
+        """
+        删除设备
+        """
+        return await db.run_sync(
+            lambda session: DeviceService.delete_device(session, device_id)
+        )
+
+    @staticmethod
+    async def update_device_private_data(
+        db: AsyncSession, device_id: int, private_data: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        更新设备私有数据
+        """
+        return await db.run_sync(
+            lambda session: _to_dict(DeviceService.update_device_private_data(session, device_id, private_data))
+        )
+
+    @staticmethod
+    async def patch_device_private_data(
+        db: AsyncSession,
+        device_id: int,
+        patch: Any,
+        patch_format: str = "merge",
+        expected_version: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        局部更新设备私有数据
+        """
+        return await db.run_sync(
+            lambda session: DeviceService.patch_device_private_data(
+                session, device_id, patch, patch_format=patch_format, expected_version=expected_version
+            )
+        )
+
+    @staticmethod
+    async def bulk_create_devices(db: AsyncSession, devices_data: List[DeviceCreate]) -> List[Dict[str, Any]]:
+        """
+        批量创建设备
+        """
+        return await db.run_sync(
+            lambda session: DeviceService.bulk_create_devices(session, devices_data)
+        )
+
+    @staticmethod
+    async def bulk_update_devices(db: AsyncSession, devices_data: List[DeviceBulkUpdateItem]) -> List[Dict[str, Any]]:
+        """
+        批量更新设备
+        """
+        return await db.run_sync(
+            lambda session: DeviceService.bulk_update_devices(session, devices_data)
+        )
+
+    @staticmethod
+    async def bulk_delete_devices(db: AsyncSession, device_ids: List[int]) -> List[Dict[str, Any]]:
+        """
+        批量删除设备
+        """
+        return await db.run_sync(
+            lambda session: DeviceService.bulk_delete_devices(session, device_ids)
+        )
+
+    @staticmethod
+    async def insert_telemetry(db: AsyncSession, device_id: int, readings: List[TelemetryReadingCreate]) -> Optional[int]:
+        """
+        批量写入设备遥测读数，设备不存在时返回None
+        """
+        def _insert(session):
+            if not DeviceService.get_device(session, device_id):
+                return None
+            return TelemetryService.insert_readings(session, device_id, readings)
+        return await db.run_sync(_insert)
+
+    @staticmethod
+    async def query_telemetry(
+        db: AsyncSession, device_id: int, metric: str, start: datetime, end: datetime, bucket_seconds: int
+    ) -> List[Dict[str, Any]]:
+        """
+        查询设备指标的降采样遥测数据
+        """
+        return await db.run_sync(
+            lambda session: TelemetryService.query_range(session, device_id, metric, start, end, bucket_seconds)
+        )
@@ -0,0 +1,93 @@
+# 用户服务层的异步版本
+# 数据库访问通过 AsyncSession.run_sync 复用 user_service 中的查询，
+# 密码哈希和校验是CPU密集操作，放到线程池中执行，避免阻塞事件循环
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.models.user import User
+from app.schemas.user import UserCreate, UserUpdate
+from app.services import user_service
+
+def _to_dict(user: Optional[User]) -> Optional[Dict[str, Any]]:
+    return user.to_dict() if user else None
+
+async def get_user(db: AsyncSession, user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    根据用户ID获取用户
+    """
+    return await db.run_sync(lambda session: _to_dict(user_service.get_user(session, user_id)))
+
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[Dict[str, Any]]:
+    """
+    根据用户名获取用户
+    """
+    return await db.run_sync(lambda session: _to_dict(user_service.get_user_by_username(session, username)))
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[Dict[str, Any]]:
+    """
+    根据邮箱获取用户
+    """
+    return await db.run_sync(lambda session: _to_dict(user_service.get_user_by_email(session, email)))
+
+async def get_users(
+    db: AsyncSession, cursor: Optional[str] = None, limit: int = 100
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    获取用户列表（游标分页）
+    返回 (用户列表, 下一页游标)
+    """
+    def _get(session):
+        users, next_cursor = user_service.get_users(session, cursor=cursor, limit=limit)
+        return [user.to_dict() for user in users], next_cursor
+    return await db.run_sync(_get)
+
+async def create_user(db: AsyncSession, user: UserCreate) -> Dict[str, Any]:
+    """
+    创建用户
+    """
+    hashed_password = await run_in_threadpool(user_service.get_password_hash, user.password)
+    db_user = User(
+        username=user.username,
+        email=user.email,
+        full_name=user.full_name,
+        hashed_password=hashed_password,
+        disabled=user.disabled,
+        storage_quota=user.storage_quota
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user.to_dict()
+
+async def update_user(db: AsyncSession, user_id: int, user_update: UserUpdate) -> Optional[Dict[str, Any]]:
+    """
+    更新用户信息
+    """
+    update_data = user_update.dict(exclude_unset=True)
+    if "password" in update_data and update_data["password"]:
+        update_data["hashed_password"] = await run_in_threadpool(
+            user_service.get_password_hash, update_data.pop("password")
+        )
+    update_data.pop("password", None)
+
+    db_user = await db.get(User, user_id)
+    if db_user:
+        for key, value in update_data.items():
+            setattr(db_user, key, value)
+        await db.commit()
+        await db.refresh(db_user)
+    return _to_dict(db_user)
+
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Union[Dict[str, Any], bool]:
+    """
+    验证用户身份
+    """
+    user = await db.run_sync(lambda session: user_service.get_user_by_username(session, username))
+    if not user:
+        return False
+    if not await run_in_threadpool(user_service.verify_password, password, user.hashed_password):
+        return False
+    return user.to_dict()
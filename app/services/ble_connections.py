@@ -0,0 +1,329 @@
+# BLE连接池
+# 统一管理与BLE设备的连接：
+#   - 限制同时连接的设备数量，达到上限时断开最久未使用的空闲连接（LRU）
+#   - 每个设备一把asyncio锁，并发的连接/断开/重连请求依次执行，不会重复建立连接
+#   - 后台定期检查连接状态（并响应bleak的断开回调），意外断开的连接按指数退避自动重连，
+#     多次失败后从连接池中移除
+#   - 长时间未使用的连接自动断开
+# 客户端通过 client_factory 创建（默认 BleakClient），可替换为模拟实现用于离线调试和测试（见 tool/fake_bleak）
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from bleak import BleakClient
+
+# 最大同时连接数
+MAX_BLE_CONNECTIONS = int(os.environ.get("BLUETOOTH_MAX_CONNECTIONS", "5"))
+# 空闲连接的最长保持时间（秒），0表示不因空闲断开
+BLE_IDLE_TIMEOUT = float(os.environ.get("BLUETOOTH_IDLE_TIMEOUT", "300"))
+# 连接状态检查间隔（秒）
+BLE_HEALTH_INTERVAL = float(os.environ.get("BLUETOOTH_HEALTH_INTERVAL", "10"))
+# 建立连接的超时时间（秒）
+BLE_CONNECT_TIMEOUT = 10.0
+# 自动重连的初始间隔、最大间隔（秒）和最多尝试次数
+RECONNECT_BASE_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+MAX_RECONNECT_ATTEMPTS = 6
+
+CONNECTION_CONNECTED = "connected"
+CONNECTION_RECONNECTING = "reconnecting"
+
+class ConnectionPoolFull(Exception):
+    """
+    连接数已达上限且没有可以断开的空闲连接
+    """
+
+class DeviceNotConnected(Exception):
+    """
+    设备未连接或连接已断开且无法恢复
+    """
+
+class ManagedConnection:
+    """
+    连接池中的单个连接
+    """
+
+    def __init__(self, address: str, client: Any, info: Optional[Dict[str, Any]] = None):
+        self.address = address
+        self.client = client
+        self.info = info or {"id": address, "name": address, "mac": address, "type": "BLE"}
+        self.connected_at = time.time()
+        self.last_used = time.monotonic()
+        self.state = CONNECTION_CONNECTED
+        self.reconnect_attempts = 0
+        self.next_retry = 0.0
+        # 正在使用该连接的操作数量，使用中的连接不会被淘汰
+        self.in_use = 0
+        # 主动断开时置为True，断开回调不再触发重连
+        self.closing = False
+        # 已解析的GATT特征值（规范化UUID -> 特征值），重连后清空重新解析
+        self.characteristics: Dict[str, Any] = {}
+
+    @property
+    def is_connected(self) -> bool:
+        return bool(self.client.is_connected)
+
+    def touch(self) -> None:
+        self.last_used = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "device": self.info,
+            "state": self.state if not self.is_connected else CONNECTION_CONNECTED,
+            "connected": self.is_connected,
+            "connected_at": self.connected_at,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "reconnect_attempts": self.reconnect_attempts,
+            "in_use": self.in_use,
+        }
+
+class BleConnectionPool:
+    """
+    BLE连接池
+    """
+
+    def __init__(self, max_connections: int = MAX_BLE_CONNECTIONS, idle_timeout: float = BLE_IDLE_TIMEOUT,
+                 health_interval: float = BLE_HEALTH_INTERVAL, client_factory: Callable[..., Any] = BleakClient):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self.client_factory = client_factory
+        # 地址 -> 连接，按最近使用排序（最久未使用的在前）
+        self._connections: "OrderedDict[str, ManagedConnection]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # 正在建立的新连接数量，计入连接数上限
+        self._connecting = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # 重连成功后、连接移出连接池后调用的回调（用于恢复/清理通知订阅等）
+        self._reconnected_listeners: List[Callable[[ManagedConnection], Awaitable[None]]] = []
+        self._closed_listeners: List[Callable[[ManagedConnection], Awaitable[None]]] = []
+
+    def add_listener(self, event: str, callback: Callable[[ManagedConnection], Awaitable[None]]) -> None:
+        """
+        登记连接事件回调，event 为 reconnected 或 closed
+        """
+        if event == "reconnected":
+            self._reconnected_listeners.append(callback)
+        elif event == "closed":
+            self._closed_listeners.append(callback)
+        else:
+            raise ValueError(f"未知的连接事件: {event}")
+
+    async def _emit(self, listeners: List[Callable[[ManagedConnection], Awaitable[None]]], conn: ManagedConnection) -> None:
+        for callback in listeners:
+            try:
+                await callback(conn)
+            except Exception as e:
+                print(f"BLE设备 {conn.address} 连接事件回调失败: {str(e)}")
+
+    def _lock(self, address: str) -> asyncio.Lock:
+        lock = self._locks.get(address)
+        if lock is None:
+            lock = self._locks[address] = asyncio.Lock()
+        return lock
+
+    def _new_client(self, address: str) -> Any:
+        return self.client_factory(address, disconnected_callback=lambda _client: self._on_disconnected(address))
+
+    def _on_disconnected(self, address: str) -> None:
+        """
+        bleak断开回调，唤醒后台检查尽快重连
+        """
+        conn = self._connections.get(address)
+        if conn is None or conn.closing:
+            return
+        print(f"BLE设备 {address} 连接意外断开")
+        conn.state = CONNECTION_RECONNECTING
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def get(self, address: str) -> Optional[ManagedConnection]:
+        """
+        获取连接池中的连接（可能处于重连中）
+        """
+        return self._connections.get(address)
+
+    def list_connections(self) -> List[Dict[str, Any]]:
+        """
+        列出所有连接（最近使用的在前）
+        """
+        return [conn.to_dict() for conn in reversed(self._connections.values())]
+
+    async def _evict_for_capacity(self) -> None:
+        """
+        连接数达到上限时断开最久未使用的空闲连接
+        """
+        while len(self._connections) + self._connecting >= self.max_connections:
+            victim = next((conn for conn in self._connections.values() if conn.in_use == 0), None)
+            if victim is None:
+                raise ConnectionPoolFull(f"BLE连接数已达上限（{self.max_connections}），且所有连接都在使用中")
+            print(f"BLE连接数已达上限，断开最久未使用的设备 {victim.address}")
+            await self.disconnect(victim.address)
+
+    async def connect(self, address: str, info: Optional[Dict[str, Any]] = None) -> ManagedConnection:
+        """
+        连接设备，已连接时直接返回现有连接
+        """
+        self.start()
+        async with self._lock(address):
+            conn = self._connections.get(address)
+            if conn is not None and conn.is_connected:
+                conn.touch()
+                self._connections.move_to_end(address)
+                return conn
+            if conn is not None:
+                # 连接已断开（正在等待重连），立即重新连接
+                await self._connect_client(conn)
+                return conn
+
+            await self._evict_for_capacity()
+            self._connecting += 1
+            try:
+                client = self._new_client(address)
+                await client.connect(timeout=BLE_CONNECT_TIMEOUT)
+            finally:
+                self._connecting -= 1
+            conn = ManagedConnection(address, client, info)
+            self._connections[address] = conn
+            return conn
+
+    async def _connect_client(self, conn: ManagedConnection) -> None:
+        """
+        为已断开的连接创建新的客户端并连接（调用方需持有该设备的锁）
+        """
+        client = self._new_client(conn.address)
+        await client.connect(timeout=BLE_CONNECT_TIMEOUT)
+        conn.client = client
+        conn.characteristics = {}
+        conn.state = CONNECTION_CONNECTED
+        conn.reconnect_attempts = 0
+        conn.next_retry = 0.0
+        conn.connected_at = time.time()
+        conn.touch()
+        self._connections.move_to_end(conn.address)
+        await self._emit(self._reconnected_listeners, conn)
+
+    async def disconnect(self, address: str) -> Optional[ManagedConnection]:
+        """
+        断开并移除连接，不在连接池中时返回None
+        """
+        async with self._lock(address):
+            conn = self._connections.pop(address, None)
+            if conn is None:
+                return None
+            conn.closing = True
+            await self._emit(self._closed_listeners, conn)
+            try:
+                if conn.is_connected:
+                    await conn.client.disconnect()
+            except Exception as e:
+                print(f"断开BLE设备 {address} 失败: {str(e)}")
+            return conn
+
+    @asynccontextmanager
+    async def acquire(self, address: str) -> AsyncIterator[ManagedConnection]:
+        """
+        使用连接：连接已断开时先尝试立即重连一次，使用期间不会被淘汰
+        """
+        conn = self._connections.get(address)
+        if conn is None:
+            raise DeviceNotConnected(f"设备 {address} 未连接")
+        if not conn.is_connected:
+            async with self._lock(address):
+                if address not in self._connections:
+                    raise DeviceNotConnected(f"设备 {address} 未连接")
+                if not conn.is_connected:
+                    try:
+                        await self._connect_client(conn)
+                    except Exception as e:
+                        raise DeviceNotConnected(f"设备 {address} 连接已断开，重连失败: {str(e)}")
+        conn.in_use += 1
+        conn.touch()
+        self._connections.move_to_end(address)
+        try:
+            yield conn
+        finally:
+            conn.in_use -= 1
+            conn.touch()
+
+    async def _reconnect(self, conn: ManagedConnection) -> None:
+        async with self._lock(conn.address):
+            if conn.is_connected or self._connections.get(conn.address) is not conn:
+                return
+            conn.state = CONNECTION_RECONNECTING
+            try:
+                await self._connect_client(conn)
+                print(f"BLE设备 {conn.address} 已重新连接")
+            except Exception as e:
+                conn.reconnect_attempts += 1
+                if conn.reconnect_attempts >= MAX_RECONNECT_ATTEMPTS:
+                    print(f"BLE设备 {conn.address} 重连失败 {conn.reconnect_attempts} 次，从连接池中移除: {str(e)}")
+                    self._connections.pop(conn.address, None)
+                    conn.closing = True
+                    await self._emit(self._closed_listeners, conn)
+                    return
+                delay = min(RECONNECT_BASE_DELAY * 2 ** (conn.reconnect_attempts - 1), RECONNECT_MAX_DELAY)
+                conn.next_retry = time.monotonic() + delay
+                print(f"BLE设备 {conn.address} 重连失败: {str(e)}，{delay:g}秒后重试")
+
+    async def check(self) -> None:
+        """
+        检查所有连接：断开空闲超时的连接，重连意外断开的连接
+        """
+        now = time.monotonic()
+        due = []
+        for conn in list(self._connections.values()):
+            if self.idle_timeout and conn.in_use == 0 and now - conn.last_used > self.idle_timeout:
+                print(f"BLE设备 {conn.address} 空闲超过 {self.idle_timeout:g} 秒，断开连接")
+                await self.disconnect(conn.address)
+            elif not conn.is_connected and now >= conn.next_retry:
+                due.append(conn)
+        # 各设备同时重连，某个设备重连较慢时不影响其他设备
+        await asyncio.gather(*(self._reconnect(conn) for conn in due))
+
+    async def _run(self) -> None:
+        while True:
+            # 有等待重连的连接时，到下一次重连时间就检查，不必等满一个检查间隔
+            timeout = self.health_interval
+            retries = [conn.next_retry for conn in self._connections.values() if not conn.is_connected]
+            if retries:
+                timeout = min(max(min(retries) - time.monotonic(), 0.1), timeout)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"检查BLE连接失败: {str(e)}")
+
+    def start(self) -> None:
+        """
+        启动后台检查任务（需在事件循环中调用，重复调用无影响）
+        """
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        停止后台检查并断开所有连接
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for address in list(self._connections):
+            await self.disconnect(address)
+
+# 全局BLE连接池实例
+ble_connection_pool = BleConnectionPool()
@@ -0,0 +1,223 @@
+# BLE GATT写入管道
+#   - 特征值UUID在每个连接上只解析一次，结果缓存在连接中（重连后重新解析）
+#   - 数据按协商的MTU分片写入
+#   - 大块数据（固件分片、配置文件等）使用无响应写入（write-without-response）连续发送，
+#     不必每片等待一次往返；每发送一个窗口的分片，若特征值支持有响应写入，则用一次有响应写入作为同步点，
+#     防止对端缓冲区溢出（不支持时依赖bleak/系统蓝牙栈自身的发送流控）
+#   - 每个设备一个发送队列和worker，同一设备的写入按提交顺序执行；
+#     所有设备共享有限的发送槽位，按窗口轮流占用（先到先得），大文件传输不会长时间占满适配器
+#   - 每次写入返回分片数、耗时和吞吐量（字节/秒）
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from bleak.uuids import normalize_uuid_str
+
+from app.services.ble_connections import BleConnectionPool, ManagedConnection, ble_connection_pool
+
+# 每个窗口连续发送的分片数量
+BLE_WRITE_WINDOW = int(os.environ.get("BLUETOOTH_WRITE_WINDOW", "16"))
+# 所有设备同时占用的发送槽位数量
+MAX_CONCURRENT_WRITES = int(os.environ.get("BLUETOOTH_MAX_CONCURRENT_WRITES", "4"))
+# 每个设备发送队列的最大长度
+WRITE_QUEUE_SIZE = 32
+# 设备发送队列空闲多久后结束worker（秒）
+WRITER_IDLE_SECONDS = 30.0
+# ATT协议头占用的字节数，单个分片最大为 MTU - 3
+ATT_HEADER_SIZE = 3
+# 单个特征值的最大长度（有响应写入的分片上限）
+MAX_ATTRIBUTE_SIZE = 512
+
+class GattError(Exception):
+    """
+    GATT操作失败（特征值不存在、不支持该操作等）
+    """
+
+class GattWriteError(GattError):
+    """
+    GATT写入失败（特征值不支持写入或发送过程中出错）
+    """
+
+class GattTransferError(GattWriteError):
+    """
+    发送过程中出错（连接断开、对端拒绝等），消息中包含已发送的字节数
+    """
+
+class WriteQueueFull(Exception):
+    """
+    设备发送队列已满
+    """
+
+class _WriteRequest:
+    def __init__(self, characteristic: str, data: bytes, response: Optional[bool]):
+        self.characteristic = characteristic
+        self.data = data
+        self.response = response
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+def resolve_characteristic(conn: ManagedConnection, uuid: str) -> Any:
+    """
+    查找特征值（每个连接只解析一次，结果缓存在连接中）
+    """
+    try:
+        key = normalize_uuid_str(uuid)
+    except ValueError:
+        raise GattError(f"无效的特征值UUID: {uuid}")
+    characteristic = conn.characteristics.get(key)
+    if characteristic is None:
+        characteristic = conn.client.services.get_characteristic(key)
+        if characteristic is None:
+            raise GattError(f"设备 {conn.address} 没有特征值 {uuid}")
+        conn.characteristics[key] = characteristic
+    return characteristic
+
+def describe_services(client: Any) -> List[Dict[str, Any]]:
+    """
+    GATT服务与特征值列表
+    """
+    return [
+        {
+            "uuid": service.uuid,
+            "description": service.description,
+            "characteristics": [
+                {
+                    "uuid": char.uuid,
+                    "description": char.description,
+                    "handle": char.handle,
+                    "properties": list(char.properties),
+                }
+                for char in service.characteristics
+            ],
+        }
+        for service in client.services.services.values()
+    ]
+
+class GattWriter:
+    """
+    按设备排队的GATT写入
+    """
+
+    def __init__(self, pool: BleConnectionPool = ble_connection_pool, window: int = BLE_WRITE_WINDOW,
+                 max_concurrent: int = MAX_CONCURRENT_WRITES, queue_size: int = WRITE_QUEUE_SIZE):
+        self.pool = pool
+        self.window = window
+        self.queue_size = queue_size
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+
+    async def write(self, address: str, characteristic: str, data: bytes,
+                    response: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        提交写入并等待完成，返回发送统计
+        response为None时自动选择：多于一个分片且支持无响应写入时使用无响应写入，否则使用有响应写入
+        """
+        queue = self._queues.get(address)
+        if queue is None:
+            queue = self._queues[address] = asyncio.Queue(self.queue_size)
+        worker = self._workers.get(address)
+        if worker is None or worker.done():
+            self._workers[address] = asyncio.create_task(self._worker(address, queue))
+
+        request = _WriteRequest(characteristic, data, response)
+        try:
+            queue.put_nowait(request)
+        except asyncio.QueueFull:
+            raise WriteQueueFull(f"设备 {address} 的发送队列已满（{self.queue_size}），请稍后重试")
+        return await request.future
+
+    async def _worker(self, address: str, queue: asyncio.Queue) -> None:
+        while True:
+            try:
+                request = await asyncio.wait_for(queue.get(), timeout=WRITER_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                # 检查和删除之间没有await，不会漏掉新提交的写入
+                if queue.empty():
+                    self._queues.pop(address, None)
+                    self._workers.pop(address, None)
+                    return
+                continue
+            if request.future.done():
+                # 提交写入的请求已经断开
+                continue
+            try:
+                async with self.pool.acquire(address) as conn:
+                    result = await self._transfer(conn, request)
+                if not request.future.done():
+                    request.future.set_result(result)
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+    async def _transfer(self, conn: ManagedConnection, request: _WriteRequest) -> Dict[str, Any]:
+        characteristic = resolve_characteristic(conn, request.characteristic)
+        properties = set(characteristic.properties)
+        can_respond = "write" in properties
+        can_stream = "write-without-response" in properties
+        if not can_respond and not can_stream:
+            raise GattWriteError(f"特征值 {request.characteristic} 不支持写入")
+
+        mtu = conn.client.mtu_size
+        data = request.data
+        response = request.response
+        if response is None:
+            response = not (can_stream and len(data) > mtu - ATT_HEADER_SIZE) and can_respond
+        elif response and not can_respond:
+            raise GattWriteError(f"特征值 {request.characteristic} 不支持有响应写入")
+        elif not response and not can_stream:
+            raise GattWriteError(f"特征值 {request.characteristic} 不支持无响应写入")
+
+        if response:
+            chunk_size = min(mtu - ATT_HEADER_SIZE, MAX_ATTRIBUTE_SIZE)
+        else:
+            chunk_size = characteristic.max_write_without_response_size or (mtu - ATT_HEADER_SIZE)
+        chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)] or [b""]
+
+        started = time.monotonic()
+        sent = 0
+        try:
+            for offset in range(0, len(chunks), self.window):
+                window = chunks[offset:offset + self.window]
+                # 每个窗口占用一个发送槽位，窗口之间让出给其他设备
+                async with self._slots:
+                    for index, chunk in enumerate(window):
+                        # 无响应写入时，窗口的最后一片用有响应写入作为同步点
+                        sync = response or (can_respond and index == len(window) - 1 and len(chunks) > 1)
+                        await conn.client.write_gatt_char(characteristic, chunk, response=sync)
+                        sent += len(chunk)
+                conn.touch()
+        except Exception as e:
+            raise GattTransferError(f"已发送 {sent}/{len(data)} 字节后写入失败: {str(e)}")
+
+        elapsed = time.monotonic() - started
+        return {
+            "characteristic": characteristic.uuid,
+            "bytes_sent": sent,
+            "chunks": len(chunks),
+            "chunk_size": chunk_size,
+            "mtu": mtu,
+            "with_response": response,
+            "queued_seconds": round(started - request.queued_at, 4),
+            "elapsed_seconds": round(elapsed, 4),
+            "throughput_bps": round(sent / elapsed, 1) if elapsed > 0 else None,
+        }
+
+    async def stop(self) -> None:
+        """
+        停止所有设备的发送worker
+        """
+        for task in self._workers.values():
+            task.cancel()
+        for task in list(self._workers.values()):
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._workers = {}
+        self._queues = {}
+
+# 全局GATT写入实例
+gatt_writer = GattWriter()
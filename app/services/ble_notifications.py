@@ -0,0 +1,373 @@
+# BLE GATT通知订阅
+#   - 订阅已连接设备的特征值通知（notify/indicate），收到的数据写入该设备的环形缓冲区
+#   - 缓冲区只保存一份数据，任意数量的WebSocket客户端各自持有读取位置；
+#     客户端消费过慢、读取位置已被覆盖时跳到最旧的数据并告知丢弃的条数，不会拖慢设备或其他客户端
+#   - 可按指定格式解析通知数据，并把解析出的传感器读数合并写入 devices 表中对应设备的私有数据
+#     （按设备合并，每隔一段时间批量写入一次，高频通知不会产生大量数据库写入）
+#   - 设备重连后自动恢复订阅，断开连接后取消订阅并移除缓冲区
+#   - 有订阅的连接计为使用中，不会因空闲超时或连接数上限被断开
+
+import asyncio
+import json
+import os
+import struct
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.database.database import SessionLocal
+from app.services.ble_connections import BleConnectionPool, ManagedConnection, ble_connection_pool
+from app.services.ble_gatt import GattError, resolve_characteristic
+from app.services.device_service import DeviceService
+
+# 每个设备环形缓冲区保存的通知条数
+NOTIFICATION_BUFFER_SIZE = int(os.environ.get("BLUETOOTH_NOTIFICATION_BUFFER", "1000"))
+# 每条WebSocket消息最多携带的通知条数
+MAX_NOTIFICATION_BATCH = 100
+# 传感器读数写入设备表的间隔（秒）
+SENSOR_FLUSH_INTERVAL = 1.0
+# 写入设备私有数据时使用的键
+SENSOR_DATA_KEY = "ble_sensor"
+
+def _parse_utf8(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace")
+
+def _parse_json(data: bytes) -> Any:
+    return json.loads(data.decode("utf-8"))
+
+def _parse_kv(data: bytes) -> Dict[str, Any]:
+    """
+    解析 "temperature=25.1,humidity=40" 形式的文本
+    """
+    values: Dict[str, Any] = {}
+    for item in data.decode("utf-8", errors="replace").replace(";", ",").split(","):
+        if "=" not in item:
+            continue
+        key, value = item.split("=", 1)
+        try:
+            values[key.strip()] = float(value)
+        except ValueError:
+            values[key.strip()] = value.strip()
+    return values
+
+def _struct_parser(fmt: str) -> Callable[[bytes], Any]:
+    size = struct.calcsize(fmt)
+    return lambda data: struct.unpack(fmt, bytes(data[:size]))[0]
+
+# 通知数据解析方式
+NOTIFICATION_PARSERS: Dict[str, Callable[[bytes], Any]] = {
+    "utf8": _parse_utf8,
+    "json": _parse_json,
+    "kv": _parse_kv,
+    "uint8": _struct_parser("<B"),
+    "int16le": _struct_parser("<h"),
+    "uint16le": _struct_parser("<H"),
+    "int32le": _struct_parser("<i"),
+    "float32le": _struct_parser("<f"),
+}
+
+class NotificationStream:
+    """
+    单个设备的通知环形缓冲区
+    每条通知有递增的序号，读取方按序号读取，读取位置早于最旧的序号说明中间的数据已被覆盖
+    """
+
+    def __init__(self, size: int = NOTIFICATION_BUFFER_SIZE):
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.next_seq = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def oldest_seq(self) -> int:
+        return self._entries[0]["seq"] if self._entries else self.next_seq
+
+    def push(self, entry: Dict[str, Any]) -> None:
+        """
+        写入一条通知，缓冲区已满时覆盖最旧的一条
+        """
+        entry["seq"] = self.next_seq
+        self.next_seq += 1
+        self._entries.append(entry)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def read(self, cursor: int, limit: int = MAX_NOTIFICATION_BATCH) -> Tuple[List[Dict[str, Any]], int, int]:
+        """
+        读取序号不小于cursor的通知，返回 (通知列表, 新的读取位置, 被覆盖而丢弃的条数)
+        """
+        dropped = max(self.oldest_seq - cursor, 0)
+        cursor = max(cursor, self.oldest_seq)
+        start = len(self._entries) - (self.next_seq - cursor)
+        entries = [self._entries[i] for i in range(start, min(start + limit, len(self._entries)))]
+        return entries, cursor + len(entries), dropped
+
+    def recent(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        最近的limit条通知
+        """
+        return list(self._entries)[-limit:] if limit > 0 else []
+
+    async def wait(self, cursor: int) -> None:
+        """
+        等待序号为cursor的通知到达
+        """
+        while self.next_seq <= cursor:
+            await self._changed.wait()
+
+class _Subscription:
+    def __init__(self, address: str, characteristic: str, parser: Optional[str],
+                 forward_to: Optional[str], metric: Optional[str]):
+        self.address = address
+        self.characteristic = characteristic
+        self.parser = parser
+        self.forward_to = forward_to
+        self.metric = metric or characteristic
+        self.started_at = time.time()
+        self.count = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "characteristic": self.characteristic,
+            "parser": self.parser,
+            "forward_to": self.forward_to,
+            "metric": self.metric,
+            "started_at": self.started_at,
+            "notifications": self.count,
+            "bytes": self.bytes,
+            "parse_errors": self.errors,
+        }
+
+class SensorForwarder:
+    """
+    把解析出的传感器读数按设备合并后定期写入 devices 表（私有数据的 ble_sensor 字段）
+    """
+
+    def __init__(self, flush_interval: float = SENSOR_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        # devices.device_id -> 最新读数
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, device_id: str, values: Dict[str, Any]) -> None:
+        self._pending.setdefault(device_id, {}).update(values)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _write(self, pending: Dict[str, Dict[str, Any]]) -> int:
+        db = SessionLocal()
+        written = 0
+        try:
+            for device_id, values in pending.items():
+                device = DeviceService.get_device_by_device_id(db, device_id)
+                if device is None:
+                    print(f"转发BLE传感器数据失败: 设备 {device_id} 不存在")
+                    continue
+                DeviceService.patch_device_private_data(db, device.id, {
+                    SENSOR_DATA_KEY: {**values, "updated_at": datetime.utcnow().isoformat()}
+                })
+                written += 1
+        finally:
+            db.close()
+        return written
+
+    async def flush(self) -> int:
+        """
+        写入积累的读数，返回写入的设备数量
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        return await run_in_threadpool(self._write, pending)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"写入BLE传感器数据失败: {str(e)}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+class BleNotificationManager:
+    """
+    通知订阅管理
+    """
+
+    def __init__(self, pool: BleConnectionPool = ble_connection_pool, buffer_size: int = NOTIFICATION_BUFFER_SIZE):
+        self.pool = pool
+        self.buffer_size = buffer_size
+        self.forwarder = SensorForwarder()
+        self._streams: Dict[str, NotificationStream] = {}
+        # 地址 -> {特征值UUID -> 订阅}
+        self._subscriptions: Dict[str, Dict[str, _Subscription]] = {}
+        # 地址 -> 因有订阅而标记为使用中的连接
+        self._pinned: Dict[str, ManagedConnection] = {}
+        pool.add_listener("reconnected", self._resubscribe)
+        pool.add_listener("closed", self._on_closed)
+
+    def _stream(self, address: str) -> NotificationStream:
+        """
+        设备的通知缓冲区（不存在时创建，只在订阅时调用）
+        """
+        stream = self._streams.get(address)
+        if stream is None:
+            stream = self._streams[address] = NotificationStream(self.buffer_size)
+        return stream
+
+    def get_stream(self, address: str) -> Optional[NotificationStream]:
+        """
+        设备的通知缓冲区，设备没有订阅过通知或连接已关闭时返回None
+        """
+        return self._streams.get(address)
+
+    def _pin(self, conn: ManagedConnection) -> None:
+        """
+        设备有订阅时占用连接一次（计入 in_use），避免正在接收通知的连接被当作空闲连接断开
+        """
+        if conn.address not in self._pinned:
+            conn.in_use += 1
+            self._pinned[conn.address] = conn
+
+    def _release(self, address: str) -> None:
+        conn = self._pinned.pop(address, None)
+        if conn is not None:
+            conn.in_use -= 1
+
+    def list_subscriptions(self, address: str) -> List[Dict[str, Any]]:
+        return [sub.to_dict() for sub in self._subscriptions.get(address, {}).values()]
+
+    def _handler(self, subscription: _Subscription) -> Callable[[Any, bytearray], None]:
+        stream = self._stream(subscription.address)
+
+        def on_notification(_sender: Any, data: bytearray) -> None:
+            subscription.count += 1
+            subscription.bytes += len(data)
+            entry: Dict[str, Any] = {
+                "type": "notification",
+                "ts": time.time(),
+                "characteristic": subscription.characteristic,
+                "hex": bytes(data).hex(),
+            }
+            if subscription.parser:
+                try:
+                    entry["value"] = NOTIFICATION_PARSERS[subscription.parser](bytes(data))
+                except Exception as e:
+                    subscription.errors += 1
+                    entry["error"] = f"解析失败: {str(e)}"
+            stream.push(entry)
+
+            value = entry.get("value")
+            if subscription.forward_to and value is not None:
+                if isinstance(value, dict):
+                    values = {k: v for k, v in value.items() if isinstance(v, (int, float, str, bool))}
+                else:
+                    values = {subscription.metric: value}
+                if values:
+                    self.forwarder.add(subscription.forward_to, values)
+
+        return on_notification
+
+    async def _start_notify(self, conn: ManagedConnection, subscription: _Subscription) -> None:
+        characteristic = resolve_characteristic(conn, subscription.characteristic)
+        properties = set(characteristic.properties)
+        if "notify" not in properties and "indicate" not in properties:
+            raise GattError(f"特征值 {subscription.characteristic} 不支持通知")
+        await conn.client.start_notify(characteristic, self._handler(subscription))
+
+    async def subscribe(self, address: str, characteristic: str, parser: Optional[str] = None,
+                        forward_to: Optional[str] = None, metric: Optional[str] = None) -> Dict[str, Any]:
+        """
+        订阅特征值通知，已订阅时先取消原订阅再按新参数订阅
+        """
+        if parser is not None and parser not in NOTIFICATION_PARSERS:
+            raise GattError(f"未知的解析方式: {parser}，可选: {', '.join(NOTIFICATION_PARSERS)}")
+        subscription = _Subscription(address, characteristic, parser, forward_to, metric)
+        async with self.pool.acquire(address) as conn:
+            key = resolve_characteristic(conn, characteristic).uuid
+            subscription.characteristic = key
+            if metric is None:
+                subscription.metric = key
+            existing = self._subscriptions.get(address, {}).get(key)
+            if existing is not None:
+                await conn.client.stop_notify(key)
+            await self._start_notify(conn, subscription)
+            self._pin(conn)
+        self._subscriptions.setdefault(address, {})[key] = subscription
+        self._stream(address).push({"type": "subscribed", "ts": time.time(), "characteristic": key})
+        return subscription.to_dict()
+
+    async def unsubscribe(self, address: str, characteristic: str) -> bool:
+        """
+        取消订阅，未订阅时返回False
+        """
+        subscriptions = self._subscriptions.get(address, {})
+        conn = self.pool.get(address)
+        key = characteristic
+        if conn is not None:
+            try:
+                key = resolve_characteristic(conn, characteristic).uuid
+            except GattError:
+                pass
+        subscription = subscriptions.pop(key, None)
+        if subscription is None:
+            return False
+        if not subscriptions:
+            self._subscriptions.pop(address, None)
+            self._release(address)
+        if conn is not None and conn.is_connected:
+            try:
+                await conn.client.stop_notify(key)
+            except Exception as e:
+                print(f"取消BLE设备 {address} 的通知订阅失败: {str(e)}")
+        self._stream(address).push({"type": "unsubscribed", "ts": time.time(), "characteristic": key})
+        return True
+
+    async def _resubscribe(self, conn: ManagedConnection) -> None:
+        """
+        重连后恢复订阅（新的客户端上没有原来的通知订阅）
+        """
+        for subscription in list(self._subscriptions.get(conn.address, {}).values()):
+            try:
+                await self._start_notify(conn, subscription)
+            except Exception as e:
+                print(f"恢复BLE设备 {conn.address} 的通知订阅 {subscription.characteristic} 失败: {str(e)}")
+
+    async def _on_closed(self, conn: ManagedConnection) -> None:
+        """
+        连接移出连接池后清除订阅，并通知正在接收的客户端
+        """
+        subscriptions = self._subscriptions.pop(conn.address, {})
+        self._release(conn.address)
+        for key in subscriptions:
+            if conn.is_connected:
+                try:
+                    await conn.client.stop_notify(key)
+                except Exception:
+                    pass
+        # 缓冲区随连接一起移除，正在读取的客户端仍持有它，读到 disconnected 后结束
+        stream = self._streams.pop(conn.address, None)
+        if stream is not None:
+            stream.push({"type": "disconnected", "ts": time.time()})
+
+    async def stop(self) -> None:
+        """
+        写入剩余的传感器读数
+        """
+        await self.forwarder.stop()
+
+# 全局通知订阅管理实例
+ble_notifications = BleNotificationManager()
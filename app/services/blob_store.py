@@ -0,0 +1,463 @@
+# 云盘内容寻址去重存储（可选，设置环境变量 CLOUD_DEDUP=1 开启）
+# 上传的文件按SHA-256保存为一份blob，用户路径下的文件是blob的写时复制副本（reflink，
+# 文件系统支持时，如btrfs/XFS）或指向blob的硬链接，
+# 目录列表、下载、搜索、打包等功能仍然直接读取用户路径，不需要任何改动；
+# 用户路径与blob的对应关系及引用计数保存在SQLite中，重复上传同样的内容不再占用额外空间，
+# 客户端也可以先用哈希询问服务器，内容已存在时无需再上传。
+# 目标路径与blob不在同一文件系统（无法建立reflink和硬链接）时退化为复制，该文件不参与去重。
+# reflink副本是独立的文件，原地修改只影响它自己；硬链接的所有用户文件共享一个inode，
+# blob设为只读，防止原地写入某个文件时改动所有副本（以root运行时权限位不起作用，优先使用reflink）；
+# 服务内所有写文件的地方都先写临时文件再用 os.replace 替换目标，只替换目录项，不会写入共享的inode
+
+import asyncio
+import hashlib
+import os
+import shutil
+import sqlite3
+import stat
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import anyio
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 是否开启去重存储
+DEDUP_ENABLED = os.environ.get("CLOUD_DEDUP", "0").lower() in ("1", "true", "yes")
+# blob存储目录（包含元数据库），可通过环境变量修改
+BLOB_STORE_DIR = Path(os.environ.get("CLOUD_BLOB_DIR", "cloud_blobs"))
+# 暂存文件保留时间（秒），超过后视为中断的上传并清理
+STAGING_EXPIRE_SECONDS = 24 * 3600
+# 写入暂存文件时的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+# blob（及指向它的所有硬链接）的权限：只读
+BLOB_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+# Linux ioctl FICLONE：让目标文件与源文件共享数据块，写入时再复制
+FICLONE = 0x40049409
+
+# 用户文件放置方式
+PLACE_REFLINK = "reflink"
+PLACE_LINK = "link"
+PLACE_COPY = "copy"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES blobs (hash),
+    inode INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_files_hash ON files (hash);
+"""
+
+def is_sha256(value: str) -> bool:
+    """
+    检查是否为64位小写十六进制的SHA-256摘要
+    """
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+def temp_path_for(target: Path, suffix: str = "part") -> Path:
+    """
+    目标文件同目录下的临时文件路径，写完后用 os.replace 原子替换目标
+    （不会原地写入目标原来的inode，目标是去重文件的硬链接时其他副本不受影响）
+    """
+    return target.with_name(f".{target.name}.{uuid.uuid4().hex[:8]}.{suffix}")
+
+def reflink(source: Path, target: Path) -> bool:
+    """
+    创建source的写时复制副本，文件系统不支持时返回False（不留下目标文件）
+    """
+    if fcntl is None:
+        return False
+    try:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        target.unlink(missing_ok=True)
+        return False
+
+def hash_file(path: Any) -> str:
+    """
+    计算文件的SHA-256（同步，在线程中调用）
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class BlobStore:
+    """
+    内容寻址的blob存储与路径引用计数
+    """
+
+    def __init__(self, root: Path = BLOB_STORE_DIR, enabled: bool = DEDUP_ENABLED):
+        self.root = Path(root)
+        self.enabled = enabled
+        # 数据库与blob文件必须一起修改（例如引用计数归零时删除blob与另一个请求链接该blob不能交错）
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def objects_dir(self) -> Path:
+        return self.root / "objects"
+
+    @property
+    def staging_dir(self) -> Path:
+        # 暂存目录与blob在同一文件系统，哈希计算完成后可以直接重命名为blob
+        return self.root / "tmp"
+
+    def blob_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest[2:4] / digest
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            self.objects_dir.mkdir(parents=True, exist_ok=True)
+            self.staging_dir.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(self.root / "blobs.db"), timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        if not self._initialized:
+            connection.executescript(_SCHEMA)
+            # 之前创建的files表没有reflink副本的inode和修改时间列
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(files)")}
+            for column in ("inode", "mtime_ns"):
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE files ADD COLUMN {column} INTEGER")
+            connection.commit()
+            self._initialized = True
+        return connection
+
+    def new_staging_path(self) -> Path:
+        """
+        分配一个暂存文件路径
+        """
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        return self.staging_dir / f"{uuid.uuid4().hex}.tmp"
+
+    # ---------- 同步实现（在线程中执行） ----------
+
+    def _lookup(self, digest: str) -> Optional[Dict[str, Any]]:
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT size, refcount FROM blobs WHERE hash = ?", (digest,)
+            ).fetchone()
+        finally:
+            connection.close()
+        if row is None or not self.blob_path(digest).exists():
+            return None
+        return {"sha256": digest, "size": row[0], "refcount": row[1]}
+
+    def _place(self, blob: Path, target: Path) -> str:
+        """
+        把blob放到目标路径（先放到临时名称再原子替换，覆盖同名文件），返回放置方式：
+        优先reflink，其次硬链接，都不支持（跨文件系统等）时复制
+        """
+        temp = temp_path_for(target, "link")
+        if reflink(blob, temp):
+            mode = PLACE_REFLINK
+        else:
+            try:
+                os.link(blob, temp)
+                mode = PLACE_LINK
+            except OSError:
+                shutil.copyfile(blob, temp)
+                mode = PLACE_COPY
+        try:
+            os.replace(temp, target)
+        except OSError:
+            temp.unlink(missing_ok=True)
+            raise
+        return mode
+
+    def _release_rows(self, connection: sqlite3.Connection, where: str, params: Tuple) -> int:
+        """
+        删除匹配的路径映射，减少对应blob的引用计数，计数归零的blob一并删除，返回释放的路径数量
+        """
+        counts = connection.execute(
+            f"SELECT hash, COUNT(*) FROM files WHERE {where} GROUP BY hash", params
+        ).fetchall()
+        if not counts:
+            return 0
+        connection.execute(f"DELETE FROM files WHERE {where}", params)
+        for digest, count in counts:
+            connection.execute("UPDATE blobs SET refcount = refcount - ? WHERE hash = ?", (count, digest))
+        self._drop_unreferenced(connection, [digest for digest, _ in counts])
+        return sum(count for _, count in counts)
+
+    def _drop_unreferenced(self, connection: sqlite3.Connection, digests) -> None:
+        for digest in digests:
+            row = connection.execute("SELECT refcount FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is not None and row[0] <= 0:
+                connection.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+                self.blob_path(digest).unlink(missing_ok=True)
+
+    def _ingest(self, staged: Optional[Path], digest: str, size: int, target: Path) -> Dict[str, Any]:
+        """
+        把暂存文件存为blob（内容已存在时直接丢弃暂存文件）并链接到目标路径
+        staged为None表示只根据已知哈希链接，blob必须已存在
+        """
+        target = Path(os.path.abspath(target))
+        key = str(target)
+        blob = self.blob_path(digest)
+        with self._lock:
+            connection = self._connect()
+            try:
+                row = connection.execute("SELECT size FROM blobs WHERE hash = ?", (digest,)).fetchone()
+                exists = row is not None and blob.exists()
+                if exists:
+                    if staged is not None:
+                        staged.unlink(missing_ok=True)
+                elif staged is None:
+                    raise FileNotFoundError(f"blob不存在: {digest}")
+                else:
+                    blob.parent.mkdir(parents=True, exist_ok=True)
+                    # 同一文件系统内是重命名，跨文件系统时退化为复制
+                    shutil.move(str(staged), str(blob))
+                # 已有的blob也确保只读（兼容之前创建的可写blob）
+                os.chmod(blob, BLOB_MODE)
+
+                target.parent.mkdir(parents=True, exist_ok=True)
+                placement = self._place(blob, target)
+                linked = placement != PLACE_COPY
+
+                # 先增加新blob的引用，再释放目标路径原来的映射（内容相同时计数不会中途归零）
+                if linked:
+                    connection.execute(
+                        "INSERT INTO blobs (hash, size, refcount, created_at) VALUES (?, ?, 1, ?) "
+                        "ON CONFLICT (hash) DO UPDATE SET refcount = refcount + 1",
+                        (digest, size, time.time())
+                    )
+                self._release_rows(connection, "path = ?", (key,))
+                if placement == PLACE_REFLINK:
+                    # reflink副本有自己的inode，记录inode和修改时间，核对时据此判断文件是否已被替换或修改
+                    info = os.stat(target)
+                    connection.execute(
+                        "INSERT INTO files (path, hash, inode, mtime_ns) VALUES (?, ?, ?, ?)",
+                        (key, digest, info.st_ino, info.st_mtime_ns)
+                    )
+                elif linked:
+                    connection.execute("INSERT INTO files (path, hash) VALUES (?, ?)", (key, digest))
+                elif not exists:
+                    # 复制出去的文件不引用blob，新建的blob没有其他引用，不需要保留
+                    blob.unlink(missing_ok=True)
+                connection.commit()
+            finally:
+                connection.close()
+        return {"sha256": digest, "size": size, "file": key, "deduplicated": exists, "linked": linked,
+                "placement": placement}
+
+    def _release(self, path: Any) -> int:
+        key = os.path.abspath(str(path))
+        prefix = key.rstrip(os.sep) + os.sep
+        # 子路径范围查询：path >= 'a/' AND path < 'a0'（分隔符的下一个字符）
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        with self._lock:
+            connection = self._connect()
+            try:
+                released = self._release_rows(
+                    connection, "path = ? OR (path >= ? AND path < ?)", (key, prefix, upper)
+                )
+                connection.commit()
+            finally:
+                connection.close()
+        return released
+
+    def _move(self, source: Any, destination: Any) -> int:
+        """
+        文件/文件夹移动后更新路径映射（硬链接和reflink副本随文件一起移动，blob和引用计数不变）
+        """
+        old = os.path.abspath(str(source))
+        new = os.path.abspath(str(destination))
+        prefix = old.rstrip(os.sep) + os.sep
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        with self._lock:
+            connection = self._connect()
+            try:
+                cursor = connection.execute(
+                    "UPDATE files SET path = ? || substr(path, ?) WHERE path = ? OR (path >= ? AND path < ?)",
+                    (new, len(old) + 1, old, prefix, upper)
+                )
+                connection.commit()
+                return cursor.rowcount
+            finally:
+                connection.close()
+
+    def reconcile(self) -> Dict[str, int]:
+        """
+        与文件系统核对：删除已不存在、已被替换或（reflink副本）已被修改的路径映射，重新计算引用计数，
+        删除无引用的blob以及过期的暂存文件（在服务之外删除/覆盖的文件由此回收空间）
+        """
+        stale = orphans = 0
+        with self._lock:
+            connection = self._connect()
+            try:
+                rows = connection.execute("SELECT path, hash, inode, mtime_ns FROM files").fetchall()
+                for path, digest, inode, mtime_ns in rows:
+                    try:
+                        if inode is None:
+                            same = os.path.samefile(path, self.blob_path(digest))
+                        else:
+                            info = os.stat(path)
+                            same = info.st_ino == inode and info.st_mtime_ns == mtime_ns
+                    except OSError:
+                        same = False
+                    if not same:
+                        connection.execute("DELETE FROM files WHERE path = ?", (path,))
+                        stale += 1
+                connection.execute(
+                    "UPDATE blobs SET refcount = (SELECT COUNT(*) FROM files WHERE files.hash = blobs.hash)"
+                )
+                unreferenced = [row[0] for row in connection.execute("SELECT hash FROM blobs WHERE refcount <= 0")]
+                self._drop_unreferenced(connection, unreferenced)
+                known = {row[0] for row in connection.execute("SELECT hash FROM blobs")}
+                connection.commit()
+            finally:
+                connection.close()
+
+            for blob in self.objects_dir.glob("*/*/*"):
+                if blob.name not in known:
+                    blob.unlink(missing_ok=True)
+                    orphans += 1
+                elif stat.S_IMODE(blob.stat().st_mode) != BLOB_MODE:
+                    os.chmod(blob, BLOB_MODE)
+
+        deadline = time.time() - STAGING_EXPIRE_SECONDS
+        for staged in self.staging_dir.glob("*.tmp"):
+            try:
+                if staged.stat().st_mtime < deadline:
+                    staged.unlink()
+            except OSError:
+                continue
+        return {"stale_paths": stale, "dropped_blobs": len(unreferenced), "orphan_blobs": orphans}
+
+    def _stats(self) -> Dict[str, Any]:
+        connection = self._connect()
+        try:
+            blobs, stored, logical, references = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size * refcount), 0), "
+                "COALESCE(SUM(refcount), 0) FROM blobs"
+            ).fetchone()
+        finally:
+            connection.close()
+        return {
+            "enabled": self.enabled,
+            "blobs": blobs,
+            "files": references,
+            "stored_bytes": stored,
+            "logical_bytes": logical,
+            "saved_bytes": logical - stored,
+        }
+
+    # ---------- 异步接口 ----------
+
+    async def lookup(self, digest: str) -> Optional[Dict[str, Any]]:
+        """
+        查询内容是否已存在，返回 {sha256, size, refcount}，不存在时返回None
+        """
+        if not is_sha256(digest):
+            return None
+        return await run_in_threadpool(self._lookup, digest)
+
+    async def ingest(self, staged: Path, digest: str, size: int, target: Path) -> Dict[str, Any]:
+        """
+        把已计算哈希的暂存文件保存到目标路径
+        """
+        return await run_in_threadpool(self._ingest, staged, digest, size, target)
+
+    async def link_existing(self, digest: str, size: int, target: Path) -> Optional[Dict[str, Any]]:
+        """
+        内容已存在（哈希和大小都一致）时直接链接到目标路径（秒传），否则返回None
+        注意：知道哈希和大小即可取得内容，只适合用户之间相互信任的场景
+        """
+        known = await self.lookup(digest)
+        if known is None or known["size"] != size:
+            return None
+        try:
+            return await run_in_threadpool(self._ingest, None, digest, known["size"], target)
+        except FileNotFoundError:
+            # 查询之后blob恰好被删除
+            return None
+
+    async def save_stream(self, chunks: AsyncIterator[bytes], target: Path) -> Dict[str, Any]:
+        """
+        边接收边计算哈希并写入暂存文件，完成后保存到目标路径
+        """
+        staged = self.new_staging_path()
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with await anyio.open_file(staged, "wb") as file:
+                async for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await file.write(chunk)
+        except BaseException:
+            staged.unlink(missing_ok=True)
+            raise
+        return await self.ingest(staged, digest.hexdigest(), size, target)
+
+    async def release(self, path: Any) -> int:
+        """
+        文件或文件夹被删除后释放其中所有路径的引用，返回释放的数量
+        """
+        if not self.enabled:
+            return 0
+        return await run_in_threadpool(self._release, path)
+
+    async def move(self, source: Any, destination: Any) -> int:
+        """
+        文件或文件夹被移动后更新其中所有路径的映射，返回更新的数量
+        """
+        if not self.enabled:
+            return 0
+        return await run_in_threadpool(self._move, source, destination)
+
+    async def reconcile_async(self) -> Dict[str, int]:
+        return await run_in_threadpool(self.reconcile)
+
+    async def stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        return await run_in_threadpool(self._stats)
+
+    def start(self) -> None:
+        """
+        启动时在后台核对一次存储
+        """
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._startup_reconcile())
+
+    async def _startup_reconcile(self) -> None:
+        try:
+            result = await self.reconcile_async()
+            print(f"去重存储核对完成: {result}")
+        except Exception as e:
+            print(f"去重存储核对失败: {str(e)}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# 全局去重存储实例
+blob_store = BlobStore()
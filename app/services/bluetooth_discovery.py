@@ -0,0 +1,219 @@
+# 蓝牙设备发现服务
+# 后台持续进行BLE扫描（bleak的检测回调），把看到的设备连同最后出现时间和信号强度保存在内存表中，
+# 超过有效期未再出现的设备自动移除；传统蓝牙按配置定期扫描。
+# 扫描接口直接读取内存表，只有请求“重新扫描”或表中数据已过期时才实际扫描一次，
+# 多种类型需要扫描时同时进行（耗时取决于最慢的一种），结果按MAC合并；
+# 同一类型同时只进行一次扫描，并发请求共享结果；连接/断开设备时按MAC查表即可，不再重新扫描
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bleak import BleakScanner
+
+# 设备有效期（秒），超过该时间未再被扫描到的设备从表中移除
+DEVICE_TTL_SECONDS = float(os.environ.get("BLUETOOTH_DEVICE_TTL", "60"))
+# 是否在后台持续进行BLE扫描
+BACKGROUND_BLE_SCAN = os.environ.get("BLUETOOTH_BACKGROUND_SCAN", "1") == "1"
+# 传统蓝牙后台扫描间隔（秒），0表示不在后台扫描，只在请求时扫描
+CLASSIC_SCAN_INTERVAL = float(os.environ.get("BLUETOOTH_BT_SCAN_INTERVAL", "60"))
+# 后台BLE扫描持续多久之后认为表中数据完整（秒），与单次扫描的时长一致
+BLE_WARMUP_SECONDS = 5.0
+# 后台BLE扫描出错后重试的初始间隔和最大间隔（秒）
+BLE_RETRY_DELAY = 5.0
+BLE_MAX_RETRY_DELAY = 300.0
+# 清理过期设备的间隔（秒）
+PRUNE_INTERVAL = 1.0
+
+DEVICE_TYPE_BLE = "BLE"
+DEVICE_TYPE_BT = "BT"
+
+class BluetoothDiscovery:
+    """
+    蓝牙设备表与后台扫描
+    扫描方式通过 register 登记为 scan() -> 设备信息列表 的协程函数（BLE / BT）
+    """
+
+    def __init__(self, ttl: float = DEVICE_TTL_SECONDS, background_ble: bool = BACKGROUND_BLE_SCAN,
+                 classic_interval: float = CLASSIC_SCAN_INTERVAL):
+        self.ttl = ttl
+        self.background_ble = background_ble
+        self.classic_interval = classic_interval
+        self._sources: Dict[str, Callable[[], Awaitable[List[Dict[str, Any]]]]] = {}
+        # (类型, MAC) -> 设备信息（含 last_seen）
+        self._devices: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # 类型 -> 表中该类型数据最近一次完整更新的时间（monotonic）
+        self._refreshed: Dict[str, float] = {}
+        # 类型 -> 正在进行的扫描，并发请求共享同一次扫描
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, kind: str, scan: Callable[[], Awaitable[List[Dict[str, Any]]]]) -> None:
+        """
+        登记扫描方式
+        """
+        self._sources[kind] = scan
+
+    def _record(self, info: Dict[str, Any], seen_at: float) -> None:
+        key = (info["type"], info["mac"])
+        current = self._devices.get(key)
+        if current is not None:
+            # 本次没有拿到名称或信号强度时保留之前的值
+            if info.get("name") in (None, "", info["mac"], "Unknown"):
+                info = {**info, "name": current["name"]}
+            if info.get("rssi") is None:
+                info = {**info, "rssi": current["rssi"]}
+        self._devices[key] = {**info, "last_seen": seen_at}
+
+    def update(self, devices: List[Dict[str, Any]]) -> None:
+        """
+        记录一批扫描到的设备
+        """
+        now = time.time()
+        for info in devices:
+            self._record(info, now)
+
+    def _on_advertisement(self, device, advertisement_data) -> None:
+        """
+        后台BLE扫描的检测回调
+        """
+        self._record({
+            "id": device.address,
+            "name": device.name or advertisement_data.local_name or device.address,
+            "mac": device.address,
+            "rssi": advertisement_data.rssi,
+            "type": DEVICE_TYPE_BLE,
+        }, time.time())
+
+    def _prune(self) -> None:
+        expire_before = time.time() - self.ttl
+        for key in [key for key, info in self._devices.items() if info["last_seen"] < expire_before]:
+            del self._devices[key]
+
+    def is_current(self, kind: str) -> bool:
+        """
+        表中该类型的数据是否在有效期内
+        """
+        refreshed = self._refreshed.get(kind)
+        return refreshed is not None and time.monotonic() - refreshed < self.ttl
+
+    def devices(self, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        表中的设备（按信号强度从强到弱），不指定类型时同一MAC只保留一条（优先BLE）
+        """
+        self._prune()
+        by_mac: Dict[str, Dict[str, Any]] = {}
+        for (device_type, mac), info in self._devices.items():
+            if kind is not None and device_type != kind:
+                continue
+            if mac not in by_mac or device_type == DEVICE_TYPE_BLE:
+                by_mac[mac] = info
+        return sorted(by_mac.values(), key=lambda info: info["rssi"] if info["rssi"] is not None else -999, reverse=True)
+
+    def get(self, mac: str) -> Optional[Dict[str, Any]]:
+        """
+        按MAC查找设备（优先BLE），不存在或已过期时返回None
+        """
+        expire_before = time.time() - self.ttl
+        for kind in (DEVICE_TYPE_BLE, DEVICE_TYPE_BT):
+            info = self._devices.get((kind, mac))
+            if info is not None and info["last_seen"] >= expire_before:
+                return info
+        return None
+
+    async def scan(self, kind: str) -> List[Dict[str, Any]]:
+        """
+        立即扫描一次，结果合并到设备表中；同一类型已有扫描在进行时等待该次扫描的结果
+        """
+        pending = self._pending.get(kind)
+        if pending is None:
+            pending = asyncio.ensure_future(self._scan(kind))
+            self._pending[kind] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(kind, None))
+        # 某个请求断开时不取消其他请求也在等待的扫描
+        return await asyncio.shield(pending)
+
+    async def _scan(self, kind: str) -> List[Dict[str, Any]]:
+        devices = await self._sources[kind]()
+        self.update(devices)
+        self._refreshed[kind] = time.monotonic()
+        return devices
+
+    async def get_devices(self, kind: Optional[str] = None, fresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        获取设备列表：fresh为True或表中数据已过期时先扫描一次，否则直接读取设备表
+        """
+        self.start()
+        kinds = [kind] if kind is not None else list(self._sources)
+        stale = [k for k in kinds if fresh or not self.is_current(k)]
+        # 各类型同时扫描，某一种失败时其他类型的结果仍然写入设备表，再抛出错误
+        results = await asyncio.gather(*(self.scan(k) for k in stale), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return self.devices(kind)
+
+    async def _run_ble(self) -> None:
+        """
+        后台持续BLE扫描，出错（如没有蓝牙适配器）时按指数退避重试
+        """
+        delay = BLE_RETRY_DELAY
+        while True:
+            try:
+                scanner = BleakScanner(detection_callback=self._on_advertisement)
+                await scanner.start()
+                started = time.monotonic()
+                delay = BLE_RETRY_DELAY
+                try:
+                    while True:
+                        await asyncio.sleep(PRUNE_INTERVAL)
+                        if time.monotonic() - started >= BLE_WARMUP_SECONDS:
+                            self._refreshed[DEVICE_TYPE_BLE] = time.monotonic()
+                        self._prune()
+                finally:
+                    await scanner.stop()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"后台BLE扫描失败: {str(e)}，{delay:.0f}秒后重试")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, BLE_MAX_RETRY_DELAY)
+
+    async def _run_periodic(self, kind: str, interval: float) -> None:
+        """
+        定期扫描指定类型
+        """
+        while True:
+            try:
+                await self.scan(kind)
+            except Exception as e:
+                print(f"后台{kind}扫描失败: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def start(self) -> None:
+        """
+        启动后台扫描（需在事件循环中调用，重复调用无影响）
+        """
+        if self._tasks:
+            return
+        if self.background_ble and DEVICE_TYPE_BLE in self._sources:
+            self._tasks.append(asyncio.create_task(self._run_ble()))
+        if self.classic_interval > 0 and DEVICE_TYPE_BT in self._sources:
+            self._tasks.append(asyncio.create_task(self._run_periodic(DEVICE_TYPE_BT, self.classic_interval)))
+
+    async def stop(self) -> None:
+        """
+        停止后台扫描
+        """
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+# 全局蓝牙设备发现服务实例
+bluetooth_discovery = BluetoothDiscovery()
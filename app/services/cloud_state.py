@@ -0,0 +1,368 @@
+# 云盘用户设置、登录会话与后台任务状态存储
+# 挂载路径和登录会话原先保存在各进程的内存里，多worker部署时每个进程看到的不一样，重启后也会丢失。
+# 默认保存在应用数据库中（cloud_user_settings / cloud_sessions / cloud_jobs 表），各进程保留一份读缓存：
+#   - 挂载路径：整张表缓存在内存中，请求中直接读取；修改设置时在同一事务中把修订号加一，
+#     后台每隔几秒检查一次修订号，其他进程修改后重新加载；本进程的修改立即生效
+#   - 会话：按令牌缓存几秒，注销后其他进程最迟在缓存过期后失效
+#   - 后台任务：任务在提交它的进程中执行，状态快照定期写入共享存储，其他进程据此查询任务状态；
+#     其他进程请求取消时只设置标记，由执行任务的进程处理
+# 通过环境变量 CLOUD_STATE_BACKEND=memory 可切换为原来的进程内存储（单进程开发调试用）
+
+import abc
+import asyncio
+import json
+import os
+import secrets
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.database.database import AsyncSessionLocal
+from app.models.cloud import CloudJob, CloudSession, CloudStateRevision, CloudUserSetting
+
+# 存储后端：database / memory
+CLOUD_STATE_BACKEND = os.environ.get("CLOUD_STATE_BACKEND", "database").lower()
+# 登录会话有效期（秒）
+SESSION_TTL_SECONDS = int(os.environ.get("CLOUD_SESSION_TTL", str(7 * 24 * 3600)))
+# 检查其他进程修改的间隔（秒）
+STATE_REFRESH_INTERVAL = float(os.environ.get("CLOUD_STATE_REFRESH_SECONDS", "2"))
+# 会话读缓存时间（秒）
+SESSION_CACHE_TTL = 5.0
+# 清理过期会话的间隔（秒）
+SESSION_CLEANUP_INTERVAL = 600.0
+# 挂载路径设置的修订号名称
+SETTINGS_REVISION = "settings"
+# 已结束任务的保留时间（秒）
+JOB_RETENTION_SECONDS = 24 * 3600
+# 执行中的任务超过该时间没有刷新状态，认为执行它的进程已退出（秒）
+JOB_LOST_SECONDS = 60.0
+# 任务结束状态（与 job_queue 中的定义一致）
+JOB_FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+class CloudStateStore(abc.ABC):
+    """
+    云盘状态存储接口
+    mount_paths 是 用户名 -> 挂载路径 的只读视图（普通dict，请求中同步读取），修改需调用 set_mount_path
+    """
+
+    def __init__(self, session_ttl: int = SESSION_TTL_SECONDS):
+        self.session_ttl = session_ttl
+        self.mount_paths: Dict[str, str] = {}
+
+    async def load(self) -> None:
+        """
+        加载已保存的状态
+        """
+
+    async def set_mount_path(self, username: str, mount_path: str) -> None:
+        self.mount_paths[username] = mount_path
+
+    @abc.abstractmethod
+    async def create_session(self, username: str) -> str:
+        """
+        创建会话，返回会话令牌
+        """
+
+    @abc.abstractmethod
+    async def get_session_user(self, token: Optional[str]) -> Optional[str]:
+        """
+        返回会话对应的用户名，会话不存在或已过期时返回None
+        """
+
+    @abc.abstractmethod
+    async def delete_session(self, token: Optional[str]) -> None:
+        """
+        删除会话
+        """
+
+    async def save_jobs(self, jobs: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """
+        写入任务状态快照 [(用户名, 任务状态)]，进程内存储不需要（任务只在本进程内可见）
+        """
+
+    async def get_job(self, job_id: str, username: str) -> Optional[Dict[str, Any]]:
+        """
+        其他进程执行的任务状态，不存在时返回None
+        """
+        return None
+
+    async def list_jobs(self, username: str) -> List[Dict[str, Any]]:
+        """
+        用户在所有进程中的任务状态（最新的在前）
+        """
+        return []
+
+    async def request_job_cancel(self, job_id: str) -> bool:
+        """
+        请求取消其他进程执行的任务，任务已结束或不存在时返回False
+        """
+        return False
+
+    async def cancel_requests(self, job_ids: List[str]) -> List[str]:
+        """
+        job_ids中被其他进程请求取消的任务
+        """
+        return []
+
+    def start(self) -> None:
+        """
+        启动后台同步任务
+        """
+
+    async def stop(self) -> None:
+        """
+        停止后台同步任务
+        """
+
+class MemoryCloudStateStore(CloudStateStore):
+    """
+    进程内存储，重启后丢失，多进程之间不共享
+    """
+
+    def __init__(self, session_ttl: int = SESSION_TTL_SECONDS):
+        super().__init__(session_ttl)
+        self._sessions: Dict[str, Tuple[str, float]] = {}
+
+    async def create_session(self, username: str) -> str:
+        token = secrets.token_urlsafe(32)
+        self._sessions[token] = (username, time.time() + self.session_ttl)
+        return token
+
+    async def get_session_user(self, token: Optional[str]) -> Optional[str]:
+        session = self._sessions.get(token) if token else None
+        if session is None or session[1] < time.time():
+            return None
+        return session[0]
+
+    async def delete_session(self, token: Optional[str]) -> None:
+        if token:
+            self._sessions.pop(token, None)
+
+class DatabaseCloudStateStore(CloudStateStore):
+    """
+    保存在应用数据库中的共享存储（带进程内读缓存）
+    """
+
+    def __init__(self, session_ttl: int = SESSION_TTL_SECONDS, refresh_interval: float = STATE_REFRESH_INTERVAL):
+        super().__init__(session_ttl)
+        self.refresh_interval = refresh_interval
+        # 令牌 -> (用户名, 会话过期时间, 缓存过期时间)
+        self._session_cache: Dict[str, Tuple[str, float, float]] = {}
+        # 已加载的设置修订号
+        self._version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _settings_version(self, db) -> int:
+        revision = (await db.execute(
+            select(CloudStateRevision.revision).where(CloudStateRevision.name == SETTINGS_REVISION)
+        )).scalar()
+        return revision or 0
+
+    async def _ensure_revision(self) -> None:
+        """
+        创建修订号行（多个进程同时启动时只有一个能插入成功）
+        """
+        async with AsyncSessionLocal() as db:
+            if await db.get(CloudStateRevision, SETTINGS_REVISION) is not None:
+                return
+            db.add(CloudStateRevision(name=SETTINGS_REVISION, revision=0))
+            try:
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+
+    async def load(self) -> None:
+        """
+        重新加载全部挂载路径（原地替换内容，其他模块持有的引用保持有效）
+        """
+        if self._version is None:
+            await self._ensure_revision()
+        async with AsyncSessionLocal() as db:
+            version = await self._settings_version(db)
+            rows = (await db.execute(select(CloudUserSetting.username, CloudUserSetting.mount_path))).all()
+        mount_paths = {username: mount_path for username, mount_path in rows if mount_path}
+        # 两步之间没有await，请求不会看到清空后的中间状态
+        self.mount_paths.clear()
+        self.mount_paths.update(mount_paths)
+        self._version = version
+
+    async def refresh(self) -> bool:
+        """
+        其他进程修改过设置时重新加载，返回是否重新加载
+        """
+        async with AsyncSessionLocal() as db:
+            version = await self._settings_version(db)
+        if version == self._version:
+            return False
+        await self.load()
+        return True
+
+    async def set_mount_path(self, username: str, mount_path: str) -> None:
+        async with AsyncSessionLocal() as db:
+            setting = await db.get(CloudUserSetting, username)
+            if setting is None:
+                setting = CloudUserSetting(username=username)
+                db.add(setting)
+            setting.mount_path = mount_path
+            setting.updated_at = time.time()
+            # 与设置在同一事务中递增修订号（数据库中自增，并发修改时依次加一），提交后其他进程一定能发现变化
+            await db.execute(
+                update(CloudStateRevision)
+                .where(CloudStateRevision.name == SETTINGS_REVISION)
+                .values(revision=CloudStateRevision.revision + 1)
+            )
+            await db.commit()
+        self.mount_paths[username] = mount_path
+
+    async def create_session(self, username: str) -> str:
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        async with AsyncSessionLocal() as db:
+            db.add(CloudSession(token=token, username=username, created_at=now, expires_at=now + self.session_ttl))
+            await db.commit()
+        self._session_cache[token] = (username, now + self.session_ttl, time.monotonic() + SESSION_CACHE_TTL)
+        return token
+
+    async def get_session_user(self, token: Optional[str]) -> Optional[str]:
+        """
+        根据令牌获取用户名，令牌无效或已过期时返回None
+        """
+        if not token:
+            return None
+        cached = self._session_cache.get(token)
+        if cached is None or cached[2] < time.monotonic():
+            async with AsyncSessionLocal() as db:
+                session = await db.get(CloudSession, token)
+            if session is None:
+                self._session_cache.pop(token, None)
+                return None
+            cached = (session.username, session.expires_at, time.monotonic() + SESSION_CACHE_TTL)
+            self._session_cache[token] = cached
+        if cached[1] < time.time():
+            return None
+        return cached[0]
+
+    async def delete_session(self, token: Optional[str]) -> None:
+        if not token:
+            return
+        self._session_cache.pop(token, None)
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(CloudSession).where(CloudSession.token == token))
+            await db.commit()
+
+    async def cleanup_sessions(self) -> int:
+        """
+        删除过期会话
+        """
+        now = time.time()
+        self._session_cache = {
+            token: cached for token, cached in self._session_cache.items() if cached[1] >= now
+        }
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(delete(CloudSession).where(CloudSession.expires_at < now))
+            await db.commit()
+        return result.rowcount
+
+    async def save_jobs(self, jobs: List[Tuple[str, Dict[str, Any]]]) -> None:
+        now = time.time()
+        async with AsyncSessionLocal() as db:
+            for username, job in jobs:
+                row = await db.get(CloudJob, job["id"])
+                if row is None:
+                    row = CloudJob(id=job["id"], username=username, created_at=job["created_at"], cancel_requested=False)
+                    db.add(row)
+                row.status = job["status"]
+                row.snapshot = json.dumps(job, ensure_ascii=False)
+                row.updated_at = now
+            await db.commit()
+
+    @staticmethod
+    def _job_snapshot(row: CloudJob) -> Dict[str, Any]:
+        job = json.loads(row.snapshot)
+        if row.status not in JOB_FINISHED_STATES and row.updated_at < time.time() - JOB_LOST_SECONDS:
+            # 执行任务的进程已退出（重启或崩溃），任务不会再继续
+            job.update(status="failed", error="执行任务的进程已退出", finished_at=row.updated_at)
+        return job
+
+    async def get_job(self, job_id: str, username: str) -> Optional[Dict[str, Any]]:
+        async with AsyncSessionLocal() as db:
+            row = await db.get(CloudJob, job_id)
+        if row is None or row.username != username:
+            return None
+        return self._job_snapshot(row)
+
+    async def list_jobs(self, username: str) -> List[Dict[str, Any]]:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(CloudJob).where(CloudJob.username == username).order_by(CloudJob.created_at.desc())
+            )).scalars().all()
+        return [self._job_snapshot(row) for row in rows]
+
+    async def request_job_cancel(self, job_id: str) -> bool:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(CloudJob)
+                .where(CloudJob.id == job_id, CloudJob.status.notin_(JOB_FINISHED_STATES))
+                .values(cancel_requested=True)
+            )
+            await db.commit()
+        return result.rowcount > 0
+
+    async def cancel_requests(self, job_ids: List[str]) -> List[str]:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(CloudJob.id).where(CloudJob.id.in_(job_ids), CloudJob.cancel_requested.is_(True))
+            )).all()
+        return [row[0] for row in rows]
+
+    async def cleanup_jobs(self) -> int:
+        """
+        删除已结束（或执行进程已退出）且超过保留时间的任务
+        """
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(CloudJob).where(CloudJob.updated_at < time.time() - JOB_RETENTION_SECONDS)
+            )
+            await db.commit()
+        return result.rowcount
+
+    async def _run(self) -> None:
+        next_cleanup = 0.0
+        while True:
+            try:
+                await self.refresh()
+                if time.monotonic() >= next_cleanup:
+                    await self.cleanup_sessions()
+                    await self.cleanup_jobs()
+                    next_cleanup = time.monotonic() + SESSION_CLEANUP_INTERVAL
+            except Exception as e:
+                print(f"同步云盘设置失败: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+def create_cloud_state_store(backend: str = CLOUD_STATE_BACKEND) -> CloudStateStore:
+    """
+    按配置创建存储后端
+    """
+    if backend == "memory":
+        return MemoryCloudStateStore()
+    if backend == "database":
+        return DatabaseCloudStateStore()
+    raise ValueError(f"未知的云盘状态存储后端: {backend}")
+
+# 全局云盘状态存储实例
+cloud_state = create_cloud_state_store()
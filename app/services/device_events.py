@@ -0,0 +1,92 @@
+# 设备状态事件中心
+# DeviceService 在设备创建、更新、状态变化和删除后发布增量事件，
+# WebSocket/SSE 订阅者只接收变化部分，空闲的控制台不再需要轮询整张设备表
+
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+
+# 每个订阅者最多积压的事件数量，超过后丢弃积压并通知客户端重新同步
+DEFAULT_QUEUE_SIZE = 1000
+
+class DeviceEventSubscription:
+    """
+    单个订阅者，持有自己的事件队列和所属事件循环
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue_size: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def deliver(self, event: Dict[str, Any]) -> None:
+        """
+        投递事件（在订阅者的事件循环中执行）
+        队列已满说明客户端消费过慢，清空积压并改为发送重新同步事件
+        """
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+    async def get(self) -> Dict[str, Any]:
+        """
+        等待下一个事件
+        """
+        return await self.queue.get()
+
+class DeviceEventHub:
+    """
+    设备事件发布/订阅中心
+    publish 可在线程池中的同步代码里调用，事件通过 call_soon_threadsafe 投递到订阅者的事件循环
+    """
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: List[DeviceEventSubscription] = []
+        self._lock = threading.Lock()
+
+    @property
+    def subscriber_count(self) -> int:
+        """
+        当前订阅者数量
+        """
+        return len(self._subscribers)
+
+    def subscribe(self) -> DeviceEventSubscription:
+        """
+        新建订阅（需在事件循环中调用）
+        """
+        subscription = DeviceEventSubscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: DeviceEventSubscription) -> None:
+        """
+        取消订阅
+        """
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscription]
+
+    def publish(self, event_type: str, data: Optional[Dict[str, Any]] = None, **fields: Any) -> None:
+        """
+        发布事件，没有订阅者时直接返回
+        """
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+
+        event = {"type": event_type, **fields}
+        if data is not None:
+            event["data"] = data
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # 订阅者的事件循环已关闭
+                self.unsubscribe(subscription)
+
+# 全局设备事件中心实例
+device_event_hub = DeviceEventHub()
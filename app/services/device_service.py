@@ -1,14 +1,170 @@
 # 设备服务层，处理设备相关的业务逻辑
 
-from typing import List, Optional, Dict, Any
-from sqlalchemy.orm import Session
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Iterable, Tuple, Hashable
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
 from datetime import datetime
 
 from app.models.device import Device, DeviceType
 from app.schemas.device import (
     DeviceTypeCreate, DeviceTypeUpdate,
-    DeviceCreate, DeviceUpdate, DeviceStatusUpdate
+    DeviceCreate, DeviceUpdate, DeviceStatusUpdate,
+    DeviceBulkUpdateItem
 )
+from app.services.pagination import paginate
+from app.services.telemetry_service import TelemetryService
+from app.services.device_events import device_event_hub
+from app.services.json_patch import JsonPatchConflict, build_json_patch_expression, build_merge_patch_expression
+
+# 设备类型缓存：类型很少变化，缓存时间较长
+DEVICE_TYPE_CACHE_TTL = 300.0
+DEVICE_TYPE_CACHE_SIZE = 1024
+# 设备缓存（按设备唯一标识符）
+DEVICE_CACHE_TTL = 30.0
+DEVICE_CACHE_SIZE = 10000
+
+class LRUCache:
+    """
+    带过期时间和容量上限的线程安全LRU缓存
+    缓存的是实体的列值字典而不是ORM对象，避免跨会话共享实例
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存，不存在或已过期时返回None
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Dict[str, Any]) -> None:
+        """
+        写入缓存，超过容量时淘汰最久未使用的条目
+        """
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """
+        删除指定的缓存条目
+        """
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+# 设备类型缓存，键为 ("id", 设备类型ID) 或 ("name", 设备类型名称)
+device_type_cache = LRUCache(DEVICE_TYPE_CACHE_SIZE, DEVICE_TYPE_CACHE_TTL)
+# 设备缓存，键为设备唯一标识符
+device_cache = LRUCache(DEVICE_CACHE_SIZE, DEVICE_CACHE_TTL)
+
+class DeviceVersionConflict(Exception):
+    """
+    设备版本号与请求中的期望版本不一致（乐观并发控制冲突）
+    """
+
+    def __init__(self, current_version: int):
+        super().__init__(f"设备数据已被修改，当前版本为 {current_version}")
+        self.current_version = current_version
+
+def _column_values(instance: Any) -> Dict[str, Any]:
+    """
+    提取ORM对象的全部列值
+    """
+    return {attr.key: getattr(instance, attr.key) for attr in instance.__mapper__.column_attrs}
+
+def _attach_cached(db: Session, model: Any, values: Dict[str, Any]) -> Any:
+    """
+    用缓存的列值在当前会话中还原ORM对象，不发出SQL
+    """
+    # 会话中已有该对象时直接复用，避免用缓存值覆盖会话内较新的状态
+    existing = db.identity_map.get(identity_key(model, values["id"]))
+    if existing is not None:
+        return existing
+    instance = model(**copy.deepcopy(values))
+    make_transient_to_detached(instance)
+    return db.merge(instance, load=False)
+
+def _cache_device_type(device_type: DeviceType) -> None:
+    """
+    按ID和名称两个键缓存设备类型
+    """
+    values = _column_values(device_type)
+    device_type_cache.set(("id", device_type.id), values)
+    device_type_cache.set(("name", device_type.name), values)
+
+def invalidate_device_cache(*device_unique_ids: str) -> None:
+    """
+    使指定设备唯一标识符的缓存失效
+    """
+    device_cache.invalidate(*device_unique_ids)
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    获取设备相关缓存的统计信息
+    """
+    return {
+        "device_type": device_type_cache.stats(),
+        "device": device_cache.stats(),
+    }
+
+def _publish_device_change(event_type: str, device: Device) -> None:
+    """
+    向设备事件中心发布完整的设备数据，没有订阅者时不做序列化
+    """
+    if device_event_hub.subscriber_count:
+        device_event_hub.publish(event_type, data=device.to_dict())
+
+def _publish_device_type_change(event_type: str, device_type: DeviceType) -> None:
+    """
+    向设备事件中心发布完整的设备类型数据，没有订阅者时不做序列化
+    """
+    if device_event_hub.subscriber_count:
+        device_event_hub.publish(event_type, data=device_type.to_dict())
 
 class DeviceTypeService:
     """
@@ -24,28 +180,56 @@ class DeviceTypeService:
         db.add(db_device_type)
         db.commit()
         db.refresh(db_device_type)
+        _publish_device_type_change("device_type.created", db_device_type)
         return db_device_type
     
     @staticmethod
     def get_device_type(db: Session, device_type_id: int) -> Optional[DeviceType]:
         """
-        根据ID获取设备类型
+        根据ID获取设备类型（优先读取缓存）
         """
-        return db.query(DeviceType).filter(DeviceType.id == device_type_id).first()
+        cached = device_type_cache.get(("id", device_type_id))
+        if cached is not None:
+            return _attach_cached(db, DeviceType, cached)
+        
+        device_type = db.query(DeviceType).filter(DeviceType.id == device_type_id).first()
+        if device_type:
+            _cache_device_type(device_type)
+        return device_type
     
     @staticmethod
     def get_device_type_by_name(db: Session, name: str) -> Optional[DeviceType]:
         """
-        根据名称获取设备类型
+        根据名称获取设备类型（优先读取缓存）
+        """
+        cached = device_type_cache.get(("name", name))
+        if cached is not None:
+            return _attach_cached(db, DeviceType, cached)
+        
+        device_type = db.query(DeviceType).filter(DeviceType.name == name).first()
+        if device_type:
+            _cache_device_type(device_type)
+        return device_type
+    
+    @staticmethod
+    def get_device_types(db: Session, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[DeviceType], Optional[str]]:
         """
-        return db.query(DeviceType).filter(DeviceType.name == name).first()
+        获取设备类型列表（游标分页）
+        返回 (设备类型列表, 下一页游标)
+        """
+        return paginate(db.query(DeviceType), DeviceType.id, cursor, limit)
     
     @staticmethod
-    def get_device_types(db: Session, skip: int = 0, limit: int = 100) -> List[DeviceType]:
+    def get_device_type_map(db: Session, device_type_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
         """
-        获取所有设备类型列表
+        批量获取设备类型，返回 设备类型ID -> 设备类型字典 的映射
+        只执行一条 IN 查询，用于序列化设备列表时构建嵌套的设备类型
         """
-        return db.query(DeviceType).offset(skip).limit(limit).all()
+        ids = {device_type_id for device_type_id in device_type_ids if device_type_id is not None}
+        if not ids:
+            return {}
+        device_types = db.query(DeviceType).filter(DeviceType.id.in_(ids)).all()
+        return {device_type.id: device_type.to_dict() for device_type in device_types}
     
     @staticmethod
     def update_device_type(db: Session, device_type_id: int, device_type_data: DeviceTypeUpdate) -> Optional[DeviceType]:
@@ -56,12 +240,15 @@ class DeviceTypeService:
         if not db_device_type:
             return None
         
+        old_name = db_device_type.name
         update_data = device_type_data.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_device_type, field, value)
         
         db.commit()
+        device_type_cache.invalidate(("id", device_type_id), ("name", old_name), ("name", db_device_type.name))
         db.refresh(db_device_type)
+        _publish_device_type_change("device_type.updated", db_device_type)
         return db_device_type
     
     @staticmethod
@@ -77,8 +264,11 @@ class DeviceTypeService:
         if db_device_type.devices:
             raise ValueError("无法删除该设备类型，因为有设备正在使用它")
         
+        device_type_name = db_device_type.name
         db.delete(db_device_type)
         db.commit()
+        device_type_cache.invalidate(("id", device_type_id), ("name", device_type_name))
+        device_event_hub.publish("device_type.deleted", id=device_type_id)
         return True
 
 class DeviceService:
@@ -99,7 +289,9 @@ class DeviceService:
         db_device = Device(**device_data.model_dump())
         db.add(db_device)
         db.commit()
+        invalidate_device_cache(db_device.device_id)
         db.refresh(db_device)
+        _publish_device_change("device.created", db_device)
         return db_device
     
     @staticmethod
@@ -112,23 +304,62 @@ class DeviceService:
     @staticmethod
     def get_device_by_device_id(db: Session, device_id: str) -> Optional[Device]:
         """
-        根据设备唯一标识符获取设备
+        根据设备唯一标识符获取设备（优先读取缓存）
+        """
+        cached = device_cache.get(device_id)
+        if cached is not None:
+            return _attach_cached(db, Device, cached)
+        
+        device = db.query(Device).filter(Device.device_id == device_id).first()
+        if device:
+            device_cache.set(device_id, _column_values(device))
+        return device
+    
+    @staticmethod
+    def get_devices(
+        db: Session, cursor: Optional[str] = None, limit: int = 100
+    ) -> Tuple[List[Device], Optional[str]]:
+        """
+        获取设备列表（游标分页）
+        设备类型不随设备加载，序列化时由 serialize_devices 批量查询
+        返回 (设备列表, 下一页游标)
+        """
+        return paginate(db.query(Device), Device.id, cursor, limit)
+    
+    @staticmethod
+    def get_devices_by_type(
+        db: Session, device_type_id: int, cursor: Optional[str] = None, limit: int = 100
+    ) -> Tuple[List[Device], Optional[str]]:
+        """
+        根据设备类型获取设备列表（游标分页）
+        返回 (设备列表, 下一页游标)
         """
-        return db.query(Device).filter(Device.device_id == device_id).first()
+        query = db.query(Device).filter(Device.device_type_id == device_type_id)
+        return paginate(query, Device.id, cursor, limit)
     
     @staticmethod
-    def get_devices(db: Session, skip: int = 0, limit: int = 100) -> List[Device]:
+    def serialize_devices(db: Session, devices: List[Device]) -> List[Dict[str, Any]]:
         """
-        获取所有设备列表
+        将设备列表转换为字典列表
+        设备类型通过一次批量查询构建的映射填充，每种设备类型只序列化一次，
+        无论设备数量多少，SQL语句数量都是固定的
         """
-        return db.query(Device).offset(skip).limit(limit).all()
+        device_type_map = DeviceTypeService.get_device_type_map(
+            db, (device.device_type_id for device in devices)
+        )
+        return [device.to_dict(device_type_map=device_type_map) for device in devices]
     
     @staticmethod
-    def get_devices_by_type(db: Session, device_type_id: int) -> List[Device]:
+    def build_snapshot(db: Session) -> Dict[str, Any]:
         """
-        根据设备类型获取设备列表
+        构建全部设备类型和设备的快照，作为事件订阅的初始数据
         """
-        return db.query(Device).filter(Device.device_type_id == device_type_id).all()
+        device_types = db.query(DeviceType).order_by(DeviceType.id).all()
+        devices = db.query(Device).order_by(Device.id).all()
+        return {
+            "device_types": [device_type.to_dict() for device_type in device_types],
+            "devices": DeviceService.serialize_devices(db, devices),
+        }
     
     @staticmethod
     def update_device(db: Session, device_id: int, device_data: DeviceUpdate) -> Optional[Device]:
@@ -147,11 +378,15 @@ class DeviceService:
             if not device_type:
                 raise ValueError(f"设备类型ID {update_data['device_type_id']} 不存在")
         
+        old_device_id = db_device.device_id
         for field, value in update_data.items():
             setattr(db_device, field, value)
+        db_device.version = Device.version + 1
         
         db.commit()
+        invalidate_device_cache(old_device_id, db_device.device_id)
         db.refresh(db_device)
+        _publish_device_change("device.updated", db_device)
         return db_device
     
     @staticmethod
@@ -168,7 +403,18 @@ class DeviceService:
         db_device.last_online = status_data.last_online or datetime.utcnow()
         
         db.commit()
+        invalidate_device_cache(db_device.device_id)
         db.refresh(db_device)
+        device_event_hub.publish(
+            "device.patched",
+            id=db_device.id,
+            device_id=db_device.device_id,
+            changes={
+                "status": db_device.status,
+                "is_online": db_device.is_online,
+                "last_online": db_device.last_online.isoformat() if db_device.last_online else None,
+            },
+        )
         return db_device
     
     @staticmethod
@@ -180,8 +426,12 @@ class DeviceService:
         if not db_device:
             return False
         
+        device_unique_id = db_device.device_id
+        TelemetryService.delete_device_telemetry(db, device_id)
         db.delete(db_device)
         db.commit()
+        invalidate_device_cache(device_unique_id)
+        device_event_hub.publish("device.deleted", id=device_id, device_id=device_unique_id)
         return True
     
     @staticmethod
@@ -193,12 +443,220 @@ class DeviceService:
         if not db_device:
             return None
         
-        # 如果私有数据已存在，合并新数据
-        if db_device.private_data:
-            db_device.private_data.update(private_data)
-        else:
-            db_device.private_data = private_data
+        # 合并为新的字典再赋值，原地修改JSON列不会被标记为已变更
+        db_device.private_data = {**(db_device.private_data or {}), **private_data}
+        db_device.version = Device.version + 1
         
         db.commit()
+        invalidate_device_cache(db_device.device_id)
         db.refresh(db_device)
-        return db_device
\ No newline at end of file
+        device_event_hub.publish(
+            "device.patched",
+            id=db_device.id,
+            device_id=db_device.device_id,
+            changes={"private_data": db_device.private_data, "version": db_device.version},
+        )
+        return db_device
+    
+    @staticmethod
+    def patch_device_private_data(
+        db: Session,
+        device_id: int,
+        patch: Any,
+        patch_format: str = "merge",
+        expected_version: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        局部更新设备私有数据
+        patch_format 为 merge 时 patch 按 JSON Merge Patch 处理，为 json-patch 时是 JSON Patch 操作列表
+        修改由数据库的JSON函数在一条UPDATE中完成，不读取整个文档；传入 expected_version 时只在版本号一致时更新
+        设备不存在返回None，版本不一致抛出 DeviceVersionConflict，JSON Patch 的目标路径不存在抛出 JsonPatchConflict
+        """
+        table = Device.__table__
+        dialect = db.get_bind().dialect
+        conditions = []
+        if patch_format == "json-patch":
+            expression, conditions = build_json_patch_expression(dialect.name, table.c.private_data, patch)
+        else:
+            expression = build_merge_patch_expression(dialect.name, table.c.private_data, patch)
+        
+        stmt = update(table).where(table.c.id == device_id, *conditions).values(
+            private_data=expression,
+            version=table.c.version + 1,
+            updated_at=datetime.utcnow(),
+        )
+        if expected_version is not None:
+            stmt = stmt.where(table.c.version == expected_version)
+        
+        # 只有存在订阅者时才取回更新后的文档用于推送
+        publish = bool(device_event_hub.subscriber_count)
+        columns = [table.c.id, table.c.device_id, table.c.version]
+        if publish:
+            columns.append(table.c.private_data)
+        if dialect.update_returning:
+            row = db.execute(stmt.returning(*columns)).first()
+        else:
+            result = db.execute(stmt)
+            row = db.execute(select(*columns).where(table.c.id == device_id)).first() if result.rowcount else None
+        
+        if row is None:
+            db.rollback()
+            current_version = db.execute(select(table.c.version).where(table.c.id == device_id)).scalar()
+            if current_version is None:
+                return None
+            if expected_version is not None and current_version != expected_version:
+                raise DeviceVersionConflict(current_version)
+            raise JsonPatchConflict()
+        
+        db.commit()
+        invalidate_device_cache(row.device_id)
+        # 会话中已加载的设备对象不再是最新状态
+        existing = db.identity_map.get(identity_key(Device, device_id))
+        if existing is not None:
+            db.expire(existing)
+        if publish:
+            device_event_hub.publish(
+                "device.patched",
+                id=row.id,
+                device_id=row.device_id,
+                changes={"private_data": row.private_data, "version": row.version},
+            )
+        return {"id": row.id, "device_id": row.device_id, "version": row.version}
+    
+    @staticmethod
+    def _publish_devices(db: Session, event_type: str, device_ids: List[int]) -> None:
+        """
+        批量操作完成后逐个发布设备事件，没有订阅者时不查询
+        """
+        if not device_event_hub.subscriber_count or not device_ids:
+            return
+        devices = db.query(Device).filter(Device.id.in_(device_ids)).order_by(Device.id).all()
+        for data in DeviceService.serialize_devices(db, devices):
+            device_event_hub.publish(event_type, data=data)
+    
+    @staticmethod
+    def bulk_create_devices(db: Session, devices_data: List[DeviceCreate]) -> List[Dict[str, Any]]:
+        """
+        批量创建设备
+        设备唯一标识符和设备类型各用一条查询校验，合法的设备在同一个事务中以executemany方式插入
+        返回与请求顺序一致的逐项结果
+        """
+        requested_ids = [item.device_id for item in devices_data]
+        existing_ids = set(db.execute(
+            select(Device.device_id).where(Device.device_id.in_(set(requested_ids)))
+        ).scalars())
+        valid_type_ids = set(db.execute(
+            select(DeviceType.id).where(DeviceType.id.in_({item.device_type_id for item in devices_data}))
+        ).scalars())
+        
+        results: List[Dict[str, Any]] = []
+        rows: List[Dict[str, Any]] = []
+        seen_ids = set()
+        for index, item in enumerate(devices_data):
+            error = None
+            if item.device_id in existing_ids:
+                error = f"设备ID '{item.device_id}' 已存在"
+            elif item.device_id in seen_ids:
+                error = f"设备ID '{item.device_id}' 在请求中重复"
+            elif item.device_type_id not in valid_type_ids:
+                error = f"设备类型ID {item.device_type_id} 不存在"
+            
+            if error:
+                results.append({"index": index, "success": False, "device_id": item.device_id, "error": error})
+                continue
+            seen_ids.add(item.device_id)
+            rows.append(item.model_dump())
+            results.append({"index": index, "success": True, "device_id": item.device_id})
+        
+        if rows:
+            db.execute(insert(Device.__table__), rows)
+            created = dict(db.execute(
+                select(Device.device_id, Device.id).where(Device.device_id.in_(seen_ids))
+            ).all())
+            db.commit()
+            for result in results:
+                if result["success"]:
+                    result["id"] = created.get(result["device_id"])
+            invalidate_device_cache(*seen_ids)
+            DeviceService._publish_devices(db, "device.created", list(created.values()))
+        return results
+    
+    @staticmethod
+    def bulk_update_devices(db: Session, devices_data: List[DeviceBulkUpdateItem]) -> List[Dict[str, Any]]:
+        """
+        批量更新设备
+        设备和设备类型各用一条查询校验，更新字段相同的设备合并为一条executemany语句，在同一个事务中提交
+        返回与请求顺序一致的逐项结果
+        """
+        current_ids = dict(db.execute(
+            select(Device.id, Device.device_id).where(Device.id.in_({item.id for item in devices_data}))
+        ).all())
+        requested_type_ids = {item.device_type_id for item in devices_data if item.device_type_id is not None}
+        valid_type_ids = set(db.execute(
+            select(DeviceType.id).where(DeviceType.id.in_(requested_type_ids))
+        ).scalars()) if requested_type_ids else set()
+        
+        results: List[Dict[str, Any]] = []
+        # 更新字段集合 -> 参数列表
+        batches: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        updated_ids = []
+        now = datetime.utcnow()
+        for index, item in enumerate(devices_data):
+            update_data = item.model_dump(exclude_unset=True, exclude={"id"})
+            if item.id not in current_ids:
+                results.append({"index": index, "success": False, "id": item.id, "error": f"设备ID {item.id} 不存在"})
+                continue
+            if "device_type_id" in update_data and update_data["device_type_id"] not in valid_type_ids:
+                results.append({
+                    "index": index, "success": False, "id": item.id,
+                    "error": f"设备类型ID {update_data['device_type_id']} 不存在"
+                })
+                continue
+            
+            fields = tuple(sorted(update_data))
+            params = {f"b_{field}": value for field, value in update_data.items()}
+            params["b_id"] = item.id
+            params["b_updated_at"] = now
+            batches.setdefault(fields, []).append(params)
+            updated_ids.append(item.id)
+            results.append({"index": index, "success": True, "id": item.id, "device_id": current_ids[item.id]})
+        
+        if updated_ids:
+            table = Device.__table__
+            for fields, params in batches.items():
+                values = {field: bindparam(f"b_{field}") for field in fields}
+                values["updated_at"] = bindparam("b_updated_at")
+                values["version"] = table.c.version + 1
+                stmt = update(table).where(table.c.id == bindparam("b_id")).values(values)
+                db.execute(stmt, params)
+            db.commit()
+            invalidate_device_cache(*(current_ids[device_id] for device_id in updated_ids))
+            DeviceService._publish_devices(db, "device.updated", updated_ids)
+        return results
+    
+    @staticmethod
+    def bulk_delete_devices(db: Session, device_ids: List[int]) -> List[Dict[str, Any]]:
+        """
+        批量删除设备及其遥测数据，在同一个事务中提交
+        返回与请求顺序一致的逐项结果
+        """
+        current_ids = dict(db.execute(
+            select(Device.id, Device.device_id).where(Device.id.in_(set(device_ids)))
+        ).all())
+        
+        results = []
+        for index, device_id in enumerate(device_ids):
+            if device_id in current_ids:
+                results.append({"index": index, "success": True, "id": device_id, "device_id": current_ids[device_id]})
+            else:
+                results.append({"index": index, "success": False, "id": device_id, "error": f"设备ID {device_id} 不存在"})
+        
+        if current_ids:
+            ids = list(current_ids)
+            TelemetryService.delete_devices_telemetry(db, ids)
+            db.execute(delete(Device).where(Device.id.in_(ids)))
+            db.commit()
+            invalidate_device_cache(*current_ids.values())
+            for device_id, device_unique_id in current_ids.items():
+                device_event_hub.publish("device.deleted", id=device_id, device_id=device_unique_id)
+        return results
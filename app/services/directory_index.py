@@ -0,0 +1,140 @@
+# 云盘目录列表缓存
+# 使用 os.scandir 一次读取目录项，直接复用 DirEntry 自带的类型和stat信息，
+# 按目录缓存排序后的结果；本服务的上传/删除/新建文件夹会主动失效对应目录，
+# 其他程序对目录的修改通过目录mtime变化发现，另外设置过期时间兜底（文件内容被外部改写时目录mtime不变）
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+# 列表中需要过滤的系统保留文件/文件夹
+SYSTEM_RESERVED = {'$RECYCLE.BIN', 'System Volume Information', 'pagefile.sys', 'hiberfil.sys', 'swapfile.sys'}
+# 最多缓存的目录数量
+DIRECTORY_CACHE_SIZE = 256
+# 缓存过期时间（秒）
+DIRECTORY_CACHE_TTL = 30.0
+# 每页默认条数与上限
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 2000
+
+def scan_directory(path: str) -> List[Dict[str, Any]]:
+    """
+    读取目录内容，返回按“文件夹在前、名称不区分大小写”排序的目录项
+    """
+    items = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name in SYSTEM_RESERVED:
+                continue
+            try:
+                is_dir = entry.is_dir()
+                stat = entry.stat()
+            except (PermissionError, OSError):
+                # 跳过无权限访问的文件
+                continue
+            items.append({
+                "name": entry.name,
+                "is_dir": is_dir,
+                "size": None if is_dir else stat.st_size,
+                "modified": stat.st_mtime,
+            })
+    items.sort(key=lambda x: (not x["is_dir"], x["name"].lower()))
+    return items
+
+class DirectoryListingCache:
+    """
+    按目录缓存列表结果，目录mtime变化或过期后重新扫描
+    """
+
+    def __init__(self, max_size: int = DIRECTORY_CACHE_SIZE, ttl: float = DIRECTORY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # 目录绝对路径 -> (目录mtime_ns, 过期时间, 目录项列表)
+        self._data: "OrderedDict[str, Tuple[int, float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, path: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        检查缓存是否仍然有效（在线程中执行，需要stat目录）
+        """
+        with self._lock:
+            entry = self._data.get(path)
+        if entry is None:
+            return None
+        mtime_ns, expires_at, items = entry
+        if expires_at < time.monotonic() or os.stat(path).st_mtime_ns != mtime_ns:
+            return None
+        return items
+
+    def _load(self, path: str) -> List[Dict[str, Any]]:
+        items = self._lookup(path)
+        if items is not None:
+            self.hits += 1
+            return items
+
+        self.misses += 1
+        # 先取mtime再扫描，扫描期间发生的修改会在下次请求时被发现
+        mtime_ns = os.stat(path).st_mtime_ns
+        items = scan_directory(path)
+        with self._lock:
+            self._data[path] = (mtime_ns, time.monotonic() + self.ttl, items)
+            self._data.move_to_end(path)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return items
+
+    async def list_directory(self, path: str) -> List[Dict[str, Any]]:
+        """
+        获取目录的全部目录项（已排序），扫描在线程池中进行，不阻塞事件循环
+        """
+        return await run_in_threadpool(self._load, os.path.abspath(path))
+
+    async def list_page(self, path: str, offset: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        分页获取目录项，返回 (当前页目录项, 总条数)
+        """
+        items = await self.list_directory(path)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        return items[offset:offset + limit], len(items)
+
+    def invalidate(self, *paths: Any) -> None:
+        """
+        使指定目录的缓存失效
+        """
+        with self._lock:
+            for path in paths:
+                self._data.pop(os.path.abspath(str(path)), None)
+
+    def invalidate_tree(self, path: Any) -> None:
+        """
+        使目录本身、其父目录以及所有子目录的缓存失效（删除或移动整个目录时使用）
+        """
+        root = os.path.abspath(str(path))
+        prefix = root.rstrip(os.sep) + os.sep
+        with self._lock:
+            for cached in [p for p in self._data if p == root or p.startswith(prefix)]:
+                del self._data[cached]
+            self._data.pop(os.path.dirname(root), None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+# 全局目录列表缓存实例
+directory_cache = DirectoryListingCache()
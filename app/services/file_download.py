@@ -0,0 +1,215 @@
+# 文件下载响应：支持断点续传和条件请求
+# Range（单区间/多区间，multipart/byteranges）、If-Range、
+# ETag/Last-Modified 以及 If-None-Match/If-Modified-Since 返回304，
+# 视频拖动、下载工具续传和浏览器缓存都只传输缺少的部分
+
+import mimetypes
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+# 每次读取的块大小
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 单个请求最多接受的区间数量，超过时忽略Range返回完整文件
+MAX_RANGES = 32
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """
+    根据修改时间和大小生成强ETag
+    """
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    """
+    判断请求头中的ETag列表是否包含当前ETag
+    weak为True时使用弱比较（忽略W/前缀），否则使用强比较（弱ETag永远不匹配）
+    """
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def _http_date_to_timestamp(value: str) -> Optional[int]:
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+def parse_range_header(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    解析Range请求头，返回按起点排序并合并重叠后的闭区间列表 [(start, end), ...]
+    格式无法识别时返回None（按完整文件处理），全部区间都不可满足时返回空列表（416）
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+    for part in parts:
+        start_text, sep, end_text = part.strip().partition("-")
+        start_text, end_text = start_text.strip(), end_text.strip()
+        if not sep or not (start_text.isdigit() or start_text == "") or not (end_text.isdigit() or end_text == ""):
+            return None
+        if start_text == "":
+            # 后缀区间：最后N个字节
+            if end_text == "":
+                return None
+            length = int(end_text)
+            if length == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+        else:
+            start = int(start_text)
+            if end_text and int(end_text) < start:
+                return None
+            if start >= size:
+                continue
+            end = min(int(end_text), size - 1) if end_text else size - 1
+            ranges.append((start, end))
+
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+async def _read_range(path: str, start: int, end: int) -> AsyncIterator[bytes]:
+    """
+    异步读取文件的 [start, end] 区间
+    """
+    async with await anyio.open_file(path, "rb") as file:
+        await file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+async def _read_multipart(
+    path: str, ranges: List[Tuple[int, int]], size: int, content_type: str, boundary: str
+) -> AsyncIterator[bytes]:
+    """
+    按 multipart/byteranges 格式依次输出多个区间
+    """
+    for start, end in ranges:
+        yield (
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode("latin-1")
+        async for chunk in _read_range(path, start, end):
+            yield chunk
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode("latin-1")
+
+def _multipart_length(ranges: List[Tuple[int, int]], size: int, content_type: str, boundary: str) -> int:
+    length = len(f"--{boundary}--\r\n")
+    for start, end in ranges:
+        length += len(
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ) + (end - start + 1) + 2
+    return length
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def _if_range_matches(if_range: str, etag: str, mtime: float) -> bool:
+    """
+    If-Range 可以是ETag（强比较）或HTTP日期（与Last-Modified完全相等）
+    """
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return _etag_matches(if_range, etag, weak=False)
+    since = _http_date_to_timestamp(if_range)
+    return since is not None and since == int(mtime)
+
+def _stream(body: Optional[AsyncIterator[bytes]], status_code: int, headers: Dict[str, str], media_type: str) -> Response:
+    if body is None:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(body, status_code=status_code, headers=headers, media_type=media_type)
+
+async def build_download_response(request: Request, path: str, filename: Optional[str] = None) -> Response:
+    """
+    构建文件下载响应
+    依次处理：条件请求（304）-> If-Range -> Range（206/416）-> 完整文件（200），HEAD请求不发送响应体
+    """
+    stat_result = await anyio.Path(path).stat()
+    size = stat_result.st_size
+    etag = make_etag(stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    content_type = mimetypes.guess_type(filename or path)[0] or "application/octet-stream"
+    headers: Dict[str, str] = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        # 浏览器可以缓存，但每次使用前都要用ETag向服务器确认
+        "Cache-Control": "private, no-cache",
+    }
+    if filename:
+        headers["Content-Disposition"] = content_disposition(filename)
+
+    # 条件请求：有If-None-Match时忽略If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag, weak=True):
+            return Response(status_code=304, headers=headers)
+    elif if_modified_since is not None:
+        since = _http_date_to_timestamp(if_modified_since)
+        if since is not None and int(stat_result.st_mtime) <= since:
+            return Response(status_code=304, headers=headers)
+
+    is_head = request.method == "HEAD"
+    range_header = request.headers.get("range")
+    ranges = None
+    if range_header is not None:
+        # If-Range 不匹配时说明文件已变化，返回完整文件
+        if_range = request.headers.get("if-range")
+        if if_range is None or _if_range_matches(if_range.strip(), etag, stat_result.st_mtime):
+            ranges = parse_range_header(range_header, size)
+
+    if ranges is not None and not ranges:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    if ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        body = None if is_head else _read_range(path, start, end)
+        return _stream(body, 206, headers, content_type)
+
+    if ranges:
+        boundary = uuid.uuid4().hex
+        headers["Content-Length"] = str(_multipart_length(ranges, size, content_type, boundary))
+        body = None if is_head else _read_multipart(path, ranges, size, content_type, boundary)
+        return _stream(body, 206, headers, f"multipart/byteranges; boundary={boundary}")
+
+    headers["Content-Length"] = str(size)
+    body = None if is_head or size == 0 else _read_range(path, 0, size - 1)
+    return _stream(body, 200, headers, content_type)
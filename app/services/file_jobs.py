@@ -0,0 +1,169 @@
+# 云盘后台文件操作：递归删除、复制、移动、创建目录
+# 以任务的形式在后台线程中执行（见 job_queue），每处理一个文件报告一次进度并检查是否已取消。
+# 复制（以及跨文件系统的移动）被取消或失败时删除已复制的部分；
+# 删除被取消时已经删除的文件无法恢复，剩余部分保留
+
+import errno
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict
+
+from app.services.job_queue import Job, job_queue
+
+def _count_entries(job: Job, path: Path) -> int:
+    """
+    统计文件和文件夹数量，作为进度的总数
+    """
+    if not path.is_dir() or path.is_symlink():
+        return 1
+    total = 1
+    for _, dirs, files in os.walk(path):
+        job.check_cancelled()
+        total += len(dirs) + len(files)
+    return total
+
+def _remove(job: Job, target: Path, cancellable: bool = True) -> int:
+    """
+    自底向上逐个删除，返回删除的数量
+    """
+    if not target.is_dir() or target.is_symlink():
+        target.unlink()
+        job.report(1)
+        return 1
+
+    done = 0
+    for current, dirs, files in os.walk(target, topdown=False):
+        for name in files:
+            if cancellable:
+                job.check_cancelled()
+            os.unlink(os.path.join(current, name))
+            done += 1
+            job.report(done)
+        for name in dirs:
+            if cancellable:
+                job.check_cancelled()
+            child = os.path.join(current, name)
+            # 指向文件夹的符号链接只删除链接本身
+            if os.path.islink(child):
+                os.unlink(child)
+            else:
+                os.rmdir(child)
+            done += 1
+            job.report(done)
+    target.rmdir()
+    job.report(done + 1)
+    return done + 1
+
+def remove_tree(job: Job, path: str) -> Dict[str, Any]:
+    """
+    删除文件或整个文件夹
+    """
+    target = Path(path)
+    if not target.exists() and not target.is_symlink():
+        raise FileNotFoundError(f"路径不存在: {path}")
+    job.report(0, _count_entries(job, target), "正在删除")
+    return {"removed": _remove(job, target)}
+
+def _copy(job: Job, source: Path, destination: Path) -> int:
+    done = 0
+    if not source.is_dir() or source.is_symlink():
+        job.check_cancelled()
+        shutil.copy2(source, destination, follow_symlinks=False)
+        job.report(1)
+        return 1
+
+    destination.mkdir()
+    done += 1
+    for current, dirs, files in os.walk(source):
+        relative = Path(current).relative_to(source)
+        for name in dirs:
+            job.check_cancelled()
+            child = Path(current) / name
+            if child.is_symlink():
+                shutil.copy2(child, destination / relative / name, follow_symlinks=False)
+            else:
+                (destination / relative / name).mkdir()
+            done += 1
+            job.report(done)
+        for name in files:
+            job.check_cancelled()
+            shutil.copy2(Path(current) / name, destination / relative / name, follow_symlinks=False)
+            done += 1
+            job.report(done)
+        shutil.copystat(current, destination / relative)
+    return done
+
+def _discard(path: Path) -> None:
+    """
+    删除复制了一半的目标
+    """
+    try:
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path)
+        elif path.exists() or path.is_symlink():
+            path.unlink()
+    except OSError as e:
+        print(f"清理未完成的复制失败 {path}: {str(e)}")
+
+def copy_tree(job: Job, source: str, destination: str) -> Dict[str, Any]:
+    """
+    复制文件或文件夹，目标路径不能已存在
+    """
+    source_path, destination_path = Path(source), Path(destination)
+    if not source_path.exists():
+        raise FileNotFoundError(f"路径不存在: {source}")
+    if destination_path.exists() or destination_path.is_symlink():
+        raise FileExistsError(f"目标已存在: {destination}")
+    if source_path.is_dir() and destination_path.resolve().is_relative_to(source_path.resolve()):
+        raise ValueError("不能把文件夹复制到它自己的子目录中")
+
+    job.report(0, _count_entries(job, source_path), "正在复制")
+    try:
+        copied = _copy(job, source_path, destination_path)
+    except BaseException:
+        _discard(destination_path)
+        raise
+    return {"copied": copied, "destination": destination}
+
+def move_path(job: Job, source: str, destination: str) -> Dict[str, Any]:
+    """
+    移动文件或文件夹：同一文件系统内直接重命名，否则复制后删除源文件
+    """
+    source_path, destination_path = Path(source), Path(destination)
+    if not source_path.exists() and not source_path.is_symlink():
+        raise FileNotFoundError(f"路径不存在: {source}")
+    if destination_path.exists() or destination_path.is_symlink():
+        raise FileExistsError(f"目标已存在: {destination}")
+    if source_path.is_dir() and destination_path.resolve().is_relative_to(source_path.resolve()):
+        raise ValueError("不能把文件夹移动到它自己的子目录中")
+
+    job.report(0, 1, "正在移动")
+    try:
+        os.rename(source_path, destination_path)
+        job.report(1, 1)
+        return {"moved": 1, "destination": destination, "renamed": True}
+    except OSError as e:
+        # 跨文件系统（EXDEV）时改为复制后删除，其他错误直接失败
+        if e.errno != errno.EXDEV:
+            raise
+
+    copied = copy_tree(job, source, destination)["copied"]
+    # 复制已完成，删除源文件阶段不再响应取消，避免两边都只剩一部分
+    job.report(0, copied, "正在删除源文件")
+    _remove(job, source_path, cancellable=False)
+    return {"moved": copied, "destination": destination, "renamed": False}
+
+def make_dirs(job: Job, path: str) -> Dict[str, Any]:
+    """
+    创建目录（含所有上级目录）
+    """
+    job.report(0, 1, "正在创建目录")
+    Path(path).mkdir(parents=True, exist_ok=True)
+    job.report(1, 1)
+    return {"path": path}
+
+job_queue.register("delete", remove_tree)
+job_queue.register("copy", copy_tree)
+job_queue.register("move", move_path)
+job_queue.register("mkdir", make_dirs)
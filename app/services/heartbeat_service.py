@@ -0,0 +1,199 @@
+# 设备心跳服务，缓冲并合并写入设备在线状态
+# 心跳先写入内存缓冲区，每个设备只保留时间戳最新的一条，
+# 由后台任务按固定间隔以一条批量UPDATE语句（executemany）写入devices表，
+# 避免每次心跳都产生一次查询、提交和刷新。
+# 缓冲区最多保留 max_pending 个设备：已在缓冲区中的设备总是可以合并，
+# 新设备会使缓冲区超限时整批拒绝（接口返回503），写入失败放回的记录超限时丢弃最旧的
+# 刷新时先用 SELECT ... IN 查出存在的设备，只更新、发布事件和清除缓存这些设备，
+# 不存在的设备的心跳被丢弃并计入 unknown_devices
+
+import asyncio
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Any, Set
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.engine import Engine
+
+from app.database.database import engine as default_engine
+from app.models.device import Device
+from app.schemas.device import DeviceHeartbeat
+from app.services.device_events import device_event_hub
+from app.services.device_service import invalidate_device_cache
+
+# 默认刷新间隔（秒）
+DEFAULT_FLUSH_INTERVAL = 1.0
+# 缓冲区最多等待写入的设备数量
+DEFAULT_MAX_PENDING = 50000
+# 查询设备是否存在时每条 IN 语句的设备数量（低于SQLite的绑定参数上限）
+EXISTS_CHUNK_SIZE = 500
+
+class HeartbeatBufferFull(Exception):
+    """
+    心跳缓冲区已满（数据库写入跟不上或持续失败）
+    """
+
+class HeartbeatBuffer:
+    """
+    设备心跳缓冲区
+    """
+
+    def __init__(self, flush_interval: float = DEFAULT_FLUSH_INTERVAL, engine: Optional[Engine] = None,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # 写入失败放回时因缓冲区超限丢弃的心跳数量
+        self.dropped = 0
+        # 因设备不存在而丢弃的心跳数量
+        self.unknown_devices = 0
+        self.engine = engine or default_engine
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._update_stmt = (
+            update(Device.__table__)
+            .where(Device.__table__.c.device_id == bindparam("b_device_id"))
+            .values(
+                status=bindparam("b_status"),
+                is_online=bindparam("b_is_online"),
+                last_online=bindparam("b_last_online"),
+            )
+        )
+
+    @property
+    def pending_count(self) -> int:
+        """
+        等待写入的设备数量
+        """
+        return len(self._pending)
+
+    def _merge(self, record: Dict[str, Any]) -> None:
+        """
+        合并单条心跳，同一设备只保留时间戳最新的记录（调用方需持有锁）
+        """
+        current = self._pending.get(record["b_device_id"])
+        if current is None or record["b_last_online"] >= current["b_last_online"]:
+            self._pending[record["b_device_id"]] = record
+
+    def _trim(self) -> None:
+        """
+        缓冲区超过上限时丢弃时间戳最旧的记录（调用方需持有锁）
+        """
+        overflow = len(self._pending) - self.max_pending
+        if overflow <= 0:
+            return
+        oldest = sorted(self._pending.values(), key=lambda record: record["b_last_online"])[:overflow]
+        for record in oldest:
+            del self._pending[record["b_device_id"]]
+        self.dropped += overflow
+        print(f"设备心跳缓冲区已满，丢弃 {overflow} 条最旧的心跳")
+
+    def add(self, heartbeats: List[DeviceHeartbeat]) -> int:
+        """
+        将一批心跳加入缓冲区，返回接收的心跳数量
+        加入后缓冲区中的设备数量会超过 max_pending 时整批拒绝，抛出 HeartbeatBufferFull
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            new_devices = {heartbeat.device_id for heartbeat in heartbeats} - self._pending.keys()
+            if len(self._pending) + len(new_devices) > self.max_pending:
+                raise HeartbeatBufferFull()
+            for heartbeat in heartbeats:
+                ts = heartbeat.ts or now
+                # 统一为UTC无时区时间，与数据库中的其他时间字段保持一致
+                if ts.tzinfo is not None:
+                    ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+                self._merge({
+                    "b_device_id": heartbeat.device_id,
+                    "b_status": heartbeat.status,
+                    "b_is_online": heartbeat.is_online,
+                    "b_last_online": ts,
+                })
+        return len(heartbeats)
+
+    def _existing_device_ids(self, conn: Any, device_ids: List[str]) -> Set[str]:
+        """
+        查询存在的设备唯一标识符
+        """
+        column = Device.__table__.c.device_id
+        existing: Set[str] = set()
+        for start in range(0, len(device_ids), EXISTS_CHUNK_SIZE):
+            chunk = device_ids[start:start + EXISTS_CHUNK_SIZE]
+            existing.update(conn.execute(select(column).where(column.in_(chunk))).scalars())
+        return existing
+
+    def flush(self) -> int:
+        """
+        将缓冲区中的心跳写入数据库，返回写入的设备数量
+        写入失败时把记录放回缓冲区，等待下次刷新重试
+        """
+        with self._lock:
+            if not self._pending:
+                return 0
+            records = list(self._pending.values())
+            self._pending = {}
+
+        try:
+            with self.engine.begin() as conn:
+                existing = self._existing_device_ids(conn, [record["b_device_id"] for record in records])
+                unknown = len(records) - len(existing)
+                records = [record for record in records if record["b_device_id"] in existing]
+                if records:
+                    conn.execute(self._update_stmt, records)
+        except Exception as e:
+            print(f"设备心跳写入失败: {str(e)}")
+            with self._lock:
+                for record in records:
+                    self._merge(record)
+                self._trim()
+            return 0
+
+        if unknown:
+            self.unknown_devices += unknown
+            print(f"丢弃 {unknown} 条不存在的设备的心跳")
+        if not records:
+            return 0
+        invalidate_device_cache(*(record["b_device_id"] for record in records))
+        for record in records:
+            device_event_hub.publish(
+                "device.patched",
+                device_id=record["b_device_id"],
+                changes={
+                    "status": record["b_status"],
+                    "is_online": record["b_is_online"],
+                    "last_online": record["b_last_online"].isoformat(),
+                },
+            )
+        return len(records)
+
+    async def _run(self) -> None:
+        """
+        后台刷新循环
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await loop.run_in_executor(None, self.flush)
+
+    def start(self) -> None:
+        """
+        启动后台刷新任务（需在事件循环中调用）
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        停止后台刷新任务，并写入剩余的心跳
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+# 全局心跳缓冲区实例
+heartbeat_buffer = HeartbeatBuffer()
@@ -0,0 +1,334 @@
+# 后台任务队列
+# 耗时的文件操作（递归删除、复制、移动、在慢速磁盘上创建目录等）提交为任务后立即返回任务ID，
+# 由固定数量的后台worker依次执行，阻塞的文件I/O在线程池中运行，不阻塞事件循环；
+# 任务在执行过程中报告进度，可以随时取消（在处理下一个文件之前检查），
+# 客户端轮询任务状态，或通过SSE订阅状态变化。
+# 设置了共享存储（store）时，任务状态快照定期写入共享存储，多worker部署时其他进程也能查询任务状态，
+# 并从共享存储读取其他进程发来的取消请求
+
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+# 同时执行的任务数量
+DEFAULT_JOB_WORKERS = 2
+# 保留的已结束任务数量（超过后删除最早的）
+JOB_HISTORY_SIZE = 200
+# 进度通知的最小间隔（秒），避免处理大量小文件时频繁唤醒订阅者
+PROGRESS_NOTIFY_INTERVAL = 0.2
+# 把任务状态写入共享存储的间隔（秒）
+JOB_SYNC_INTERVAL = 1.0
+# 执行中的任务状态没有变化时，至少每隔这么久写入一次，表明执行它的进程仍在运行（秒）
+JOB_HEARTBEAT_SECONDS = 10.0
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+class JobCancelled(Exception):
+    """
+    任务被取消
+    """
+
+class Job:
+    """
+    单个后台任务，进度由执行任务的线程更新
+    """
+
+    def __init__(self, kind: str, user: str, params: Dict[str, Any],
+                 on_complete: Optional[Callable[["Job"], Awaitable[None]]] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.user = user
+        self.params = params
+        self.on_complete = on_complete
+        self.status = JOB_QUEUED
+        self.done = 0
+        self.total: Optional[int] = None
+        self.message = ""
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # 状态版本号，每次变化加一，订阅者据此判断是否有新状态
+        self.version = 0
+        self._cancel = threading.Event()
+        self._changed = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_notify = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self) -> None:
+        """
+        执行任务的函数在处理每个文件之前调用，已请求取消时抛出 JobCancelled
+        """
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def report(self, done: Optional[int] = None, total: Optional[int] = None, message: Optional[str] = None) -> None:
+        """
+        更新进度（可在线程中调用）
+        """
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        now = time.monotonic()
+        if now - self._last_notify >= PROGRESS_NOTIFY_INTERVAL:
+            self._last_notify = now
+            self._notify_threadsafe()
+
+    def _notify(self) -> None:
+        """
+        唤醒等待状态变化的订阅者（在事件循环中执行）
+        """
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _notify_threadsafe(self) -> None:
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._notify)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    async def wait_changed(self, version: int, timeout: float) -> bool:
+        """
+        等待状态版本超过version，超时返回False
+        """
+        if self.version > version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "done": self.done,
+            "total": self.total,
+            "progress": round(self.done / self.total, 4) if self.total else (1.0 if self.status == JOB_SUCCEEDED else 0.0),
+            "message": self.message,
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "version": self.version,
+        }
+
+class JobQueue:
+    """
+    进程内任务队列与worker池
+    任务类型通过 register 登记为同步函数 handler(job, **params)，在线程池中执行
+    """
+
+    def __init__(self, workers: int = DEFAULT_JOB_WORKERS, history_size: int = JOB_HISTORY_SIZE):
+        self.workers = workers
+        self.history_size = history_size
+        self._handlers: Dict[str, Callable[..., Any]] = {}
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # 共享任务状态存储（cloud_state），为None时任务只在本进程内可见
+        self.store: Any = None
+        # 任务ID -> (已写入共享存储的状态版本, 写入时间)
+        self._synced: Dict[str, Tuple[int, float]] = {}
+        self._sync_task: Optional[asyncio.Task] = None
+
+    def register(self, kind: str, handler: Callable[..., Any]) -> None:
+        """
+        登记任务类型
+        """
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, user: str, params: Dict[str, Any],
+               on_complete: Optional[Callable[[Job], Awaitable[None]]] = None) -> Job:
+        """
+        提交任务，立即返回；on_complete 在任务执行结束后（成功、失败或取消）于事件循环中调用，用于刷新缓存等
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        if self._queue is None:
+            self.start()
+        job = Job(kind, user, params, on_complete)
+        job._loop = asyncio.get_running_loop()
+        self._jobs[job.id] = job
+        self._trim_history()
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str, user: Optional[str] = None) -> Optional[Job]:
+        """
+        获取任务，指定user时只返回该用户的任务
+        """
+        job = self._jobs.get(job_id)
+        if job is None or (user is not None and job.user != user):
+            return None
+        return job
+
+    def list_jobs(self, user: Optional[str] = None) -> List[Job]:
+        """
+        列出任务（最新的在前）
+        """
+        return [job for job in reversed(self._jobs.values()) if user is None or job.user == user]
+
+    def cancel(self, job: Job) -> bool:
+        """
+        取消任务：排队中的任务直接取消，执行中的任务在处理下一个文件前停止，已结束的任务返回False
+        """
+        if job.finished:
+            return False
+        job._cancel.set()
+        if job.status == JOB_QUEUED:
+            self._finish(job, JOB_CANCELLED)
+        return True
+
+    def _trim_history(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self._jobs) - self.history_size)]:
+            del self._jobs[job_id]
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None) -> None:
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        job._notify()
+
+    async def _execute(self, job: Job) -> None:
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        job._notify()
+        error = None
+        try:
+            job.result = await run_in_threadpool(self._handlers[job.kind], job, **job.params)
+            status = JOB_SUCCEEDED
+        except JobCancelled:
+            status = JOB_CANCELLED
+        except Exception as e:
+            print(f"后台任务 {job.kind} ({job.id}) 失败: {str(e)}")
+            status, error = JOB_FAILED, str(e)
+
+        # 失败或取消时文件可能已经部分修改，回调同样需要执行
+        job.status, job.error = status, error
+        if job.on_complete is not None:
+            try:
+                await job.on_complete(job)
+            except Exception as e:
+                print(f"后台任务 {job.kind} ({job.id}) 完成回调失败: {str(e)}")
+        self._finish(job, status, error)
+
+    async def sync(self) -> None:
+        """
+        把有变化的任务状态写入共享存储，并处理其他进程发来的取消请求
+        """
+        if self.store is None:
+            return
+        now = time.monotonic()
+        changed = []
+        for job in self._jobs.values():
+            synced = self._synced.get(job.id)
+            if synced is None or synced[0] != job.version or (
+                not job.finished and now - synced[1] >= JOB_HEARTBEAT_SECONDS
+            ):
+                changed.append(job)
+        if changed:
+            await self.store.save_jobs([(job.user, job.to_dict()) for job in changed])
+            for job in changed:
+                self._synced[job.id] = (job.version, now)
+        self._synced = {job_id: synced for job_id, synced in self._synced.items() if job_id in self._jobs}
+
+        running = [job.id for job in self._jobs.values() if not job.finished]
+        if running:
+            for job_id in await self.store.cancel_requests(running):
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    self.cancel(job)
+
+    async def _run_sync(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_SYNC_INTERVAL)
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"同步后台任务状态失败: {str(e)}")
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                if not job.finished:
+                    await self._execute(job)
+            finally:
+                self._queue.task_done()
+
+    def start(self) -> None:
+        """
+        启动worker（需在事件循环中调用）
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.store is not None and (self._sync_task is None or self._sync_task.done()):
+            self._sync_task = asyncio.create_task(self._run_sync())
+
+    async def stop(self) -> None:
+        """
+        停止worker，执行中的任务会被请求取消
+        """
+        for job in self._jobs.values():
+            if not job.finished:
+                job._cancel.set()
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._queue = None
+        # 未结束的任务不会再执行，记为已取消并写入共享存储
+        for job in self._jobs.values():
+            if not job.finished:
+                self._finish(job, JOB_CANCELLED, "服务停止")
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+            self._sync_task = None
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"同步后台任务状态失败: {str(e)}")
+
+# 全局任务队列实例
+job_queue = JobQueue()
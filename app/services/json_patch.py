@@ -0,0 +1,236 @@
+# JSON文档的数据库端局部更新
+# 把 JSON Merge Patch (RFC 7396) 和 JSON Patch (RFC 6902) 翻译成数据库自带的JSON函数，
+# UPDATE 时直接在数据库中修改指定的键，不需要把整个文档读到应用里再整体写回
+#   SQLite:     json_patch / json_set / json_replace / json_remove
+#   MySQL:      JSON_MERGE_PATCH / JSON_SET / JSON_REPLACE / JSON_REMOVE / JSON_ARRAY_APPEND / JSON_ARRAY_INSERT
+#   PostgreSQL: || / - / jsonb_set / jsonb_insert / #-
+# 约定：
+#   文档（设备私有数据）必须是对象，整体替换为非对象的值时报错
+#   路径中纯数字的片段按数组下标处理，"-" 表示数组末尾（仅用于add）
+#   replace/remove 的目标、add 的父节点必须存在（RFC 6902），
+#   这些检查作为 UPDATE 的 WHERE 条件在数据库中判断，不满足时不修改，调用方抛出 JsonPatchConflict
+#   SQLite 没有数组中间插入函数，add 到数组下标时返回错误，追加请使用 "-"
+
+import json
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import JSON, Text, case, cast, func, literal, literal_column
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+
+# 支持的请求内容类型
+MERGE_PATCH_MEDIA_TYPE = "application/merge-patch+json"
+JSON_PATCH_MEDIA_TYPE = "application/json-patch+json"
+
+# 支持的JSON Patch操作
+JSON_PATCH_OPS = ("add", "replace", "remove")
+
+# SQLite 与 MySQL 的路径语法相同，只是函数名不同
+_PATH_FUNCTIONS = {
+    "sqlite": {
+        "merge": "json_patch",
+        "set": "json_set",
+        "replace": "json_replace",
+        "remove": "json_remove",
+    },
+    "mysql": {
+        "merge": "JSON_MERGE_PATCH",
+        "set": "JSON_SET",
+        "replace": "JSON_REPLACE",
+        "remove": "JSON_REMOVE",
+        "append": "JSON_ARRAY_APPEND",
+        "insert": "JSON_ARRAY_INSERT",
+    },
+}
+
+SUPPORTED_DIALECTS = tuple(_PATH_FUNCTIONS) + ("postgresql",)
+
+class JsonPatchConflict(Exception):
+    """
+    JSON Patch 无法应用到当前文档（replace/remove 的目标或 add 的父节点不存在）
+    """
+
+    def __init__(self):
+        super().__init__("JSON Patch 无法应用：replace/remove 的目标路径或 add 的父路径不存在")
+
+def parse_json_pointer(pointer: str) -> List[str]:
+    """
+    解析JSON Pointer (RFC 6901)，返回路径片段列表，空字符串表示整个文档
+    """
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise ValueError(f"无效的JSON Pointer: '{pointer}'")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+def _check_dialect(dialect: str) -> None:
+    if dialect not in SUPPORTED_DIALECTS:
+        raise ValueError(f"数据库 {dialect} 不支持JSON局部更新")
+
+def _json_text(value: Any):
+    return literal(json.dumps(value, ensure_ascii=False), Text)
+
+def _json_path(tokens: List[str]) -> str:
+    """
+    SQLite/MySQL 的JSON路径，如 ["a", "0", "b"] -> $."a"[0]."b"
+    """
+    path = "$"
+    for token in tokens:
+        if token.isdigit():
+            path += f"[{int(token)}]"
+        elif token == "-":
+            raise ValueError("'-' 只能作为add操作路径的最后一段")
+        elif '"' in token or "\\" in token:
+            raise ValueError(f"路径中的键不能包含引号或反斜杠: '{token}'")
+        else:
+            path += f'."{token}"'
+    return path
+
+def _document(dialect: str, column: Any):
+    """
+    待修改的文档，列为NULL时视为空对象
+    """
+    if dialect == "postgresql":
+        return func.coalesce(cast(column, JSONB), cast(literal_column("'{}'"), JSONB))
+    return func.coalesce(column, literal_column("'{}'"))
+
+def _replace_document(dialect: str, value: Any):
+    """
+    用新值整体替换文档，新值必须是对象
+    """
+    if not isinstance(value, dict):
+        raise ValueError("私有数据必须是JSON对象")
+    if dialect == "postgresql":
+        return cast(_json_text(value), JSONB)
+    return _json_text(value)
+
+def _result(dialect: str, expression: Any):
+    if dialect == "postgresql":
+        return cast(expression, JSON)
+    return expression
+
+def _pg_merge(target: Any, patch: Dict[str, Any]):
+    """
+    PostgreSQL 的 RFC 7396 合并：先删除值为null的键，再用 || 覆盖其余键，嵌套对象递归合并
+    """
+    base = case((func.jsonb_typeof(target) == "object", target), else_=cast(literal_column("'{}'"), JSONB))
+    removed = [key for key, value in patch.items() if value is None]
+    if removed:
+        base = base.op("-")(literal(removed, ARRAY(Text)))
+    updates = []
+    for key, value in patch.items():
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            updates.extend([key, _pg_merge(target.op("->")(key), value)])
+        else:
+            updates.extend([key, cast(_json_text(value), JSONB)])
+    if updates:
+        base = base.op("||")(func.jsonb_build_object(*updates))
+    return base
+
+def build_merge_patch_expression(dialect: str, column: Any, patch: Any):
+    """
+    构建 JSON Merge Patch (RFC 7396) 的SQL表达式
+    patch 必须是对象，按键合并（值为null表示删除该键）；
+    RFC 7396 中非对象的patch会整体替换文档，私有数据必须是对象，因此拒绝
+    """
+    _check_dialect(dialect)
+    if not isinstance(patch, dict):
+        raise ValueError("JSON Merge Patch请求体必须是JSON对象")
+
+    if dialect == "postgresql":
+        return _result(dialect, _pg_merge(_document(dialect, column), patch))
+    merge = getattr(func, _PATH_FUNCTIONS[dialect]["merge"])
+    return merge(_document(dialect, column), _json_text(patch))
+
+def _parse_value(dialect: str, value: Any):
+    """
+    SQLite/MySQL 中把JSON文本解析为JSON值，否则会被当作字符串写入
+    """
+    if dialect == "sqlite":
+        return func.json(_json_text(value))
+    return func.JSON_EXTRACT(_json_text(value), "$")
+
+def _apply_path_operation(dialect: str, document: Any, op: str, tokens: List[str], value: Any):
+    """
+    SQLite/MySQL 上执行单个JSON Patch操作
+    """
+    functions = _PATH_FUNCTIONS[dialect]
+
+    def call(name: str, path: str, *args: Any):
+        return getattr(func, functions[name])(document, path, *args)
+
+    if op == "remove":
+        return call("remove", _json_path(tokens))
+    if op == "replace":
+        return call("replace", _json_path(tokens), _parse_value(dialect, value))
+
+    parent, last = tokens[:-1], tokens[-1]
+    if last == "-":
+        if dialect == "sqlite":
+            return call("set", _json_path(parent) + "[#]", _parse_value(dialect, value))
+        return call("append", _json_path(parent), _parse_value(dialect, value))
+    if last.isdigit():
+        if dialect == "sqlite":
+            raise ValueError("SQLite不支持在数组中间插入元素，请使用 '-' 追加或使用replace替换")
+        return call("insert", _json_path(tokens), _parse_value(dialect, value))
+    return call("set", _json_path(tokens), _parse_value(dialect, value))
+
+def _path_exists(dialect: str, document: Any, tokens: List[str]):
+    """
+    文档中路径存在的条件（值为JSON null也算存在）
+    """
+    if dialect == "postgresql":
+        return document.op("#>")(literal(tokens, ARRAY(Text))).isnot(None)
+    if dialect == "sqlite":
+        return func.json_type(document, _json_path(tokens)).isnot(None)
+    return func.JSON_CONTAINS_PATH(document, "one", _json_path(tokens)) == 1
+
+def _apply_pg_operation(document: Any, op: str, tokens: List[str], value: Any):
+    """
+    PostgreSQL 上执行单个JSON Patch操作，路径片段对对象是键、对数组是下标
+    """
+    if op == "remove":
+        return document.op("#-")(literal(tokens, ARRAY(Text)))
+    json_value = cast(_json_text(value), JSONB)
+    if op == "replace":
+        return func.jsonb_set(document, literal(tokens, ARRAY(Text)), json_value, False)
+
+    parent, last = tokens[:-1], tokens[-1]
+    if last == "-":
+        return func.jsonb_insert(document, literal(parent + ["-1"], ARRAY(Text)), json_value, True)
+    if last.isdigit():
+        return func.jsonb_insert(document, literal(tokens, ARRAY(Text)), json_value)
+    return func.jsonb_set(document, literal(tokens, ARRAY(Text)), json_value, True)
+
+def build_json_patch_expression(
+    dialect: str, column: Any, operations: List[Dict[str, Any]]
+) -> Tuple[Any, List[Any]]:
+    """
+    构建 JSON Patch (RFC 6902) 的SQL表达式，支持 add/replace/remove，按顺序嵌套应用
+    返回 (新文档表达式, 条件列表)：条件针对每个操作执行前的文档，检查目标路径（add为父路径）存在，
+    调用方把条件加入 UPDATE 的 WHERE，全部满足才修改
+    """
+    _check_dialect(dialect)
+    document = _document(dialect, column)
+    conditions = []
+    for operation in operations:
+        op = operation["op"]
+        if op not in JSON_PATCH_OPS:
+            raise ValueError(f"不支持的JSON Patch操作: '{op}'")
+        tokens = parse_json_pointer(operation["path"])
+        value = operation.get("value")
+        if not tokens:
+            # 对整个文档的add/replace等同于整体替换
+            if op == "remove":
+                raise ValueError("不能删除整个文档")
+            document = _replace_document(dialect, value)
+            continue
+        required = tokens[:-1] if op == "add" else tokens
+        if required:
+            conditions.append(_path_exists(dialect, document, required))
+        if dialect == "postgresql":
+            document = _apply_pg_operation(document, op, tokens, value)
+        else:
+            document = _apply_path_operation(dialect, document, op, tokens, value)
+    return _result(dialect, document), conditions
@@ -0,0 +1,63 @@
+# 游标（keyset）分页工具
+# 以自增主键id作为游标，翻页时使用 WHERE id > :last_id ORDER BY id LIMIT n，
+# 任意深度的分页代价都与第一页相同，不会像 OFFSET 那样随页数线性增长
+
+import base64
+import json
+from typing import List, Optional, Tuple, Any
+
+from sqlalchemy.orm import Query
+
+# 单页最大条数
+MAX_PAGE_LIMIT = 500
+
+# 列表接口仍返回JSON数组，下一页游标放在该响应头中，没有更多数据时不返回
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(last_id: int) -> str:
+    """
+    将最后一条记录的id编码为不透明的游标字符串
+    """
+    raw = json.dumps({"id": last_id}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """
+    解析游标字符串，返回上一页最后一条记录的id
+    游标格式不正确时抛出 ValueError
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        last_id = payload["id"]
+    except Exception:
+        raise ValueError("无效的分页游标")
+    if not isinstance(last_id, int):
+        raise ValueError("无效的分页游标")
+    return last_id
+
+def paginate(query: Query, id_column: Any, cursor: Optional[str], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """
+    对查询按id列执行游标分页
+    返回 (当前页记录, 下一页游标)，没有更多数据时下一页游标为None
+    """
+    limit = max(1, min(limit, MAX_PAGE_LIMIT))
+    last_id = decode_cursor(cursor)
+    if last_id is not None:
+        query = query.filter(id_column > last_id)
+
+    # 多取一条用于判断是否还有下一页
+    rows = query.order_by(id_column).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].id)
+    return rows, None
+
+def set_next_cursor(response: Any, next_cursor: Optional[str]) -> None:
+    """
+    将下一页游标写入响应头
+    """
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -0,0 +1,149 @@
+# 云盘存储配额
+# 占用空间来自搜索索引中按挂载路径增量维护的汇总表（上传/删除/新建文件夹时更新，
+# 后台定期完整扫描时重新汇总），查询只读一行，不需要遍历目录；
+# 配额按用户的挂载路径统计：未设置挂载路径的用户各自使用默认根目录下自己的目录，
+# 多个用户挂载同一个自定义目录时共享该目录的占用空间；
+# 上传在接收数据之前检查配额，配额不足时直接拒绝；
+# 未完成的分片上传会话按声明的大小计入已用空间，创建会话时持有挂载路径的锁（同时用文件锁跨进程互斥），
+# 并发创建的会话不会都按同一个已用空间通过检查
+
+import asyncio
+import hashlib
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.database.database import SessionLocal
+from app.models.user import User
+from app.services.search_index import search_index
+from app.services.upload_service import upload_manager
+
+try:
+    import fcntl
+except ImportError:  # Windows，只在进程内互斥
+    fcntl = None
+
+# 默认配额（字节），用户未单独设置时使用，0表示不限制
+DEFAULT_STORAGE_QUOTA = int(os.environ.get("CLOUD_DEFAULT_QUOTA_MB", "0")) * 1024 * 1024
+# 用户配额的缓存时间（秒），修改用户信息时会主动失效
+QUOTA_CACHE_TTL = 60.0
+
+class QuotaExceeded(Exception):
+    """
+    存储空间不足
+    """
+
+    def __init__(self, used: int, quota: int, requested: int):
+        super().__init__(f"存储空间不足：已用 {used} 字节，配额 {quota} 字节，本次需要 {requested} 字节")
+        self.used = used
+        self.quota = quota
+        self.requested = requested
+
+class QuotaService:
+    """
+    用户配额查询与检查
+    """
+
+    def __init__(self, default_quota: int = DEFAULT_STORAGE_QUOTA, cache_ttl: float = QUOTA_CACHE_TTL):
+        self.default_quota = default_quota
+        self.cache_ttl = cache_ttl
+        # 用户名 -> (过期时间, 配额)
+        self._cache: Dict[str, Tuple[float, int]] = {}
+        # 挂载路径 -> 进程内的预留锁
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _load_quota(self, username: str) -> int:
+        db = SessionLocal()
+        try:
+            row = db.query(User.storage_quota).filter(User.username == username).first()
+        finally:
+            db.close()
+        if row is None or row[0] is None:
+            return self.default_quota
+        return row[0]
+
+    async def get_quota(self, username: str) -> int:
+        """
+        用户的配额（字节），0表示不限制
+        """
+        cached = self._cache.get(username)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        quota = await run_in_threadpool(self._load_quota, username)
+        self._cache[username] = (time.monotonic() + self.cache_ttl, quota)
+        return quota
+
+    def invalidate(self, username: Optional[str] = None) -> None:
+        """
+        用户配额被修改后清除缓存
+        """
+        if username is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(username, None)
+
+    @asynccontextmanager
+    async def lock(self, root: str) -> AsyncIterator[None]:
+        """
+        挂载路径的配额预留锁：检查配额和创建上传会话在锁内完成
+        """
+        root = os.path.abspath(root)
+        async with self._locks.setdefault(root, asyncio.Lock()):
+            if fcntl is None:
+                yield
+                return
+            lock_dir = upload_manager.staging_dir
+            name = hashlib.sha1(root.encode("utf-8")).hexdigest()[:16]
+
+            def _acquire():
+                lock_dir.mkdir(parents=True, exist_ok=True)
+                lock_file = open(lock_dir / f".quota-{name}.lock", "w")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                return lock_file
+
+            lock_file = await run_in_threadpool(_acquire)
+            try:
+                yield
+            finally:
+                lock_file.close()
+
+    async def get_usage(self, username: str, root: str) -> Dict[str, Any]:
+        """
+        用户挂载路径的占用空间与配额
+        indexing为true表示挂载路径正在扫描（首次扫描期间占用空间由直接遍历得出）
+        reserved_bytes为未完成的分片上传预留的空间，已计入可用空间的计算
+        """
+        usage = await search_index.usage(root)
+        reserved = await upload_manager.reserved_bytes(os.path.abspath(root))
+        quota = await self.get_quota(username)
+        return {
+            "used_bytes": usage["bytes"],
+            "reserved_bytes": reserved,
+            "files": usage["files"],
+            "dirs": usage["dirs"],
+            "quota_bytes": quota or None,
+            "available_bytes": max(quota - usage["bytes"] - reserved, 0) if quota else None,
+            "indexing": search_index.is_indexing(root),
+        }
+
+    async def check(
+        self, username: str, root: str, incoming: int, replaced: int = 0, exclude_upload: Optional[str] = None
+    ) -> None:
+        """
+        检查写入incoming字节（覆盖已有的replaced字节）后是否超出配额，超出时抛出 QuotaExceeded
+        已用空间包括未完成的上传会话预留的空间，exclude_upload 为不计入的会话（完成上传时检查自身）
+        """
+        quota = await self.get_quota(username)
+        if not quota:
+            return
+        root = os.path.abspath(root)
+        used = (await search_index.usage(root))["bytes"]
+        used += await upload_manager.reserved_bytes(root, exclude_upload)
+        if used - replaced + incoming > quota:
+            raise QuotaExceeded(used, quota, incoming)
+
+# 全局配额服务实例
+quota_service = QuotaService()
@@ -0,0 +1,422 @@
+# 云盘文件名搜索索引
+# 每个挂载路径的文件名/相对路径保存在独立的SQLite数据库中，使用FTS5的trigram分词建立全文索引，
+# 支持任意子串（包括中文文件名）检索，结果按bm25排序（文件名权重高于路径）。
+# 首次访问某个挂载路径时在后台建立索引；本服务的上传/删除/新建文件夹会增量更新索引；
+# 后台任务定期重新扫描，发现其他程序对目录的修改。
+# usage表由触发器随files表增量维护每个挂载路径的总大小和文件数（用于配额，O(1)读取），
+# 每次完整扫描后按files表重新汇总一次；挂载路径的首次扫描完成之前汇总不完整，占用空间改为直接遍历统计
+
+import asyncio
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.services.directory_index import SYSTEM_RESERVED
+
+# 索引数据库位置，可通过环境变量修改
+SEARCH_INDEX_PATH = Path(os.environ.get("CLOUD_SEARCH_INDEX", "cloud_index.db"))
+# 定期重新扫描的间隔（秒）
+DEFAULT_RESCAN_INTERVAL = 600.0
+# 扫描时每批写入的条数
+SCAN_BATCH_SIZE = 5000
+# 单次搜索返回的最大条数
+MAX_SEARCH_LIMIT = 200
+# trigram分词要求检索词至少3个字符，更短的词改用LIKE匹配文件名
+MIN_FTS_TERM_LENGTH = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    root TEXT PRIMARY KEY,
+    scanned_at REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    modified REAL,
+    scan_id INTEGER NOT NULL,
+    UNIQUE (root, path)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+    name, path, content='files', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts(rowid, name, path) VALUES (new.id, new.name, new.path);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts(files_fts, rowid, name, path) VALUES ('delete', old.id, old.name, old.path);
+END;
+CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE OF name, path ON files BEGIN
+    INSERT INTO files_fts(files_fts, rowid, name, path) VALUES ('delete', old.id, old.name, old.path);
+    INSERT INTO files_fts(rowid, name, path) VALUES (new.id, new.name, new.path);
+END;
+CREATE TABLE IF NOT EXISTS usage (
+    root TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    files INTEGER NOT NULL DEFAULT 0,
+    dirs INTEGER NOT NULL DEFAULT 0
+);
+CREATE TRIGGER IF NOT EXISTS usage_ai AFTER INSERT ON files BEGIN
+    INSERT INTO usage (root, bytes, files, dirs) VALUES (new.root, COALESCE(new.size, 0), 1 - new.is_dir, new.is_dir)
+    ON CONFLICT (root) DO UPDATE SET
+        bytes = bytes + excluded.bytes, files = files + excluded.files, dirs = dirs + excluded.dirs;
+END;
+CREATE TRIGGER IF NOT EXISTS usage_ad AFTER DELETE ON files BEGIN
+    UPDATE usage SET bytes = bytes - COALESCE(old.size, 0), files = files - (1 - old.is_dir), dirs = dirs - old.is_dir
+    WHERE root = old.root;
+END;
+CREATE TRIGGER IF NOT EXISTS usage_au AFTER UPDATE OF size, is_dir ON files
+WHEN old.size IS NOT new.size OR old.is_dir != new.is_dir BEGIN
+    UPDATE usage SET
+        bytes = bytes - COALESCE(old.size, 0) + COALESCE(new.size, 0),
+        files = files - (1 - old.is_dir) + (1 - new.is_dir),
+        dirs = dirs - old.is_dir + new.is_dir
+    WHERE root = new.root;
+END;
+"""
+
+_RECOUNT_SQL = """
+INSERT OR REPLACE INTO usage (root, bytes, files, dirs)
+SELECT ?, COALESCE(SUM(size), 0), COALESCE(SUM(1 - is_dir), 0), COALESCE(SUM(is_dir), 0) FROM files WHERE root = ?
+"""
+
+# 扫描只更新大小、时间和扫描批次，name/path不变，不会触发全文索引的更新
+_UPSERT_SQL = """
+INSERT INTO files (root, path, name, is_dir, size, modified, scan_id) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (root, path) DO UPDATE SET
+    is_dir = excluded.is_dir, size = excluded.size, modified = excluded.modified, scan_id = excluded.scan_id
+"""
+
+def _relative_path(root: str, path: Any) -> Optional[str]:
+    """
+    计算相对于挂载路径的路径（使用/分隔），不在挂载路径之内时返回None
+    """
+    relative = os.path.relpath(os.path.abspath(str(path)), root)
+    if relative == "." or relative.startswith(".."):
+        return None
+    return relative.replace(os.sep, "/")
+
+def _subtree_bounds(relative: str) -> Tuple[str, str]:
+    """
+    子路径的范围查询边界：path >= 'a/' AND path < 'a0'（'0'是'/'的下一个字符），可以使用唯一索引
+    """
+    return relative + "/", relative + "0"
+
+class FileSearchIndex:
+    """
+    云盘文件名搜索索引
+    """
+
+    def __init__(self, db_path: Path = SEARCH_INDEX_PATH, rescan_interval: float = DEFAULT_RESCAN_INTERVAL):
+        self.db_path = Path(db_path)
+        self.rescan_interval = rescan_interval
+        self._roots: Set[str] = set()
+        # 至少完成过一次完整扫描的挂载路径，只有这些路径的usage汇总是完整的
+        self._indexed: Set[str] = set()
+        self._scanning: Set[str] = set()
+        self._pending: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(str(self.db_path), timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        if not self._initialized:
+            connection.executescript(_SCHEMA)
+            self._roots.update(row[0] for row in connection.execute("SELECT root FROM roots"))
+            self._indexed.update(
+                row[0] for row in connection.execute("SELECT root FROM roots WHERE scanned_at IS NOT NULL")
+            )
+            # 旧版本建立的索引没有usage表的数据，按现有条目补充
+            if connection.execute("SELECT COUNT(*) FROM usage").fetchone()[0] == 0:
+                for root in self._roots:
+                    connection.execute(_RECOUNT_SQL, (root, root))
+                connection.commit()
+            self._initialized = True
+        return connection
+
+    def _open(self) -> None:
+        self._connect().close()
+
+    def _walk(self, root: str) -> Iterator[Tuple[str, str, int, Optional[int], float]]:
+        """
+        遍历挂载路径下的全部文件和文件夹（不跟随符号链接）
+        """
+        stack = [("", root)]
+        while stack:
+            relative_dir, absolute_dir = stack.pop()
+            try:
+                entries = os.scandir(absolute_dir)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name in SYSTEM_RESERVED:
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    relative = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    yield relative, entry.name, int(is_dir), None if is_dir else stat.st_size, stat.st_mtime
+                    if is_dir:
+                        stack.append((relative, entry.path))
+
+    def rescan(self, root: str) -> int:
+        """
+        完整扫描一个挂载路径，新增/更新现有条目并删除已不存在的条目，返回条目总数
+        """
+        scan_id = time.time_ns()
+        count = 0
+        connection = self._connect()
+        try:
+            connection.execute("INSERT OR IGNORE INTO roots (root) VALUES (?)", (root,))
+            batch = []
+            for item in self._walk(root):
+                batch.append((root, *item, scan_id))
+                if len(batch) >= SCAN_BATCH_SIZE:
+                    connection.executemany(_UPSERT_SQL, batch)
+                    connection.commit()
+                    count += len(batch)
+                    batch = []
+            if batch:
+                connection.executemany(_UPSERT_SQL, batch)
+                count += len(batch)
+            # 扫描开始后增量写入的条目批次号更大，不会被删除
+            connection.execute("DELETE FROM files WHERE root = ? AND scan_id < ?", (root, scan_id))
+            # 重新汇总占用空间，校正增量统计的偏差
+            connection.execute(_RECOUNT_SQL, (root, root))
+            connection.execute("UPDATE roots SET scanned_at = ? WHERE root = ?", (time.time(), root))
+            connection.commit()
+        finally:
+            connection.close()
+        self._indexed.add(root)
+        return count
+
+    def _add_paths(self, root: str, paths: List[Any]) -> None:
+        rows = []
+        scan_id = time.time_ns()
+        for path in paths:
+            relative = _relative_path(root, path)
+            if relative is None:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            is_dir = os.path.isdir(path)
+            rows.append((root, relative, os.path.basename(relative), int(is_dir), None if is_dir else stat.st_size, stat.st_mtime, scan_id))
+        if not rows:
+            return
+        connection = self._connect()
+        try:
+            connection.executemany(_UPSERT_SQL, rows)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _remove_path(self, root: str, path: Any) -> None:
+        relative = _relative_path(root, path)
+        if relative is None:
+            return
+        lower, upper = _subtree_bounds(relative)
+        connection = self._connect()
+        try:
+            connection.execute(
+                "DELETE FROM files WHERE root = ? AND (path = ? OR (path >= ? AND path < ?))",
+                (root, relative, lower, upper)
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _usage(self, root: str) -> Dict[str, int]:
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT bytes, files, dirs FROM usage WHERE root = ?", (root,)).fetchone()
+        finally:
+            connection.close()
+        bytes_used, files, dirs = row or (0, 0, 0)
+        return {"bytes": bytes_used, "files": files, "dirs": dirs}
+
+    def _walk_usage(self, root: str) -> Dict[str, int]:
+        """
+        直接遍历目录统计占用空间（首次扫描完成之前使用）
+        """
+        bytes_used = files = dirs = 0
+        for _, _, is_dir, size, _ in self._walk(root):
+            if is_dir:
+                dirs += 1
+            else:
+                files += 1
+                bytes_used += size
+        return {"bytes": bytes_used, "files": files, "dirs": dirs}
+
+    def _search(self, root: str, query: str, limit: int) -> List[Dict[str, Any]]:
+        terms = query.split()
+        fts_terms = [term for term in terms if len(term) >= MIN_FTS_TERM_LENGTH]
+        like_terms = [term for term in terms if len(term) < MIN_FTS_TERM_LENGTH]
+        if not terms:
+            return []
+
+        conditions = ["f.root = ?"]
+        params: List[Any] = [root]
+        for term in like_terms:
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append("f.name LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+
+        columns = "f.path, f.name, f.is_dir, f.size, f.modified"
+        if fts_terms:
+            match = " AND ".join('"' + term.replace('"', '""') + '"' for term in fts_terms)
+            sql = (
+                f"SELECT {columns} FROM files_fts JOIN files f ON f.id = files_fts.rowid "
+                f"WHERE files_fts MATCH ? AND {' AND '.join(conditions)} "
+                "ORDER BY bm25(files_fts, 10.0, 1.0), length(f.path) LIMIT ?"
+            )
+            params = [match] + params
+        else:
+            sql = (
+                f"SELECT {columns} FROM files f WHERE {' AND '.join(conditions)} "
+                "ORDER BY length(f.name), length(f.path) LIMIT ?"
+            )
+        params.append(limit)
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+        return [
+            {"path": path, "name": name, "is_dir": bool(is_dir), "size": size, "modified": modified}
+            for path, name, is_dir, size, modified in rows
+        ]
+
+    async def ensure_root(self, root: str) -> None:
+        """
+        登记挂载路径，尚未建立索引时安排后台扫描
+        """
+        root = os.path.abspath(root)
+        if not self._initialized:
+            # 首次打开索引库会建表并加载已登记的挂载路径，在线程池中进行，不阻塞事件循环
+            await run_in_threadpool(self._open)
+        if root not in self._roots:
+            self._roots.add(root)
+            self.request_scan(root)
+
+    def request_scan(self, root: str) -> None:
+        """
+        安排一次后台扫描
+        """
+        self._pending.add(os.path.abspath(root))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def is_indexing(self, root: str) -> bool:
+        """
+        挂载路径是否正在（或等待）建立索引
+        """
+        root = os.path.abspath(root)
+        return root in self._scanning or root in self._pending
+
+    async def add_paths(self, root: str, *paths: Any) -> None:
+        """
+        增量添加或更新文件/文件夹
+        """
+        try:
+            await run_in_threadpool(self._add_paths, os.path.abspath(root), list(paths))
+        except sqlite3.Error as e:
+            print(f"更新搜索索引失败: {str(e)}")
+
+    async def remove_path(self, root: str, path: Any) -> None:
+        """
+        增量删除文件或整个文件夹
+        """
+        try:
+            await run_in_threadpool(self._remove_path, os.path.abspath(root), path)
+        except sqlite3.Error as e:
+            print(f"更新搜索索引失败: {str(e)}")
+
+    def is_indexed(self, root: str) -> bool:
+        """
+        挂载路径是否已完成过完整扫描（之后的定期扫描期间汇总表仍然可用）
+        """
+        return os.path.abspath(root) in self._indexed
+
+    async def usage(self, root: str) -> Dict[str, int]:
+        """
+        挂载路径的占用空间（字节）和文件/文件夹数量
+        通常直接读取汇总表；首次扫描完成之前汇总表不完整，改为遍历目录统计
+        """
+        root = os.path.abspath(root)
+        if root in self._indexed:
+            return await run_in_threadpool(self._usage, root)
+        return await run_in_threadpool(self._walk_usage, root)
+
+    async def search(self, root: str, query: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        在挂载路径内按文件名/路径搜索
+        """
+        limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+        return await run_in_threadpool(self._search, os.path.abspath(root), query, limit)
+
+    async def _scan(self, root: str) -> None:
+        self._scanning.add(root)
+        try:
+            started = time.monotonic()
+            count = await run_in_threadpool(self.rescan, root)
+            print(f"搜索索引扫描完成: {root}，共 {count} 项，耗时 {time.monotonic() - started:.1f} 秒")
+        except (OSError, sqlite3.Error) as e:
+            print(f"搜索索引扫描失败: {root}: {str(e)}")
+        finally:
+            self._scanning.discard(root)
+
+    async def _run(self) -> None:
+        """
+        后台循环：优先处理新登记的挂载路径，定期重新扫描全部挂载路径
+        """
+        next_rescan = time.monotonic() + self.rescan_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(next_rescan - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                self._pending.update(self._roots)
+                next_rescan = time.monotonic() + self.rescan_interval
+            self._wakeup.clear()
+            while self._pending:
+                await self._scan(self._pending.pop())
+
+    def start(self) -> None:
+        """
+        启动后台索引任务（需在事件循环中调用）
+        """
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            if self._pending:
+                self._wakeup.set()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        停止后台索引任务
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# 全局搜索索引实例
+search_index = FileSearchIndex()
@@ -0,0 +1,441 @@
+# 设备遥测服务层，处理遥测数据的写入、降采样查询和保留策略
+# 原始读数只追加写入telemetry_readings，同时在telemetry_dirty_buckets中记录读数所在的时间桶；
+# 后台任务定期把已完成的待汇总时间桶重新汇总到telemetry_rollups并清理过期的原始读数。
+# 查询时优先使用聚合数据，待汇总的时间桶和尚未汇总的最近一段时间再从原始读数实时聚合
+
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any
+
+from sqlalchemy import func, insert, delete, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.database.database import SessionLocal
+from app.models.telemetry import TelemetryReading, TelemetryRollup, TelemetryDirtyBucket
+from app.schemas.telemetry import TelemetryReadingCreate
+
+# 聚合时间桶大小（秒）
+ROLLUP_BUCKET_SECONDS = 60
+# 原始读数保留时长（秒）
+RAW_RETENTION_SECONDS = 2 * 24 * 3600
+# 聚合数据保留时长（秒）
+ROLLUP_RETENTION_SECONDS = 365 * 24 * 3600
+# 单次查询最多返回的时间桶数量
+MAX_QUERY_POINTS = 5000
+# 后台汇总任务的执行间隔（秒）
+DEFAULT_MAINTENANCE_INTERVAL = 60.0
+# 单条INSERT语句最多写入的行数（避免超出数据库的参数数量限制）
+INSERT_CHUNK_SIZE = 500
+
+def to_epoch_ms(value: datetime) -> int:
+    """
+    将时间转换为UTC毫秒时间戳，无时区信息的时间按UTC处理
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+def from_epoch_ms(value: int) -> datetime:
+    """
+    将UTC毫秒时间戳转换为无时区的UTC时间
+    """
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+def _insert_ignore(db: Session, table, rows: List[Dict[str, Any]]) -> int:
+    """
+    批量写入，主键冲突的行忽略，返回实际写入的行数
+    """
+    dialect = db.get_bind().dialect.name
+    inserted = 0
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[i:i + INSERT_CHUNK_SIZE]
+        if dialect == "sqlite":
+            stmt = sqlite.insert(table).values(chunk).on_conflict_do_nothing()
+        elif dialect == "postgresql":
+            stmt = postgresql.insert(table).values(chunk).on_conflict_do_nothing()
+        elif dialect == "mysql":
+            stmt = mysql.insert(table).values(chunk).prefix_with("IGNORE")
+        else:
+            stmt = insert(table).values(chunk)
+        inserted += db.execute(stmt).rowcount
+    return inserted
+
+def _mark_dirty(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """
+    记录待汇总的时间桶；时间桶已存在时清空汇总标识（持有行锁直到事务提交，
+    正在进行的汇总不会删除这条记录，新读数会在下一次汇总时计入）
+    """
+    dialect = db.get_bind().dialect.name
+    table = TelemetryDirtyBucket.__table__
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[i:i + INSERT_CHUNK_SIZE]
+        if dialect == "sqlite":
+            stmt = sqlite.insert(table).values(chunk)
+            stmt = stmt.on_conflict_do_update(index_elements=list(table.primary_key.columns), set_={"claim": None})
+        elif dialect == "postgresql":
+            stmt = postgresql.insert(table).values(chunk)
+            stmt = stmt.on_conflict_do_update(index_elements=list(table.primary_key.columns), set_={"claim": None})
+        elif dialect == "mysql":
+            stmt = mysql.insert(table).values(chunk).on_duplicate_key_update(claim=None)
+        else:
+            stmt = insert(table).values(chunk)
+        db.execute(stmt)
+
+class TelemetryService:
+    """
+    设备遥测服务类
+    """
+
+    @staticmethod
+    def insert_readings(db: Session, device_id: int, readings: List[TelemetryReadingCreate]) -> int:
+        """
+        批量写入设备遥测读数，返回实际写入的读数数量
+        同一 (设备, 指标, 时间戳) 的重复读数会被忽略，读数所在的时间桶记为待汇总；
+        早于原始读数保留时长的读数也会被忽略（这些时间桶的原始读数已清理，无法重新汇总）
+        """
+        now_ms = to_epoch_ms(datetime.utcnow())
+        rollup_ms = ROLLUP_BUCKET_SECONDS * 1000
+        expired_ms = now_ms - RAW_RETENTION_SECONDS * 1000
+        expired_ms -= expired_ms % rollup_ms
+        rows = [
+            {
+                "device_id": device_id,
+                "metric": reading.metric,
+                "ts": to_epoch_ms(reading.ts) if reading.ts else now_ms,
+                "value": reading.value,
+            }
+            for reading in readings
+        ]
+        rows = [row for row in rows if row["ts"] >= expired_ms]
+        if not rows:
+            return 0
+
+        inserted = _insert_ignore(db, TelemetryReading.__table__, rows)
+        if inserted:
+            buckets = {(row["device_id"], row["metric"], row["ts"] - row["ts"] % rollup_ms) for row in rows}
+            _mark_dirty(db, [
+                {"device_id": device, "metric": metric, "bucket_start": bucket_start}
+                for device, metric, bucket_start in sorted(buckets)
+            ])
+        db.commit()
+        return inserted
+
+    @staticmethod
+    def _aggregate_raw(
+        db: Session, device_id: int, metric: str, start_ms: int, end_ms: int, bucket_ms: int, dirty_only: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        从原始读数按时间桶聚合，dirty_only为True时只聚合待汇总时间桶内的读数
+        """
+        bucket = (TelemetryReading.ts - TelemetryReading.ts % bucket_ms).label("bucket")
+        conditions = [
+            TelemetryReading.device_id == device_id,
+            TelemetryReading.metric == metric,
+            TelemetryReading.ts >= start_ms,
+            TelemetryReading.ts < end_ms,
+        ]
+        if dirty_only:
+            rollup_ms = ROLLUP_BUCKET_SECONDS * 1000
+            conditions.append(
+                (TelemetryReading.ts - TelemetryReading.ts % rollup_ms).in_(
+                    TelemetryService._dirty_buckets(device_id, metric, start_ms, end_ms)
+                )
+            )
+        rows = db.execute(
+            select(
+                bucket,
+                func.count(TelemetryReading.value),
+                func.min(TelemetryReading.value),
+                func.max(TelemetryReading.value),
+                func.sum(TelemetryReading.value),
+            )
+            .where(*conditions)
+            .group_by(bucket)
+        ).all()
+        return [
+            {"bucket": row[0], "count": row[1], "min": row[2], "max": row[3], "sum": row[4]}
+            for row in rows
+        ]
+
+    @staticmethod
+    def _dirty_buckets(device_id: int, metric: str, start_ms: int, end_ms: int):
+        """
+        时间范围内待汇总时间桶的子查询（这些时间桶的聚合数据不完整）
+        """
+        return select(TelemetryDirtyBucket.bucket_start).where(
+            TelemetryDirtyBucket.device_id == device_id,
+            TelemetryDirtyBucket.metric == metric,
+            TelemetryDirtyBucket.bucket_start >= start_ms,
+            TelemetryDirtyBucket.bucket_start < end_ms,
+        )
+
+    @staticmethod
+    def _aggregate_rollups(db: Session, device_id: int, metric: str, start_ms: int, end_ms: int, bucket_ms: int) -> List[Dict[str, Any]]:
+        """
+        从聚合数据按更大的时间桶再次聚合（bucket_ms需为聚合桶大小的整数倍），跳过待汇总的时间桶
+        """
+        bucket = (TelemetryRollup.bucket_start - TelemetryRollup.bucket_start % bucket_ms).label("bucket")
+        rows = db.execute(
+            select(
+                bucket,
+                func.sum(TelemetryRollup.count),
+                func.min(TelemetryRollup.min_value),
+                func.max(TelemetryRollup.max_value),
+                func.sum(TelemetryRollup.sum_value),
+            )
+            .where(
+                TelemetryRollup.device_id == device_id,
+                TelemetryRollup.metric == metric,
+                TelemetryRollup.bucket_start >= start_ms,
+                TelemetryRollup.bucket_start < end_ms,
+                TelemetryRollup.bucket_start.notin_(TelemetryService._dirty_buckets(device_id, metric, start_ms, end_ms)),
+            )
+            .group_by(bucket)
+        ).all()
+        return [
+            {"bucket": row[0], "count": row[1], "min": row[2], "max": row[3], "sum": row[4]}
+            for row in rows
+        ]
+
+    @staticmethod
+    def query_range(
+        db: Session, device_id: int, metric: str, start: datetime, end: datetime, bucket_seconds: int = ROLLUP_BUCKET_SECONDS
+    ) -> List[Dict[str, Any]]:
+        """
+        查询设备指标在时间范围内的降采样数据，每个时间桶返回 min/max/avg/count
+        bucket_seconds为聚合桶大小整数倍时，已汇总的时间段直接读取聚合数据，
+        其中有新读数写入、尚待重新汇总的时间桶从原始读数聚合
+        """
+        if bucket_seconds <= 0:
+            raise ValueError("时间桶大小必须大于0")
+        start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+        if end_ms <= start_ms:
+            raise ValueError("结束时间必须晚于开始时间")
+        bucket_ms = bucket_seconds * 1000
+        if (end_ms - start_ms) // bucket_ms > MAX_QUERY_POINTS:
+            raise ValueError(f"时间桶数量超过上限 {MAX_QUERY_POINTS}，请增大时间桶或缩小时间范围")
+
+        # 对齐到时间桶边界，保证边界桶的数据完整
+        start_ms -= start_ms % bucket_ms
+        buckets: List[Dict[str, Any]] = []
+        raw_start_ms = start_ms
+
+        rollup_ms = ROLLUP_BUCKET_SECONDS * 1000
+        if bucket_ms % rollup_ms == 0:
+            last_rollup = db.execute(
+                select(func.max(TelemetryRollup.bucket_start)).where(
+                    TelemetryRollup.device_id == device_id,
+                    TelemetryRollup.metric == metric,
+                )
+            ).scalar()
+            if last_rollup is not None:
+                rolled_until = min(last_rollup + rollup_ms, end_ms)
+                if rolled_until > start_ms:
+                    buckets.extend(TelemetryService._aggregate_rollups(
+                        db, device_id, metric, start_ms, rolled_until, bucket_ms
+                    ))
+                    buckets.extend(TelemetryService._aggregate_raw(
+                        db, device_id, metric, start_ms, rolled_until, bucket_ms, dirty_only=True
+                    ))
+                    raw_start_ms = rolled_until
+
+        if raw_start_ms < end_ms:
+            buckets.extend(TelemetryService._aggregate_raw(
+                db, device_id, metric, raw_start_ms, end_ms, bucket_ms
+            ))
+
+        # 聚合数据与原始数据可能落在同一个时间桶内，需要合并
+        merged: Dict[int, Dict[str, Any]] = {}
+        for item in buckets:
+            current = merged.get(item["bucket"])
+            if current is None:
+                merged[item["bucket"]] = dict(item)
+            else:
+                current["count"] += item["count"]
+                current["min"] = min(current["min"], item["min"])
+                current["max"] = max(current["max"], item["max"])
+                current["sum"] += item["sum"]
+
+        return [
+            {
+                "ts": from_epoch_ms(bucket_start),
+                "count": item["count"],
+                "min": item["min"],
+                "max": item["max"],
+                "avg": item["sum"] / item["count"] if item["count"] else None,
+            }
+            for bucket_start, item in sorted(merged.items())
+        ]
+
+    @staticmethod
+    def rollup(db: Session, now: Optional[datetime] = None) -> int:
+        """
+        把已完成的待汇总时间桶从原始读数重新汇总到聚合表，返回写入的聚合行数
+        """
+        now_ms = to_epoch_ms(now or datetime.utcnow())
+        rollup_ms = ROLLUP_BUCKET_SECONDS * 1000
+        # 当前未结束的时间桶不汇总
+        cutoff_ms = now_ms - now_ms % rollup_ms
+
+        # 先认领待汇总的时间桶（多个进程同时汇总时各自只处理自己认领的），
+        # 认领之后写入的读数会清空认领标识，这些时间桶保留到下一次汇总
+        claim = uuid.uuid4().hex
+        claimed = db.execute(
+            update(TelemetryDirtyBucket)
+            .where(TelemetryDirtyBucket.bucket_start < cutoff_ms)
+            .values(claim=claim)
+        ).rowcount
+        if not claimed:
+            db.commit()
+            return 0
+
+        dirty = TelemetryDirtyBucket.__table__
+        reading = TelemetryReading.__table__
+        source = (
+            select(
+                dirty.c.device_id,
+                dirty.c.metric,
+                dirty.c.bucket_start,
+                func.count(reading.c.value),
+                func.min(reading.c.value),
+                func.max(reading.c.value),
+                func.sum(reading.c.value),
+            )
+            .select_from(dirty.join(
+                reading,
+                (reading.c.device_id == dirty.c.device_id)
+                & (reading.c.metric == dirty.c.metric)
+                & (reading.c.ts >= dirty.c.bucket_start)
+                & (reading.c.ts < dirty.c.bucket_start + rollup_ms),
+            ))
+            .where(dirty.c.claim == claim)
+            .group_by(dirty.c.device_id, dirty.c.metric, dirty.c.bucket_start)
+        )
+        rows = [
+            {
+                "device_id": row[0],
+                "metric": row[1],
+                "bucket_start": row[2],
+                "count": row[3],
+                "min_value": row[4],
+                "max_value": row[5],
+                "sum_value": row[6],
+            }
+            for row in db.execute(source).all()
+        ]
+        # 先删除认领的时间桶已有的聚合再重新写入，重复执行结果一致
+        db.execute(
+            delete(TelemetryRollup).where(
+                select(dirty.c.bucket_start).where(
+                    dirty.c.claim == claim,
+                    dirty.c.device_id == TelemetryRollup.device_id,
+                    dirty.c.metric == TelemetryRollup.metric,
+                    dirty.c.bucket_start == TelemetryRollup.bucket_start,
+                ).exists()
+            )
+        )
+        for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+            db.execute(insert(TelemetryRollup.__table__), rows[i:i + INSERT_CHUNK_SIZE])
+        db.execute(delete(TelemetryDirtyBucket).where(TelemetryDirtyBucket.claim == claim))
+        db.commit()
+        return len(rows)
+
+    @staticmethod
+    def apply_retention(db: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        执行汇总并删除过期数据
+        """
+        now = now or datetime.utcnow()
+        now_ms = to_epoch_ms(now)
+        rolled_up = TelemetryService.rollup(db, now)
+
+        # 按时间桶边界删除原始读数，避免已汇总的时间桶只剩部分原始数据
+        raw_cutoff_ms = now_ms - RAW_RETENTION_SECONDS * 1000
+        raw_cutoff_ms -= raw_cutoff_ms % (ROLLUP_BUCKET_SECONDS * 1000)
+        raw_deleted = db.execute(
+            delete(TelemetryReading).where(TelemetryReading.ts < raw_cutoff_ms)
+        ).rowcount
+        rollups_deleted = db.execute(
+            delete(TelemetryRollup).where(TelemetryRollup.bucket_start < now_ms - ROLLUP_RETENTION_SECONDS * 1000)
+        ).rowcount
+        db.commit()
+        return {
+            "rolled_up": rolled_up,
+            "raw_deleted": raw_deleted,
+            "rollups_deleted": rollups_deleted,
+        }
+
+    @staticmethod
+    def delete_device_telemetry(db: Session, device_id: int) -> None:
+        """
+        删除设备的全部遥测数据（不提交事务，由调用方提交）
+        """
+        TelemetryService.delete_devices_telemetry(db, [device_id])
+
+    @staticmethod
+    def delete_devices_telemetry(db: Session, device_ids: List[int]) -> None:
+        """
+        批量删除多个设备的全部遥测数据（不提交事务，由调用方提交）
+        """
+        if not device_ids:
+            return
+        db.execute(delete(TelemetryReading).where(TelemetryReading.device_id.in_(device_ids)))
+        db.execute(delete(TelemetryRollup).where(TelemetryRollup.device_id.in_(device_ids)))
+        db.execute(delete(TelemetryDirtyBucket).where(TelemetryDirtyBucket.device_id.in_(device_ids)))
+
+class TelemetryMaintenance:
+    """
+    遥测数据后台维护任务，定期执行汇总和过期清理
+    """
+
+    def __init__(self, interval: float = DEFAULT_MAINTENANCE_INTERVAL, session_factory=SessionLocal):
+        self.interval = interval
+        self.session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+
+    def run_once(self) -> Dict[str, int]:
+        """
+        执行一次汇总和清理
+        """
+        db = self.session_factory()
+        try:
+            return TelemetryService.apply_retention(db)
+        except Exception as e:
+            db.rollback()
+            print(f"遥测数据汇总失败: {str(e)}")
+            return {}
+        finally:
+            db.close()
+
+    async def _run(self) -> None:
+        """
+        后台维护循环
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(None, self.run_once)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """
+        启动后台维护任务（需在事件循环中调用）
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        停止后台维护任务
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# 全局遥测维护任务实例
+telemetry_maintenance = TelemetryMaintenance()
@@ -0,0 +1,225 @@
+# 云盘缩略图/预览图服务
+# 首次请求时才生成，图片解码和缩放在进程池中执行（CPU密集，不占用事件循环和线程池），
+# 结果按 (文件路径, 修改时间, 大小, 缩略图尺寸) 缓存在磁盘上，文件被修改后自动生成新的缩略图；
+# 缓存总大小超过上限时按最近访问时间（LRU）淘汰。
+# PDF首页预览需要安装PyMuPDF（可选），未安装时PDF不提供预览
+
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+# 缓存目录和缓存大小上限（字节），可通过环境变量修改
+THUMBNAIL_CACHE_DIR = Path(os.environ.get("CLOUD_THUMBNAIL_DIR", "cloud_thumbnails"))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get("CLOUD_THUMBNAIL_CACHE_MB", "512")) * 1024 * 1024
+# 允许的缩略图尺寸（长边像素），请求的尺寸向上取最接近的一档，避免缓存被任意尺寸撑满
+THUMBNAIL_SIZES = (128, 256, 512, 1024)
+DEFAULT_THUMBNAIL_SIZE = 256
+# 进程池大小
+THUMBNAIL_WORKERS = max(1, min(4, os.cpu_count() or 1))
+# 拒绝处理像素数过多的图片（防止解压炸弹）
+MAX_IMAGE_PIXELS = 200_000_000
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tif", ".tiff"}
+PDF_EXTENSIONS = {".pdf"}
+
+class ThumbnailError(Exception):
+    """
+    无法为文件生成缩略图（格式不支持或文件损坏）
+    """
+
+def _pdf_supported() -> bool:
+    try:
+        import fitz  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _render_image(source: str, size: int):
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    image = Image.open(source)
+    # JPEG可以在解码时直接缩小，大照片只需解码一小部分数据
+    image.draft("RGB", (size, size))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((size, size))
+    return image
+
+def _render_pdf(source: str, size: int):
+    import fitz
+    from PIL import Image
+
+    with fitz.open(source) as document:
+        page = document[0]
+        zoom = size / max(page.rect.width, page.rect.height)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+def render_thumbnail(source: str, destination: str, size: int, kind: str) -> int:
+    """
+    生成缩略图并写入目标文件（在子进程中执行），返回缩略图大小
+    """
+    from PIL import Image
+
+    temp = f"{destination}.{os.getpid()}.tmp"
+    try:
+        image = _render_pdf(source, size) if kind == "pdf" else _render_image(source, size)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        image.save(temp, format="WEBP", quality=80, method=4)
+    except Exception as e:
+        # 文件损坏、格式无法识别或像素过多
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise ThumbnailError(str(e))
+    os.replace(temp, destination)
+    return os.path.getsize(destination)
+
+class ThumbnailService:
+    """
+    缩略图生成与磁盘LRU缓存
+    """
+
+    media_type = "image/webp"
+
+    def __init__(self, cache_dir: Path = THUMBNAIL_CACHE_DIR, max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES,
+                 workers: int = THUMBNAIL_WORKERS):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 正在生成的缩略图，同一缩略图的并发请求共用一次生成
+        self._pending: Dict[str, asyncio.Future] = {}
+        # 缓存占用的字节数，首次使用时扫描缓存目录得到
+        self._cache_bytes: Optional[int] = None
+        self._evict_lock = threading.Lock()
+        self.pdf_supported = _pdf_supported()
+
+    def kind_of(self, path: Path) -> Optional[str]:
+        """
+        判断文件能否生成缩略图，返回 "image"/"pdf"，不支持时返回None
+        """
+        suffix = path.suffix.lower()
+        if suffix in IMAGE_EXTENSIONS:
+            return "image"
+        if suffix in PDF_EXTENSIONS and self.pdf_supported:
+            return "pdf"
+        return None
+
+    @staticmethod
+    def normalize_size(size: int) -> int:
+        for candidate in THUMBNAIL_SIZES:
+            if size <= candidate:
+                return candidate
+        return THUMBNAIL_SIZES[-1]
+
+    @staticmethod
+    def cache_key(path: Path, stat_result: os.stat_result, size: int) -> str:
+        """
+        缓存键：文件路径、修改时间、文件大小和缩略图尺寸，文件被修改后键随之变化
+        """
+        raw = f"{os.path.abspath(path)}\0{stat_result.st_mtime_ns}\0{stat_result.st_size}\0{size}"
+        return hashlib.sha1(raw.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def cache_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.webp"
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _touch(self, cached: Path) -> bool:
+        """
+        命中缓存时更新访问时间（LRU依据），缓存文件不存在时返回False
+        """
+        try:
+            os.utime(cached)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _scan_cache_bytes(self) -> int:
+        total = 0
+        for cached in self.cache_dir.glob("*/*.webp"):
+            try:
+                total += cached.stat().st_size
+            except OSError:
+                continue
+        return total
+
+    def _evict(self) -> int:
+        """
+        缓存超过上限时删除最久未访问的缩略图，直到降到上限的90%，返回删除的数量
+        """
+        with self._evict_lock:
+            if self._cache_bytes is None:
+                self._cache_bytes = self._scan_cache_bytes()
+            if self._cache_bytes <= self.max_bytes:
+                return 0
+            entries = []
+            for cached in self.cache_dir.glob("*/*.webp"):
+                try:
+                    stat_result = cached.stat()
+                except OSError:
+                    continue
+                entries.append((stat_result.st_mtime, stat_result.st_size, cached))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, size, cached in entries:
+                if total <= target:
+                    break
+                cached.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+            self._cache_bytes = total
+            return removed
+
+    async def _generate(self, source: Path, cached: Path, size: int, kind: str) -> None:
+        await run_in_threadpool(cached.parent.mkdir, parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        written = await loop.run_in_executor(
+            self._get_executor(), render_thumbnail, str(source), str(cached), size, kind
+        )
+        if self._cache_bytes is not None:
+            self._cache_bytes += written
+        await run_in_threadpool(self._evict)
+
+    async def get_thumbnail(self, source: Path, stat_result: os.stat_result, size: int) -> Tuple[Path, str]:
+        """
+        获取缩略图文件，缓存中没有时生成，返回 (缩略图路径, 缓存键)
+        格式不支持或文件无法解码时抛出 ThumbnailError
+        """
+        kind = self.kind_of(source)
+        if kind is None:
+            raise ThumbnailError("不支持预览的文件类型")
+        size = self.normalize_size(size)
+        key = self.cache_key(source, stat_result, size)
+        cached = self.cache_path(key)
+        if await run_in_threadpool(self._touch, cached):
+            return cached, key
+
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._generate(source, cached, size, kind))
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        # shield：某个请求断开不会取消其他请求共用的生成任务
+        await asyncio.shield(future)
+        return cached, key
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# 全局缩略图服务实例
+thumbnail_service = ThumbnailService()
@@ -0,0 +1,327 @@
+# 云盘分片上传服务（可断点续传）
+# 协议：创建上传会话 -> 按偏移量逐片PUT -> 完成后移动到目标目录
+# 分片直接以追加方式写入暂存文件，文件I/O交给线程执行，不阻塞事件循环；
+# 会话信息保存在暂存目录的JSON文件中，连接中断或服务重启后，客户端查询当前偏移量即可继续上传；
+# 开启去重存储时，接收分片的同时计算SHA-256，完成后按内容保存；
+# 未完成的会话按声明的文件大小预留配额（会话信息中记录所属的挂载路径，多个worker进程共享暂存目录）
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import anyio
+from starlette.concurrency import run_in_threadpool
+
+from app.services.blob_store import blob_store, hash_file, temp_path_for
+
+# 暂存目录，可通过环境变量修改
+UPLOAD_STAGING_DIR = Path(os.environ.get("CLOUD_UPLOAD_STAGING_DIR", "cloud_uploads"))
+# 建议的分片大小（字节），客户端可以使用其他大小
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+# 未完成的上传会话保留时间（秒）
+UPLOAD_EXPIRE_SECONDS = 24 * 3600
+
+class UploadOffsetMismatch(Exception):
+    """
+    分片偏移量与服务器已接收的字节数不一致
+    """
+
+    def __init__(self, offset: int):
+        super().__init__(f"偏移量不一致，服务器已接收 {offset} 字节")
+        self.offset = offset
+
+class ChunkedUploadManager:
+    """
+    分片上传会话管理
+    """
+
+    def __init__(self, staging_dir: Path = UPLOAD_STAGING_DIR, expire_seconds: float = UPLOAD_EXPIRE_SECONDS):
+        self.staging_dir = Path(staging_dir)
+        self.expire_seconds = expire_seconds
+        # 同一会话同时只允许一个分片写入
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # 边接收边计算的哈希 upload_id -> (哈希对象, 已计算的字节数)，服务重启后在完成时重新计算
+        self._hashers: Dict[str, Tuple[Any, int]] = {}
+
+    def _meta_path(self, upload_id: str) -> Path:
+        return self.staging_dir / f"{upload_id}.json"
+
+    def _part_path(self, upload_id: str) -> Path:
+        return self.staging_dir / f"{upload_id}.part"
+
+    def _lock(self, upload_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(upload_id, asyncio.Lock())
+
+    async def _save_meta(self, meta: Dict[str, Any]) -> None:
+        meta["updated_at"] = time.time()
+        await anyio.Path(self._meta_path(meta["upload_id"])).write_text(json.dumps(meta, ensure_ascii=False))
+
+    async def _load_meta(self, upload_id: str, user: str) -> Optional[Dict[str, Any]]:
+        """
+        读取会话信息，会话不存在或不属于该用户时返回None
+        """
+        # upload_id 由服务器生成，只接受十六进制字符，防止拼接出其他路径
+        if not upload_id or any(c not in "0123456789abcdef" for c in upload_id):
+            return None
+        meta_path = anyio.Path(self._meta_path(upload_id))
+        if not await meta_path.exists():
+            return None
+        meta = json.loads(await meta_path.read_text())
+        if meta.get("user") != user:
+            return None
+        return meta
+
+    async def _received(self, upload_id: str) -> int:
+        """
+        已接收的字节数，以暂存文件的实际大小为准
+        """
+        part_path = anyio.Path(self._part_path(upload_id))
+        if not await part_path.exists():
+            return 0
+        return (await part_path.stat()).st_size
+
+    def _status(self, meta: Dict[str, Any], offset: int) -> Dict[str, Any]:
+        return {
+            "upload_id": meta["upload_id"],
+            "filename": meta["filename"],
+            "path": meta["path"],
+            "size": meta["size"],
+            "offset": offset,
+            "chunk_size": DEFAULT_CHUNK_SIZE,
+            "completed": offset >= meta["size"],
+        }
+
+    async def create(
+        self, user: str, target_dir: Path, relative_dir: str, filename: str, size: int, sha256: Optional[str] = None,
+        root: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        创建上传会话
+        target_dir 为已校验过的目标目录绝对路径，relative_dir 为相对挂载路径的目录（用于展示和跳转），
+        root 为挂载路径，会话完成或取消之前按 size 为其预留配额（见 reserved_bytes）
+        开启去重存储且sha256对应的内容已存在时直接完成（秒传），返回的upload_id为None
+        """
+        name = Path(filename.replace("\\", "/")).name
+        if not name or name in (".", ".."):
+            raise ValueError("无效的文件名")
+        if size < 0:
+            raise ValueError("文件大小不能为负数")
+        if sha256 is not None:
+            sha256 = sha256.lower()
+
+        if blob_store.enabled and sha256:
+            linked = await blob_store.link_existing(sha256, size, target_dir / name)
+            if linked is not None:
+                return {
+                    "upload_id": None,
+                    "filename": name,
+                    "path": relative_dir,
+                    "size": size,
+                    "offset": size,
+                    "chunk_size": DEFAULT_CHUNK_SIZE,
+                    "completed": True,
+                    "file": linked["file"],
+                    "deduplicated": True,
+                }
+
+        await anyio.Path(self.staging_dir).mkdir(parents=True, exist_ok=True)
+        await self.cleanup_expired()
+
+        meta = {
+            "upload_id": uuid.uuid4().hex,
+            "user": user,
+            "filename": name,
+            "path": relative_dir,
+            "target_dir": str(target_dir),
+            "size": size,
+            "sha256": sha256,
+            "root": root,
+            "created_at": time.time(),
+        }
+        await anyio.Path(self._part_path(meta["upload_id"])).touch()
+        await self._save_meta(meta)
+        return self._status(meta, 0)
+
+    async def get_status(self, upload_id: str, user: str) -> Optional[Dict[str, Any]]:
+        """
+        查询上传进度，客户端断线后据此确定续传的偏移量
+        """
+        meta = await self._load_meta(upload_id, user)
+        if meta is None:
+            return None
+        return self._status(meta, await self._received(upload_id))
+
+    async def write_chunk(
+        self, upload_id: str, user: str, offset: int, chunks: AsyncIterator[bytes]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        从指定偏移量写入一个分片，边接收边写入暂存文件
+        偏移量必须等于已接收的字节数，否则抛出 UploadOffsetMismatch；
+        连接中途断开时，已写入的部分会保留，下次从新的偏移量继续
+        """
+        meta = await self._load_meta(upload_id, user)
+        if meta is None:
+            return None
+
+        lock = self._lock(upload_id)
+        if lock.locked():
+            raise UploadOffsetMismatch(await self._received(upload_id))
+        async with lock:
+            received = await self._received(upload_id)
+            if offset != received:
+                raise UploadOffsetMismatch(received)
+
+            hasher = None
+            if blob_store.enabled:
+                hasher, hashed = self._hashers.get(upload_id, (None, 0))
+                if hasher is None and received == 0:
+                    hasher, hashed = hashlib.sha256(), 0
+                if hashed != received:
+                    # 哈希状态与已接收的数据对不上（例如服务重启过），完成时重新计算
+                    hasher = None
+                    self._hashers.pop(upload_id, None)
+
+            part_path = self._part_path(upload_id)
+            async with await anyio.open_file(part_path, "ab") as part_file:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if received + len(chunk) > meta["size"]:
+                        chunk = chunk[:meta["size"] - received]
+                        await part_file.write(chunk)
+                        self._track_hash(upload_id, hasher, chunk, received + len(chunk))
+                        raise ValueError(f"上传数据超过声明的文件大小 {meta['size']} 字节")
+                    await part_file.write(chunk)
+                    received += len(chunk)
+                    self._track_hash(upload_id, hasher, chunk, received)
+
+            await self._save_meta(meta)
+            return self._status(meta, received)
+
+    def _track_hash(self, upload_id: str, hasher: Any, chunk: bytes, received: int) -> None:
+        """
+        数据写入暂存文件后再更新哈希，保证哈希与文件内容一致
+        """
+        if hasher is not None:
+            hasher.update(chunk)
+            self._hashers[upload_id] = (hasher, received)
+
+    async def _digest(self, upload_id: str, received: int) -> str:
+        hasher, hashed = self._hashers.pop(upload_id, (None, 0))
+        if hasher is not None and hashed == received:
+            return hasher.hexdigest()
+        return await run_in_threadpool(hash_file, self._part_path(upload_id))
+
+    async def complete(self, upload_id: str, user: str) -> Optional[Dict[str, Any]]:
+        """
+        完成上传，把暂存文件移动到目标目录
+        开启去重存储时按内容保存，内容已存在则不占用额外空间
+        """
+        meta = await self._load_meta(upload_id, user)
+        if meta is None:
+            return None
+
+        async with self._lock(upload_id):
+            received = await self._received(upload_id)
+            if received != meta["size"]:
+                raise UploadOffsetMismatch(received)
+
+            target_dir = Path(meta["target_dir"])
+            target = target_dir / meta["filename"]
+
+            if blob_store.enabled:
+                digest = await self._digest(upload_id, received)
+                if meta.get("sha256") and meta["sha256"] != digest:
+                    raise ValueError("文件内容与声明的SHA-256不一致")
+                stored = await blob_store.ingest(self._part_path(upload_id), digest, received, target)
+                await run_in_threadpool(self._meta_path(upload_id).unlink, True)
+                self._locks.pop(upload_id, None)
+                return {**self._status(meta, received), "completed": True, "file": str(target),
+                        "deduplicated": stored["deduplicated"]}
+
+            def _move():
+                target_dir.mkdir(parents=True, exist_ok=True)
+                # 先移动到目标目录下的临时文件（跨文件系统时退化为复制），再原子替换同名文件，
+                # 不会原地覆盖同名文件的内容（可能是共享inode的去重文件）
+                temp = temp_path_for(target)
+                try:
+                    shutil.move(str(self._part_path(upload_id)), str(temp))
+                except BaseException:
+                    temp.unlink(missing_ok=True)
+                    raise
+                try:
+                    os.replace(temp, target)
+                except OSError:
+                    # 放回暂存文件，客户端可以重试完成上传
+                    shutil.move(str(temp), str(self._part_path(upload_id)))
+                    raise
+                self._meta_path(upload_id).unlink(missing_ok=True)
+
+            await run_in_threadpool(_move)
+        self._locks.pop(upload_id, None)
+        return {**self._status(meta, received), "completed": True, "file": str(target)}
+
+    async def abort(self, upload_id: str, user: str) -> bool:
+        """
+        取消上传并删除暂存文件
+        """
+        meta = await self._load_meta(upload_id, user)
+        if meta is None:
+            return False
+        async with self._lock(upload_id):
+            await run_in_threadpool(self._remove, upload_id)
+        self._locks.pop(upload_id, None)
+        return True
+
+    def _remove(self, upload_id: str) -> None:
+        self._hashers.pop(upload_id, None)
+        self._part_path(upload_id).unlink(missing_ok=True)
+        self._meta_path(upload_id).unlink(missing_ok=True)
+
+    def _reserved_bytes(self, root: str, exclude: Optional[str]) -> int:
+        reserved = 0
+        for meta_path in self.staging_dir.glob("*.json"):
+            if meta_path.stem == exclude:
+                continue
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (OSError, ValueError):
+                continue
+            if meta.get("root") == root:
+                reserved += meta.get("size", 0)
+        return reserved
+
+    async def reserved_bytes(self, root: str, exclude: Optional[str] = None) -> int:
+        """
+        挂载路径下未完成的上传会话预留的字节数（按声明的文件大小），exclude 为不计入的会话
+        """
+        if not await anyio.Path(self.staging_dir).exists():
+            return 0
+        return await run_in_threadpool(self._reserved_bytes, root, exclude)
+
+    async def cleanup_expired(self) -> int:
+        """
+        删除长时间没有更新的上传会话
+        """
+        def _cleanup() -> int:
+            deadline = time.time() - self.expire_seconds
+            removed = 0
+            for meta_path in self.staging_dir.glob("*.json"):
+                try:
+                    if meta_path.stat().st_mtime < deadline:
+                        self._remove(meta_path.stem)
+                        removed += 1
+                except OSError:
+                    continue
+            return removed
+
+        return await run_in_threadpool(_cleanup)
+
+# 全局分片上传管理实例
+upload_manager = ChunkedUploadManager()
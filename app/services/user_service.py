@@ -1,8 +1,10 @@
 # 用户服务层
 
+from typing import List, Optional, Tuple
 from sqlalchemy.orm import Session
 from app.models.user import User
 from app.schemas.user import UserCreate, UserUpdate
+from app.services.pagination import paginate
 from passlib.context import CryptContext
 
 # 密码加密上下文
@@ -38,11 +40,12 @@ def get_user_by_email(db: Session, email: str):
     """
     return db.query(User).filter(User.email == email).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
+def get_users(db: Session, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[User], Optional[str]]:
     """
-    获取用户列表
+    获取用户列表（游标分页）
+    返回 (用户列表, 下一页游标)
     """
-    return db.query(User).offset(skip).limit(limit).all()
+    return paginate(db.query(User), User.id, cursor, limit)
 
 def create_user(db: Session, user: UserCreate):
     """
@@ -53,7 +56,8 @@ def create_user(db: Session, user: UserCreate):
         email=user.email,
         full_name=user.full_name,
         hashed_password=get_password_hash(user.password),
-        disabled=user.disabled
+        disabled=user.disabled,
+        storage_quota=user.storage_quota
     )
     db.add(db_user)
     db.commit()
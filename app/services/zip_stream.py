@@ -0,0 +1,104 @@
+# 流式ZIP打包下载
+# 边读取文件边生成ZIP数据并立即发送，不在内存或磁盘上生成完整的压缩包：
+# zipfile写入不可seek的缓冲对象时会使用数据描述符（data descriptor）记录CRC和大小，
+# 每写入一块就把缓冲区中的字节交给响应，内存占用与文件夹大小无关。
+# 已经压缩过的格式（图片、视频、压缩包等）使用存储模式，避免无意义的CPU消耗
+
+import io
+import os
+import zipfile
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from app.services.directory_index import SYSTEM_RESERVED
+
+# 每次读取的块大小
+ZIP_CHUNK_SIZE = 256 * 1024
+# 这些格式本身已经压缩，再次压缩几乎没有收益，直接存储
+STORED_EXTENSIONS = {
+    ".zip", ".rar", ".7z", ".gz", ".tgz", ".bz2", ".xz", ".zst",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+    ".mp3", ".aac", ".ogg", ".flac", ".m4a",
+    ".mp4", ".mkv", ".mov", ".avi", ".webm",
+    ".docx", ".xlsx", ".pptx", ".apk", ".jar", ".iso",
+}
+
+class _StreamBuffer(io.RawIOBase):
+    """
+    只追加、不可seek的写入缓冲区，取出后清空
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def pending(self) -> int:
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def compress_type_for(name: str) -> int:
+    """
+    根据扩展名选择压缩方式
+    """
+    if Path(name).suffix.lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def collect_entries(paths: List[Path]) -> Iterator[Tuple[Path, str]]:
+    """
+    展开待打包的文件和文件夹，返回 (文件绝对路径, 压缩包内路径)
+    每个选中项以自己的名称作为压缩包内的顶层目录/文件，文件夹递归展开（不跟随符号链接）
+    """
+    for path in paths:
+        if path.is_file():
+            yield path, path.name
+            continue
+        for current, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d not in SYSTEM_RESERVED)
+            relative = Path(current).relative_to(path.parent).as_posix()
+            yield Path(current), relative + "/"
+            for name in sorted(files):
+                if name not in SYSTEM_RESERVED:
+                    yield Path(current) / name, f"{relative}/{name}"
+
+def stream_zip(paths: List[Path]) -> Iterator[bytes]:
+    """
+    生成ZIP数据流（同步生成器，由StreamingResponse在线程池中迭代）
+    无法读取的文件会被跳过
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", allowZip64=True) as archive:
+        for source, arcname in collect_entries(paths):
+            try:
+                info = zipfile.ZipInfo.from_file(source, arcname, strict_timestamps=False)
+                if info.is_dir():
+                    archive.writestr(info, b"")
+                    continue
+                info.compress_type = compress_type_for(arcname)
+                with open(source, "rb") as src, archive.open(info, mode="w", force_zip64=True) as dest:
+                    while chunk := src.read(ZIP_CHUNK_SIZE):
+                        dest.write(chunk)
+                        if buffer.pending() >= ZIP_CHUNK_SIZE:
+                            yield buffer.pop()
+            except OSError as e:
+                print(f"打包时跳过文件 {source}: {str(e)}")
+                continue
+            if buffer.pending():
+                yield buffer.pop()
+    # 写入中央目录
+    yield buffer.pop()
@@ -0,0 +1,120 @@
+# BLE连接池：容量上限与LRU淘汰、并发连接合并、断开后按退避重连、多次失败后移除
+# 使用 tool/fake_bleak 中的模拟客户端，不需要蓝牙适配器
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "tool" / "fake_bleak"))
+
+from fake_bleak import FakeBleBackend  # noqa: E402
+
+from app.services import ble_connections  # noqa: E402
+from app.services.ble_connections import (  # noqa: E402
+    CONNECTION_RECONNECTING, MAX_RECONNECT_ATTEMPTS, BleConnectionPool, ConnectionPoolFull
+)
+
+def _pool(backend: FakeBleBackend, **kwargs) -> BleConnectionPool:
+    pool = BleConnectionPool(client_factory=backend.client, idle_timeout=0, **kwargs)
+    # 不启动后台检查任务，由测试直接调用 check()
+    pool.start = lambda: None
+    return pool
+
+def test_evicts_least_recently_used_connection_at_capacity():
+    async def scenario():
+        backend = FakeBleBackend()
+        pool = _pool(backend, max_connections=2)
+        await pool.connect("A")
+        await pool.connect("B")
+        # 使用A之后，B成为最久未使用的连接
+        async with pool.acquire("A"):
+            pass
+        await pool.connect("C")
+        assert [conn["device"]["id"] for conn in pool.list_connections()] == ["C", "A"]
+        assert not backend.clients["B"].is_connected
+
+    asyncio.run(scenario())
+
+def test_pool_full_when_all_connections_in_use():
+    async def scenario():
+        backend = FakeBleBackend()
+        pool = _pool(backend, max_connections=1)
+        await pool.connect("A")
+        async with pool.acquire("A"):
+            with pytest.raises(ConnectionPoolFull):
+                await pool.connect("B")
+        assert pool.get("A").is_connected
+
+    asyncio.run(scenario())
+
+def test_concurrent_connects_share_one_connection():
+    async def scenario():
+        backend = FakeBleBackend(connect_delay=0.05)
+        pool = _pool(backend)
+        connections = await asyncio.gather(*(pool.connect("A") for _ in range(5)))
+        assert backend.connect_calls["A"] == 1
+        assert all(conn is connections[0] for conn in connections)
+
+    asyncio.run(scenario())
+
+def test_dropped_connection_reconnects_with_backoff():
+    async def scenario():
+        backend = FakeBleBackend()
+        pool = _pool(backend)
+        reconnected = []
+
+        async def on_reconnected(conn):
+            reconnected.append(conn.address)
+
+        pool.add_listener("reconnected", on_reconnected)
+        conn = await pool.connect("A")
+        backend.fail("A")
+        backend.drop("A")
+        assert conn.state == CONNECTION_RECONNECTING
+
+        delays = []
+        for attempt in range(1, 4):
+            await pool.check()
+            assert conn.reconnect_attempts == attempt
+            delays.append(round(conn.next_retry - ble_connections.time.monotonic()))
+            # 未到重试时间时不会再次连接
+            calls = backend.connect_calls["A"]
+            await pool.check()
+            assert backend.connect_calls["A"] == calls
+            conn.next_retry = 0.0
+        assert delays == [1, 2, 4]
+
+        backend.fail("A", False)
+        await pool.check()
+        assert conn.is_connected
+        assert conn.reconnect_attempts == 0
+        assert pool.get("A") is conn
+        assert reconnected == ["A"]
+
+    asyncio.run(scenario())
+
+def test_connection_removed_after_max_reconnect_attempts():
+    async def scenario():
+        backend = FakeBleBackend()
+        pool = _pool(backend)
+        closed = []
+
+        async def on_closed(conn):
+            closed.append(conn.address)
+
+        pool.add_listener("closed", on_closed)
+        conn = await pool.connect("A")
+        backend.fail("A")
+        backend.drop("A")
+        for _ in range(MAX_RECONNECT_ATTEMPTS):
+            assert pool.get("A") is conn
+            await pool.check()
+            conn.next_retry = 0.0
+        assert pool.get("A") is None
+        assert closed == ["A"]
+        # 初次连接 + 每次重连尝试
+        assert backend.connect_calls["A"] == 1 + MAX_RECONNECT_ATTEMPTS
+
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+# 设备列表查询的SQL语句数量
+# 列表页与序列化（含嵌套的设备类型）的语句数量固定，不随设备数量增长（没有N+1查询）
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database.database import Base
+from app.models.device import Device, DeviceType
+from app.services.device_service import DeviceService, device_type_cache
+
+DEVICE_TYPE_COUNT = 20
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'devices.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([DeviceType(name=f"type-{i}", description="测试类型") for i in range(DEVICE_TYPE_COUNT)])
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+def _add_devices(db, count):
+    type_ids = [device_type.id for device_type in db.query(DeviceType).order_by(DeviceType.id)]
+    db.add_all([
+        Device(name=f"device-{i}", device_id=f"DEV-{i:04d}", device_type_id=type_ids[i % len(type_ids)])
+        for i in range(count)
+    ])
+    db.commit()
+    # 清空会话和缓存，计数时从数据库读取
+    db.expunge_all()
+    device_type_cache.clear()
+
+class StatementCounter:
+    """
+    统计引擎执行的SQL语句
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+@pytest.mark.parametrize("count", [1, 10, 100])
+def test_get_devices_statement_count_is_constant(db, count):
+    _add_devices(db, count)
+    with StatementCounter(db.get_bind()) as counter:
+        devices, _ = DeviceService.get_devices(db, limit=count)
+        items = DeviceService.serialize_devices(db, devices)
+    assert len(items) == count
+    assert all(item["device_type"]["name"].startswith("type-") for item in items)
+    # 一条分页查询 + 一条设备类型 IN 查询
+    assert len(counter.statements) == 2, counter.statements
+
+@pytest.mark.parametrize("count", [1, 10, 100])
+def test_get_devices_by_type_statement_count_is_constant(db, count):
+    _add_devices(db, count * DEVICE_TYPE_COUNT)
+    device_type_id = db.query(DeviceType.id).order_by(DeviceType.id).limit(1).scalar()
+    with StatementCounter(db.get_bind()) as counter:
+        devices, _ = DeviceService.get_devices_by_type(db, device_type_id, limit=count)
+        items = DeviceService.serialize_devices(db, devices)
+    assert len(items) == count
+    assert {item["device_type_id"] for item in items} == {device_type_id}
+    assert len(counter.statements) == 2, counter.statements
@@ -0,0 +1,62 @@
+# 设备心跳批量写入：只更新、发布和清除缓存存在的设备，不存在的设备的心跳被丢弃
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database.database import Base
+from app.models.device import Device, DeviceType
+from app.schemas.device import DeviceHeartbeat
+from app.services import heartbeat_service
+from app.services.heartbeat_service import HeartbeatBuffer
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'heartbeat.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    device_type = DeviceType(name="sensor")
+    session.add(device_type)
+    session.flush()
+    session.add_all([
+        Device(name=f"device-{i}", device_id=f"DEV-{i}", device_type_id=device_type.id, status="offline", is_online=False)
+        for i in range(2)
+    ])
+    session.commit()
+    session.close()
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+
+def test_flush_skips_unknown_devices(engine, monkeypatch):
+    published = []
+    invalidated = []
+    monkeypatch.setattr(heartbeat_service.device_event_hub, "publish",
+                        lambda event_type, **fields: published.append((event_type, fields["device_id"])))
+    monkeypatch.setattr(heartbeat_service, "invalidate_device_cache", lambda *ids: invalidated.extend(ids))
+
+    buffer = HeartbeatBuffer(engine=engine)
+    buffer.add([
+        DeviceHeartbeat(device_id=device_id, status="online")
+        for device_id in ("DEV-0", "DEV-1", "MISSING-1", "MISSING-2")
+    ])
+    assert buffer.flush() == 2
+    assert sorted(published) == [("device.patched", "DEV-0"), ("device.patched", "DEV-1")]
+    assert sorted(invalidated) == ["DEV-0", "DEV-1"]
+    assert buffer.unknown_devices == 2
+    assert buffer.pending_count == 0
+
+    session = sessionmaker(bind=engine)()
+    assert {device.device_id: device.is_online for device in session.query(Device)} == {"DEV-0": True, "DEV-1": True}
+    session.close()
+
+def test_flush_with_only_unknown_devices_publishes_nothing(engine, monkeypatch):
+    published = []
+    monkeypatch.setattr(heartbeat_service.device_event_hub, "publish", lambda event_type, **fields: published.append(fields))
+
+    buffer = HeartbeatBuffer(engine=engine)
+    buffer.add([DeviceHeartbeat(device_id="MISSING", status="online")])
+    assert buffer.flush() == 0
+    assert published == []
+    assert buffer.unknown_devices == 1
@@ -0,0 +1,108 @@
+# 模拟的 Bleak 客户端，用于在没有蓝牙适配器的环境中调试和测试BLE连接池
+# 用法：
+#   backend = FakeBleBackend()
+#   pool = BleConnectionPool(client_factory=backend.client)
+#   backend.drop(address)          模拟设备意外断开（触发bleak的断开回调）
+#   backend.fail(address)          之后该设备的连接请求失败，backend.fail(address, False) 恢复
+#   backend.connect_calls[address] 该设备被请求连接的次数
+# connect_delay 模拟建立连接的耗时，用于检查并发连接是否被合并
+
+import asyncio
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from bleak.exc import BleakError
+
+class FakeBleakClient:
+    """
+    与 BleakClient 接口相同的模拟客户端（连接、断开、通知和写入特征值）
+    """
+
+    def __init__(self, backend: "FakeBleBackend", address: str,
+                 disconnected_callback: Optional[Callable[["FakeBleakClient"], None]] = None, **kwargs: Any):
+        self.backend = backend
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.services: List[Any] = []
+        self.notifications: Dict[Any, Callable[..., Any]] = {}
+        self.writes: List[tuple] = []
+
+    async def connect(self, timeout: float = 10.0, **kwargs: Any) -> bool:
+        self.backend.connect_calls[self.address] += 1
+        if self.backend.connect_delay:
+            await asyncio.sleep(self.backend.connect_delay)
+        if self.address in self.backend.failing:
+            raise BleakError(f"Device with address {self.address} was not found.")
+        self.is_connected = True
+        self.backend.clients[self.address] = self
+        return True
+
+    async def disconnect(self) -> bool:
+        # 主动断开同样会触发回调，与bleak一致
+        self._lost()
+        return True
+
+    def _lost(self) -> None:
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        self.notifications.clear()
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    async def start_notify(self, characteristic: Any, callback: Callable[..., Any], **kwargs: Any) -> None:
+        if not self.is_connected:
+            raise BleakError("Not connected")
+        self.notifications[characteristic] = callback
+
+    async def stop_notify(self, characteristic: Any) -> None:
+        self.notifications.pop(characteristic, None)
+
+    async def write_gatt_char(self, characteristic: Any, data: Any, response: Optional[bool] = None) -> None:
+        if not self.is_connected:
+            raise BleakError("Not connected")
+        self.writes.append((characteristic, bytes(data), response))
+
+class FakeBleBackend:
+    """
+    模拟的蓝牙适配器，记录连接请求，可以让设备断开或连接失败
+    """
+
+    def __init__(self, connect_delay: float = 0.0):
+        self.connect_delay = connect_delay
+        self.connect_calls: Counter = Counter()
+        self.failing: Set[str] = set()
+        # 地址 -> 最近一次连接成功的客户端
+        self.clients: Dict[str, FakeBleakClient] = {}
+
+    def client(self, address: str, **kwargs: Any) -> FakeBleakClient:
+        """
+        客户端工厂，作为 BleConnectionPool 的 client_factory
+        """
+        return FakeBleakClient(self, address, **kwargs)
+
+    def fail(self, address: str, enabled: bool = True) -> None:
+        """
+        让设备的连接请求失败（设备不在范围内）
+        """
+        if enabled:
+            self.failing.add(address)
+        else:
+            self.failing.discard(address)
+
+    def drop(self, address: str) -> None:
+        """
+        模拟设备意外断开
+        """
+        client = self.clients.get(address)
+        if client is not None:
+            client._lost()
+
+    def notify(self, address: str, characteristic: Any, data: bytes) -> None:
+        """
+        模拟设备发送通知
+        """
+        client = self.clients.get(address)
+        if client is not None and characteristic in client.notifications:
+            client.notifications[characteristic](characteristic, bytearray(data))